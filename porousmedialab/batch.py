@@ -4,7 +4,6 @@ pH equlibrium simulations
 import numpy as np
 import porousmedialab.phcalc as phcalc
 import porousmedialab.plotter as plotter
-from porousmedialab.dotdict import DotDict
 from porousmedialab.lab import Lab
 
 
@@ -23,14 +22,31 @@ class Batch(Lab):
         plot_rates (TYPE): Description
     """
 
-    def __init__(self, tend, dt):
+    def __init__(self,
+                 tend,
+                 dt,
+                 save_every=1,
+                 output_times=None,
+                 storage='memory',
+                 scratch_dir=None):
         """Summary
 
         Args:
             tend (TYPE): Description
             dt (TYPE): Description
+            save_every (int): save results every k-th time step
+            output_times (np.array): times when results are saved,
+            overrides save_every
+            storage (str): storage of results: 'memory' or 'memmap'
+            scratch_dir (str): folder for memmap files
         """
-        super().__init__(tend, dt)
+        super().__init__(
+            tend,
+            dt,
+            save_every=save_every,
+            output_times=output_times,
+            storage=storage,
+            scratch_dir=scratch_dir)
         self.N = 1
 
     def add_species(self, name, init_conc):
@@ -40,15 +56,17 @@ class Batch(Lab):
             name (string): name of the element
             init_conc (float): initial concentration
         """
-        self.species[name] = DotDict({})
+        self.species[name] = self.profiles.add(name, self.N)
         self.species[name]['init_conc'] = init_conc
-        self.species[name]['concentration'] = np.zeros((self.N,
-                                                           self.time.size))
-        self.species[name]['alpha'] = np.zeros((self.N, self.time.size))
-        self.species[name]['rates'] = np.zeros((self.N, self.time.size))
+        self.species[name]['concentration'] = self.allocate_results_array(
+            'concentration/' + name)
+        self.species[name]['alpha'] = self.allocate_results_array(
+            'alpha/' + name)
+        self.species[name]['rates'] = self.allocate_results_array(
+            'rates/' + name)
         self.species[name]['concentration'][:, 0] = self.species[name][
             'init_conc']
-        self.profiles[name] = self.species[name]['concentration'][:, 0]
+        self.profiles[name] = self.species[name]['concentration'][:, 0].copy()
         self.species[name]['int_transport'] = False
         self.dcdt[name] = '0'
 
@@ -60,11 +78,17 @@ class Batch(Lab):
         """
         if i == 1:
             self.pre_run_methods()
-        self.reactions_integrate_scipy(i)
-        if self.henry_law_equations:
-            self.henry_equilibrium_integrate(i)
-        if self.acid_base_components:
-            self.acid_base_equilibrium_solve(i)
+        if self.equilibria_coupled():
+            self.reactions_integrate_coupled(i)
+            if self.acid_base_components:
+                self.acid_base_update_concentrations(i)
+        else:
+            self.reactions_integrate_scipy(i)
+            if self.henry_law_equations or self.mass_action_equilibria:
+                self.equilibrium_integrate(i)
+            if self.acid_base_components:
+                self.acid_base_equilibrium_solve(i)
+        self.save_profiles(i)
 
     def add_time_variable(self):
         """Temporal hack of adding time variable with dctdt=1
@@ -80,6 +104,8 @@ class Batch(Lab):
         self.add_species(name='pH', init_conc=7)
         self.acid_base_system = phcalc.System(
             *[c['pH_object'] for c in self.acid_base_components])
+        if self.pH_tables:
+            self.acid_base_system.build_tables()
 
     def acid_base_update_concentrations(self, i):
         """Summary
@@ -87,20 +113,24 @@ class Batch(Lab):
         Args:
             i (TYPE): Description
         """
+        j = self.output_column[i]
         for component in self.acid_base_components:
             init_conc = 0
+            # fractions are written in the buffer of the component
+            if 'alphas' not in component:
+                component['alphas'] = np.empty(
+                    np.shape(self.profiles['pH']) +
+                    (len(component['species']), ))
             alphas = component['pH_object'].alpha(
-                self.species['pH']['concentration'][:, i])
+                self.profiles['pH'], out=component['alphas'])
             for idx in range(len(component['species'])):
-                init_conc += self.species[component['species'][idx]][
-                    'concentration'][:, i]
+                init_conc += self.profiles[component['species'][idx]]
             for idx in range(len(component['species'])):
-                self.species[component['species'][idx]][
-                    'concentration'][:, i] = init_conc * alphas[idx]
-                self.profiles[component['species'][idx]] = self.species[
-                    component['species'][idx]]['concentration'][:, i]
-                self.species[component['species'][idx]]['alpha'][:, i] = alphas[
-                    idx]
+                self.profiles[component['species']
+                              [idx]] = init_conc * alphas[idx]
+                if j >= 0:
+                    self.species[component['species'][idx]]['alpha'][:, j] = alphas[
+                        idx]
 
     plot = plotter.plot_depth_index
     plot_profiles = plotter.all_plot_depth_index
@@ -86,7 +86,8 @@ class Calibrator:
         err = 0
         for m in self.measurements:
             idxs = find_indexes_of_intersections(
-                self.lab.time, self.measurements[m]['time'], self.lab.dt / 2)
+                self.lab.output_time, self.measurements[m]['time'],
+                self.lab.dt / 2)
             err += metric_fun(self.lab.species[m]['concentration'][:, idxs],
                               self.measurements[m]['values'])
         if disp:
@@ -3,15 +3,25 @@ import numpy as np
 import porousmedialab.desolver as desolver
 import porousmedialab.phcalc as phcalc
 import porousmedialab.plotter as plotter
-from porousmedialab.dotdict import DotDict
-from porousmedialab.lab import Lab
+from porousmedialab.lab import Lab, Profiles
 
 
 class Column(Lab):
     """Column module solves Advection-Diffusion-Reaction Equation
     in porous media"""
 
-    def __init__(self, length, dx, tend, dt, w=0, ode_method='scipy'):
+    def __init__(self,
+                 length,
+                 dx,
+                 tend,
+                 dt,
+                 w=0,
+                 ode_method='scipy',
+                 transport_solver='banded',
+                 save_every=1,
+                 output_times=None,
+                 storage='memory',
+                 scratch_dir=None):
         """ initializing the domain of the column model
 
         Arguments:
@@ -22,16 +32,36 @@ class Column(Lab):
 
         Keyword Arguments:
             w {float} -- default advective flux for all species (default: {0})
-            ode_method {str} -- method to solve ode (default: {'rk4'})
+            ode_method {str} -- method to solve ode: 'scipy' (LSODA),
+            'rk4', 'butcher5', 'dopri5' (adaptive Dormand-Prince),
+            'implicit' (implicit Euler) or 'bdf2' (TR-BDF2)
+            (default: {'scipy'})
+            transport_solver {str} -- linear solver for transport: 'banded'
+            (tridiagonal LU) or 'sparse' (sparse LU) (default: {'banded'})
+            save_every {int} -- save results every k-th time step
+            (default: {1})
+            output_times {np.array} -- times when results are saved,
+            overrides save_every (default: {None})
+            storage {str} -- storage of results: 'memory' or 'memmap'
+            (default: {'memory'})
+            scratch_dir {str} -- folder for memmap files (default: {None})
         """
         # ne.set_num_threads(ne.detect_number_of_cores())
-        super().__init__(tend, dt)
-        self.x = np.linspace(0, length, length / dx + 1)
+        super().__init__(
+            tend,
+            dt,
+            save_every=save_every,
+            output_times=output_times,
+            storage=storage,
+            scratch_dir=scratch_dir)
+        self.x = np.linspace(0, length, round(length / dx) + 1)
         self.N = self.x.size
         self.length = length
         self.dx = dx
         self.w = w
         self.ode_method = ode_method
+        self.transport_solver = transport_solver
+        self.transport_groups = {}
 
     def add_species(self,
                     theta,
@@ -61,7 +91,7 @@ class Column(Lab):
             w {float} -- advective term for this element (default: {False})
             int_transport {bool} -- integrate transport? (default: {True})
         """
-        self.species[name] = DotDict({})
+        self.species[name] = self.profiles.add(name, self.N)
         self.species[name]['bc_top_value'] = bc_top_value
         self.species[name]['bc_top_type'] = bc_top_type.lower()
         self.species[name]['bc_bot_value'] = bc_bot_value
@@ -69,12 +99,11 @@ class Column(Lab):
         self.species[name]['theta'] = np.ones((self.N)) * theta
         self.species[name]['D'] = D
         self.species[name]['init_conc'] = init_conc
-        self.species[name]['concentration'] = np.zeros((self.N,
-                                                           self.time.size))
-        self.species[name]['rates'] = np.zeros((self.N, self.time.size))
-        self.species[name]['concentration'][:, 0] = self.species[name][
-            'init_conc']
-        self.profiles[name] = self.species[name]['concentration'][:, 0]
+        self.species[name]['concentration'] = self.allocate_results_array(
+            'concentration/' + name)
+        self.species[name]['rates'] = self.allocate_results_array(
+            'rates/' + name)
+        self.profiles[name] = np.ones((self.N)) * init_conc
         if w:
             self.species[name]['w'] = w
         else:
@@ -83,6 +112,7 @@ class Column(Lab):
         if int_transport:
             self.template_AL_AR(name)
             self.update_matrices_due_to_bc(name, 0)
+        self.species[name]['concentration'][:, 0] = self.profiles[name]
         self.dcdt[name] = '0'
 
     def save_final_profiles(self):
@@ -102,10 +132,10 @@ class Column(Lab):
             x = init_values[:, 0]
             init_conc = np.interp(self.x, x, init_conc_at_x)
             self.species[elem]['init_conc'] = init_conc
-            self.species[elem]['concentration'][:, 0] = self.species[elem]['init_conc']
-            self.profiles[elem] = self.species[elem]['concentration'][:, 0]
+            self.profiles[elem] = init_conc.copy()
             self.template_AL_AR(elem)
             self.update_matrices_due_to_bc(elem, 0)
+            self.species[elem]['concentration'][:, 0] = self.profiles[elem]
 
     def change_boundary_conditions(self, element, i, bc_top_value, bc_top_type,
                                    bc_bot_value, bc_bot_type):
@@ -125,19 +155,77 @@ class Column(Lab):
             self.species[element].bc_bot_value = bc_bot_value
             self.template_AL_AR(element)
             self.update_matrices_due_to_bc(element, i)
+            self.restart_reactions()
 
     def template_AL_AR(self, element):
         """creates the templates of matrices for linear algebra solutions
+        and factorization of AL, which is reused until the matrices are
+        rebuilt (e.g. boundary conditions types are changed)
+
+        Species with the same transport operator (theta, D, w and types of
+        boundary conditions) are grouped and share matrices and
+        factorization, see transport_integrate.
 
         Arguments:
             element {str} -- name of the element for which it creates AL,AR
         """
+        self.remove_from_transport_group(element)
+        signature = self.operator_signature(element)
+        if signature in self.transport_groups:
+            group = self.transport_groups[signature]
+            for key in ['AL', 'AR', 'AL_banded', 'AL_factor', 'bc_coef']:
+                self.species[element][key] = self.species[group[0]][key]
+            group.append(element)
+            return
+
         self.species[element]['AL'], self.species[
             element]['AR'] = desolver.create_template_AL_AR(
                 self.species[element]['theta'], self.species[element]['D'],
                 self.species[element]['w'],
                 self.species[element]['bc_top_type'],
                 self.species[element]['bc_bot_type'], self.dt, self.dx, self.N)
+        self.species[element]['AL_banded'] = desolver.create_banded_matrix(
+            self.species[element]['AL'])
+        if self.transport_solver == 'sparse':
+            self.species[element]['AL_factor'] = desolver.factorize_sparse(
+                self.species[element]['AL'])
+        else:
+            self.species[element][
+                'AL_factor'] = desolver.factorize_tridiagonal(
+                    self.species[element]['AL_banded'])
+        self.species[element]['bc_coef'] = desolver.create_bc_coefficients(
+            self.species[element]['theta'], self.species[element]['D'],
+            self.species[element]['w'], self.species[element]['bc_top_type'],
+            self.species[element]['bc_bot_type'], self.dt, self.dx)
+        self.transport_groups[signature] = [element]
+
+    def operator_signature(self, element):
+        """signature of transport operator of the element, species with
+        equal signatures have identical AL and AR matrices
+
+        Arguments:
+            element {str} -- name of the element
+
+        Returns:
+            tuple -- hashable signature
+        """
+        return (self.species[element]['theta'].tobytes(),
+                self.species[element]['D'], self.species[element]['w'],
+                self.species[element]['bc_top_type'],
+                self.species[element]['bc_bot_type'])
+
+    def remove_from_transport_group(self, element):
+        """removes element from its group of transport operator, e.g. before
+        rebuilding its matrices
+
+        Arguments:
+            element {str} -- name of the element
+        """
+        for signature, group in list(self.transport_groups.items()):
+            if element in group:
+                group.remove(element)
+                if not group:
+                    del self.transport_groups[signature]
 
     def update_matrices_due_to_bc(self, element, i):
         """updating the matrices due to boundary conditions
@@ -146,17 +234,54 @@ class Column(Lab):
             element {str} -- name of the element
             i {int} -- number of the step
         """
+        bc_top_coef, bc_bot_coef = self.species[element]['bc_coef']
         self.profiles[element], self.species[
-            element]['B'] = desolver.update_matrices_due_to_bc(
+            element]['B'] = desolver.update_rhs_due_to_bc(
                 self.species[element]['AR'], self.profiles[element],
-                self.species[element]['theta'], self.species[element]['D'],
-                self.species[element]['w'],
-                self.species[element]['bc_top_type'],
-                self.species[element]['bc_top_value'],
-                self.species[element]['bc_bot_type'],
-                self.species[element]['bc_bot_value'], self.dt, self.dx, self.N)
+                bc_top_coef, self.species[element]['bc_top_value'],
+                bc_bot_coef, self.species[element]['bc_bot_value'])
+
+    def update_matrices_due_to_bc_of_species(self, names, i):
+        """updating the matrices due to boundary conditions of several
+        species, species sharing transport operator are updated together
+        (see update_matrices_due_to_bc_of_group)
+
+        Arguments:
+            names {list} -- names of species
+            i {int} -- number of the step
+        """
+        names = set(names)
+        for group in self.transport_groups.values():
+            members = [element for element in group if element in names]
+            if members:
+                self.update_matrices_due_to_bc_of_group(members, i)
+
+    def update_matrices_due_to_bc_of_group(self, group, i):
+        """updating the matrices due to boundary conditions of species
+        sharing transport operator at once: boundary values are taken from
+        parallel arrays of parameters (self.profiles.parameters) and right
+        hand sides are estimated from the block of profiles in one product
 
-        self.species[element]['concentration'][:, i] = self.profiles[element]
+        Arguments:
+            group {list} -- names of species with the same operator
+            i {int} -- number of the step
+        """
+        rows = self.profiles.rows(group)
+        block = self.profiles.block
+        parameters = self.profiles.parameters
+        dirichlet = Profiles.boundary_types['dirichlet']
+        top = rows[parameters['bc_top_type'][rows] == dirichlet]
+        block[top, 0] = parameters['bc_top_value'][top]
+        bot = rows[parameters['bc_bot_type'][rows] == dirichlet]
+        block[bot, -1] = parameters['bc_bot_value'][bot]
+        B = self.species[group[0]]['AR'].dot(block[rows].T)
+        bc_top_coef, bc_bot_coef = self.species[group[0]]['bc_coef']
+        if bc_top_coef is not None:
+            B[0] += bc_top_coef * parameters['bc_top_value'][rows]
+        if bc_bot_coef is not None:
+            B[-1] += bc_bot_coef * parameters['bc_bot_value'][rows]
+        for idx, element in enumerate(group):
+            self.species[element]['B'] = B[:, idx]
 
     def add_time_variable(self):
         # for now we just added it in the batch system. Not sure if we
@@ -177,34 +302,42 @@ class Column(Lab):
             int_transport=False)
         self.acid_base_system = phcalc.System(
             *[c['pH_object'] for c in self.acid_base_components])
+        if self.pH_tables:
+            self.acid_base_system.build_tables()
 
     def acid_base_update_concentrations(self, i):
         for component in self.acid_base_components:
             init_conc = 0
+            # fractions are written in the buffer of the component
+            if 'alphas' not in component:
+                component['alphas'] = np.empty(
+                    np.shape(self.profiles['pH']) +
+                    (len(component['species']), ))
             alphas = component['pH_object'].alpha(
-                self.species['pH']['concentration'][:, i])
+                self.profiles['pH'], out=component['alphas'])
             for idx in range(len(component['species'])):
-                init_conc += self.species[component['species'][idx]][
-                    'concentration'][:, i]
+                init_conc += self.profiles[component['species'][idx]]
             for idx in range(len(component['species'])):
-                self.species[component['species'][idx]][
-                    'concentration'][:, i] = init_conc * alphas[:, idx]
-                self.profiles[component['species'][idx]] = self.species[
-                    component['species'][idx]]['concentration'][:, i]
+                self.profiles[component['species']
+                              [idx]] = init_conc * alphas[:, idx]
 
     def integrate_one_timestep(self, i):
         if i < 2:
             self.pre_run_methods()
         self.transport_integrate(i)
-        if self.henry_law_equations:
-            self.henry_equilibrium_integrate(i)
-        if self.acid_base_components:
-            self.acid_base_equilibrium_solve(i)
-        if self.rates:
-            if self.ode_method is 'scipy':
-                self.reactions_integrate_scipy(i)
-            else:
-                self.reactions_integrate(i)
+        if self.equilibria_coupled():
+            self.reactions_integrate_coupled(i)
+        else:
+            if self.henry_law_equations or self.mass_action_equilibria:
+                self.equilibrium_integrate(i)
+            if self.acid_base_components:
+                self.acid_base_equilibrium_solve(i)
+            if self.rates:
+                if self.ode_method == 'scipy':
+                    self.reactions_integrate_scipy(i)
+                else:
+                    self.reactions_integrate(i)
+        self.save_profiles(i)
 
     def reactions_integrate(self, i):
         C_new, rates_per_elem, rates_per_rate = desolver.ode_integrate(
@@ -213,12 +346,15 @@ class Column(Lab):
             self.rates,
             self.constants,
             self.dt,
-            solver=self.ode_method)
+            solver=self.ode_method,
+            kernels=self.dynamic_functions['kernels'])
 
+        j = self.output_column[i - 1]
         try:
-            for rate_name, rate in rates_per_rate.items():
-                self.estimated_rates[rate_name][:, i - 1] = rates_per_rate[
-                    rate_name]
+            if j >= 0:
+                for rate_name, rate in rates_per_rate.items():
+                    self.estimated_rates.store(rate_name, j,
+                                               rates_per_rate[rate_name])
         except:
             pass
 
@@ -227,24 +363,31 @@ class Column(Lab):
                 # the concentration should be positive
                 C_new[element][C_new[element] < 0] = 0
             self.profiles[element] = C_new[element]
-            self.species[element]['concentration'][:, i] = self.profiles[
-                element]
-            self.species[element]['rates'][:, i] = rates_per_elem[
-                element] / self.dt
-            if self.species[element]['int_transport']:
-                self.update_matrices_due_to_bc(element, i)
+            if self.output_column[i] >= 0:
+                self.species[element]['rates'][:, self.output_column[
+                    i]] = rates_per_elem[element] / self.dt
+        self.update_matrices_due_to_bc_of_species(C_new, i)
 
     def transport_integrate(self, i):
         """ Integrates transport equations
+
+        Species sharing transport operator are solved together as one
+        N x k right hand side against shared factorization of AL.
         """
-        for element in self.species:
-            if self.species[element]['int_transport']:
-                self.transport_integrate_one_element(element, i)
+        for group in self.transport_groups.values():
+            if len(group) == 1:
+                self.transport_integrate_one_element(group[0], i)
+                continue
+            B = np.empty((self.N, len(group)), order='F')
+            for idx, element in enumerate(group):
+                B[:, idx] = self.species[element]['B']
+            self.profiles.set_block(group,
+                                    self.species[group[0]]['AL_factor'](B).T)
+            self.update_matrices_due_to_bc_of_group(group, i)
 
     def transport_integrate_one_element(self, element, i):
-        self.profiles[element] = desolver.linear_alg_solver(
-            self.species[element]['AL'], self.species[element]['B'])
-        self.species[element]['concentration'][:, i] = self.profiles[element]
+        self.profiles[element] = self.species[element]['AL_factor'](
+            self.species[element]['B'])
         self.update_matrices_due_to_bc(element, i)
 
     def estimate_flux_at_top(self, elem, idx=slice(None, None, None), order=4):
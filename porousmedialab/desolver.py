@@ -1,9 +1,34 @@
+import hashlib
+import importlib.util
+import json
+import os
 import sys
+import types
+import warnings
 import numexpr as ne
+from numexpr.necompiler import getExprNames, double
+import numpy as np
+from scipy.linalg import lapack
 from scipy.sparse import linalg
 from scipy.sparse import spdiags
 from scipy.integrate import ode
 
+try:
+    import sympy
+    from sympy.printing.numpy import NumPyPrinter
+except ImportError:
+    sympy = None
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# revision of generated code (create_ode_function, create_rate_function,
+# create_jacobian_function and create_model_source), it is a part of the
+# model hash, so cached modules are regenerated when the code changes
+CODE_GENERATOR_VERSION = 4
+
 
 def create_template_AL_AR(phi, diff_coef, adv_coef, bc_top_type, bc_bot_type,
                           dt, dx, N):
@@ -65,122 +90,353 @@ def create_template_AL_AR(phi, diff_coef, adv_coef, bc_top_type, bc_bot_type,
     return AL, AR
 
 
-def update_matrices_due_to_bc(AR, profile, phi, diff_coef, adv_coef,
-                              bc_top_type, bc_top, bc_bot_type, bc_bot, dt, dx,
-                              N):
-    s = phi * diff_coef * dt / dx / dx
-    q = phi * adv_coef * dt / dx
+def create_bc_coefficients(phi, diff_coef, adv_coef, bc_top_type,
+                           bc_bot_type, dt, dx):
+    """ precomputes boundary correction terms of the right hand side B,
+    they depend only on the transport operator, not on the values of
+    boundary conditions
 
-    if (bc_top_type in ['dirichlet', 'constant']
-            and bc_bot_type in ['dirichlet', 'constant']):
-        profile[0], profile[-1] = bc_top, bc_bot
-        B = AR.dot(profile)
+    Args:
+        phi (TYPE): vector of porosity(phi) or 1-phi
+        diff_coef (float): diffusion coefficient
+        adv_coef (float): advection coefficient
+        bc_top_type (string): type of boundary condition
+        bc_bot_type (string): type of boundary condition
+        dt (float): time step
+        dx (float): spatial step
 
-    elif (bc_top_type in ['dirichlet', 'constant']
-          and bc_bot_type in ['neumann', 'flux']):
-        profile[0] = bc_top
-        B = AR.dot(profile)
-        B[-1] = B[-1] + 2 * 2 * bc_bot * (
-            s[-1] / 2 - q[-1] / 4) * dx / phi[-1] / diff_coef
+    Returns:
+        tuple: coefficients of top and bottom flux boundary conditions,
+        None for dirichlet boundary condition
+    """
+    coefs = []
+    for idx, bc_type in [(0, bc_top_type), (-1, bc_bot_type)]:
+        if bc_type in ['dirichlet', 'constant']:
+            coefs.append(None)
+        elif bc_type in ['neumann', 'flux']:
+            s = phi[idx] * diff_coef * dt / dx / dx
+            q = phi[idx] * adv_coef * dt / dx
+            coefs.append(2 * 2 * (s / 2 - q / 4) * dx / phi[idx] / diff_coef)
+        else:
+            print(
+                '\nABORT!!!: Not correct boundary condition in the species...')
+            sys.exit()
+    return tuple(coefs)
 
-    elif (bc_top_type in ['neumann', 'flux']
-          and bc_bot_type in ['dirichlet', 'constant']):
-        profile[-1] = bc_bot
-        B = AR.dot(profile)
-        B[0] = B[0] + 2 * 2 * bc_top * (
-            s[0] / 2 - q[0] / 4) * dx / phi[0] / diff_coef
-
-    elif (bc_top_type in ['neumann', 'flux']
-          and bc_bot_type in ['neumann', 'flux']):
-        B = AR.dot(profile)
-        B[0] = B[0] + 2 * 2 * bc_top * (
-            s[0] / 2 - q[0] / 4) * dx / phi[0] / diff_coef
-        B[-1] = B[-1] + 2 * 2 * bc_bot * (
-            s[-1] / 2 - q[-1] / 4) * dx / phi[-1] / diff_coef
-    else:
-        print('\nABORT!!!: Not correct boundary condition in the species...')
-        sys.exit()
 
+def update_rhs_due_to_bc(AR, profile, bc_top_coef, bc_top, bc_bot_coef,
+                         bc_bot):
+    """ assigns dirichlet boundary values and estimates right hand side B
+    using precomputed coefficients from create_bc_coefficients
+
+    Args:
+        AR (sparse matrix): right hand side matrix
+        profile (array): concentration profile, modified in place
+        bc_top_coef (float): coefficient of top boundary, None for dirichlet
+        bc_top (float): top boundary value
+        bc_bot_coef (float): coefficient of bottom boundary, None for
+        dirichlet
+        bc_bot (float): bottom boundary value
+
+    Returns:
+        tuple: profile and B
+    """
+    if bc_top_coef is None:
+        profile[0] = bc_top
+    if bc_bot_coef is None:
+        profile[-1] = bc_bot
+    B = AR.dot(profile)
+    if bc_top_coef is not None:
+        B[0] += bc_top_coef * bc_top
+    if bc_bot_coef is not None:
+        B[-1] += bc_bot_coef * bc_bot
     return profile, B
 
 
+def update_matrices_due_to_bc(AR, profile, phi, diff_coef, adv_coef,
+                              bc_top_type, bc_top, bc_bot_type, bc_bot, dt, dx,
+                              N):
+    bc_top_coef, bc_bot_coef = create_bc_coefficients(
+        phi, diff_coef, adv_coef, bc_top_type, bc_bot_type, dt, dx)
+    return update_rhs_due_to_bc(AR, profile, bc_top_coef, bc_top, bc_bot_coef,
+                                bc_bot)
+
+
 def linear_alg_solver(A, B):
     return linalg.spsolve(A, B, use_umfpack=True)
 
 
-def ode_integrate(C0, dcdt, rates, coef, dt, solver='rk4'):
+def create_banded_matrix(A):
+    """ stores tridiagonal matrix as 3xN array of diagonals
+
+    The layout is the same as in scipy.linalg.solve_banded with l=u=1:
+    upper diagonal in the first row (shifted right), main diagonal in the
+    second and lower diagonal in the third row (shifted left).
+
+    Args:
+        A (sparse matrix): tridiagonal matrix NxN, e.g. AL
+
+    Returns:
+        array: 3xN array of diagonals
+    """
+    ab = np.zeros((3, A.shape[0]))
+    ab[0, 1:] = A.diagonal(1)
+    ab[1] = A.diagonal(0)
+    ab[2, :-1] = A.diagonal(-1)
+    return ab
+
+
+def tridiagonal_solver(A, B):
+    """ solves A*x = B with tridiagonal A in O(N) using LAPACK gtsv
+    (Gaussian elimination with partial pivoting, i.e. Thomas algorithm
+    with pivoting)
+
+    Args:
+        A (array): 3xN diagonals of matrix, see create_banded_matrix
+        B (array): right hand side vector
+
+    Returns:
+        array: solution x
+    """
+    _, _, _, x, info = lapack.dgtsv(A[2, :-1], A[1], A[0, 1:], B)
+    if info != 0:
+        raise np.linalg.LinAlgError(
+            'Tridiagonal solver failed, info = {}'.format(info))
+    return x
+
+
+def factorize_tridiagonal(A):
+    """ LU factorization of tridiagonal matrix (LAPACK gttrf), which is
+    computed once and reused for every time step
+
+    Args:
+        A (array): 3xN diagonals of matrix, see create_banded_matrix
+
+    Returns:
+        function: solve(B) which does only forward/back substitution
+    """
+    dl, d, du, du2, ipiv, info = lapack.dgttrf(A[2, :-1], A[1], A[0, 1:])
+    if info != 0:
+        raise np.linalg.LinAlgError(
+            'Tridiagonal factorization failed, info = {}'.format(info))
+
+    def solve(B):
+        x, info = lapack.dgttrs(dl, d, du, du2, ipiv, B)
+        if info != 0:
+            raise np.linalg.LinAlgError(
+                'Tridiagonal substitution failed, info = {}'.format(info))
+        return x
+
+    return solve
+
+
+def factorize_sparse(A):
+    """ sparse LU factorization of matrix (UMFPACK or SuperLU)
+
+    Args:
+        A (sparse matrix): matrix NxN, e.g. AL
+
+    Returns:
+        function: solve(B) which does only forward/back substitution
+    """
+    return linalg.factorized(A.tocsc())
+
+
+class NumExprKernels:
+    """
+    Compiled numexpr kernels of rates and dcdt expressions. Expressions
+    are parsed and compiled once per model, the kernels are called with
+    the operands looked up by name and write into preallocated output
+    buffers (one set of buffers per stage of Runge-Kutta method).
+    """
+
+    def __init__(self, rates, dcdt):
+        """
+        Arguments:
+            rates {dict} -- dict of rates provided by user
+            dcdt {dict} -- dict of dcdt provided by user
+        """
+        self.rates = {k: self.compile(v) for k, v in rates.items()}
+        self.dcdt = {k: self.compile(v) for k, v in dcdt.items()}
+        self.buffers = {}
+
+    @staticmethod
+    def compile(expression):
+        names, uses_vml = getExprNames(expression, {})
+        kernel = ne.NumExpr(expression, [(name, double) for name in names])
+        return kernel, names, uses_vml
+
+    def evaluate(self, compiled, key, first, second):
+        """evaluates compiled expression, operands are taken from the first
+        dict, then from the second one
+
+        Arguments:
+            compiled {tuple} -- compiled expression (see compile)
+            key {hashable} -- key of output buffer, e.g. (stage, name)
+            first {dict} -- operands, e.g. concentrations
+            second {dict} -- operands, e.g. coefficients
+
+        Returns:
+            np.array -- result, stored in the buffer and overwritten by the
+            next call with the same key
+        """
+        kernel, names, uses_vml = compiled
+        args = [first[n] if n in first else second[n] for n in names]
+        out = self.buffers.get(key)
+        if out is not None and out.shape != np.broadcast_shapes(
+                *[np.shape(a) for a in args]):
+            out = None
+        result = kernel(
+            *args,
+            out=out,
+            order='K',
+            casting='safe',
+            ex_uses_vml=uses_vml)
+        if result.ndim > 0:
+            self.buffers[key] = result
+        return result
+
+
+# Dormand-Prince 5(4): rows of Butcher tableau for stages 2-7 (the last
+# row are weights of the solution of 5th order) and weights of error
+# estimate (difference of 5th and 4th order solutions)
+DOPRI_A = [
+    [1 / 5],
+    [3 / 40, 9 / 40],
+    [44 / 45, -56 / 15, 32 / 9],
+    [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+    [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+    [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84],
+]
+DOPRI_E = [
+    71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40
+]
+
+
+def ode_integrate(C0, dcdt, rates, coef, dt, solver='rk4', kernels=None):
     """Integrates the reactions according to 4th Order Runge-Kutta method
-    or Butcher 5th where the variables, rates, coef are passed as dictionaries
+    or Butcher 5th where the variables, rates, coef are passed as dictionaries,
+    solver='dopri5' is adaptive Dormand-Prince method with substeps in every
+    cell, solver='implicit' (implicit Euler) and solver='bdf2' are implicit
+    methods for stiff reactions (see implicit_solver)
+
+    kernels {NumExprKernels} -- compiled rates and dcdt, reused between
+    calls (compiled for the call if not provided)
     """
+    if kernels is None:
+        kernels = NumExprKernels(rates, dcdt)
 
-    def implicit_solver(C_0):
-
-        class Derivative:
-
-            def __init__(self, f, h=1E-5):
-                self.f = f
-                self.h = float(h)
-
-            def __call__(self, x):
-                f, h = self.f, self.h
-                return (f(x + h) - f(x - h)) / (2 * h)
-
-        def Newton(f, x, dfdx, epsilon=1.0E-7, N=100, store=False):
-            f_value = f(x)
-            n = 0
-            if store:
-                info = [(x, f_value)]
-            while abs(f_value) > epsilon and n <= N:
-                dfdx_value = float(dfdx(x))
-                if abs(dfdx_value) < 1E-14:
-                    raise ValueError("Newton: f’(%g)=%g" % (x, dfdx_value))
-
-                x = x - f_value / dfdx_value
-                n += 1
-                f_value = f(x)
-                if store:
-                    info.append((x, f_value))
-            if store:
-                return x, info
-            else:
-                return x, n, f_value
+    def implicit_solver(C_0, bdf2=False, rtol=1e-6, atol=1e-12, max_iter=20):
+        """Integrates the reactions according to implicit Euler method
+            C_new = C0 + dt*dcdt(C_new)
+        or TR-BDF2 (bdf2=True): trapezoidal rule up to g*dt, g = 2 - sqrt(2),
+        followed by BDF2 through C0, C_g and C_new
+            C_g = C0 + g*dt/2*(dcdt(C0) + dcdt(C_g))
+            C_new = (C_g - (1-g)^2*C0)/(g*(2-g)) + (1-g)/(2-g)*dt*dcdt(C_new)
+        (stages are replaced by implicit Euler in cells where the explicit
+        parts are negative).
+        Nonlinear equations are solved by Newton method in all cells at once,
+        Jacobians (n x n per cell) are estimated by finite differences
+        perturbing each element in all cells together (cells are independent).
+        """
+        elements = list(dcdt)
+        n = len(elements)
+        shape = np.broadcast(*C_0.values()).shape
+        identity = np.eye(n)
 
-        def F(w):
-            return w - k_loop(w) - C0
+        def to_conc(Y):
+            conc = dict(C_0)
+            for idx, element in enumerate(elements):
+                conc[element] = Y[..., idx]
+            return conc
 
-        dFdw = Derivative(F)
+        def f(Y):
+            Kn, _ = k_loop(to_conc(Y), dt=1)
+            return np.stack(
+                [np.broadcast_to(Kn[element], shape) for element in elements],
+                axis=-1)
 
-        C_new = {}
-        k1 = k_loop(C_0)
-        for element in C_0:
-            w_start = C_0[element] + k1[element]
-            C_new[element], _ = Newton(F, w_start, dFdw, N=30)
+        def jacobian(Y, F):
+            J = np.empty(Y.shape + (n, ))
+            for j in range(n):
+                h = 1.5e-8 * np.maximum(np.abs(Y[..., j]), 1e-8)
+                Y_h = Y.copy()
+                Y_h[..., j] += h
+                J[..., j] = (f(Y_h) - F) / h[..., None]
+            return J
 
-        raise NotImplemented
+        def newton(B, h):
+            """solves Y - h*dcdt(Y) = B, warns if iterations do not
+            converge in some cells"""
+            Y = B.copy()
+            for _ in range(max_iter):
+                F = f(Y)
+                G = Y - h * F - B
+                J = identity - h * jacobian(Y, F)
+                dY = np.linalg.solve(J, G[..., None])[..., 0]
+                Y -= dY
+                converged = np.all(np.abs(dY) <= atol + rtol * np.abs(Y),
+                                   axis=-1)
+                if np.all(converged):
+                    break
+            else:
+                warnings.warn(
+                    'Newton iterations of implicit reaction solver did not '
+                    'converge in {} of {} cells, reduce time step.'.format(
+                        np.count_nonzero(~converged), converged.size),
+                    RuntimeWarning)
+            return Y
 
-    def k_loop(conc, dt=dt, non_negative_rates=True):
+        Y_0 = np.stack(
+            [np.broadcast_to(C_0[element], shape) for element in elements],
+            axis=-1).astype(float)
+        if bdf2:
+            g = 2 - np.sqrt(2)
+            B_g = Y_0 + g * dt / 2 * f(Y_0)
+            Y_g = newton(B_g, g * dt / 2)
+            # cells with fast depletion (negative right hand sides) take
+            # implicit Euler steps instead
+            depleted = np.any(B_g < 0, axis=-1)
+            if np.any(depleted):
+                Y_g[depleted] = newton(Y_0, g * dt)[depleted]
+            B = (Y_g - (1 - g)**2 * Y_0) / (g * (2 - g))
+            Y = newton(B, (1 - g) / (2 - g) * dt)
+            depleted = np.any(B < 0, axis=-1)
+            if np.any(depleted):
+                Y[depleted] = newton(Y_g, (1 - g) * dt)[depleted]
+        else:
+            Y = newton(Y_0, dt)
+
+        C_new = to_conc(Y)
+        _, rates_at_end = k_loop(C_new)
+        rates_per_rate = {k: np.array(v) for k, v in rates_at_end.items()}
+        rates_per_element = {}
+        for element in C_0:
+            rates_per_element[element] = C_new[element] - C_0[element]
+        return C_new, rates_per_element, rates_per_rate
+
+    def k_loop(conc, dt=dt, non_negative_rates=True, stage=0):
         rates_per_rate = {}
-        for element, rate in rates.items():
-            rates_per_rate[element] = ne.evaluate(rate, {**coef, **conc})
+        for element, rate in kernels.rates.items():
+            r = kernels.evaluate(rate, (stage, 'rate', element), conc, coef)
             if non_negative_rates:
-                rates_per_rate[element] = rates_per_rate[element] * (
-                    rates_per_rate[element] > 0)
+                # in place for buffers, constant expressions return scalars
+                r = np.multiply(r, r > 0, out=r if r.ndim else None)
+            rates_per_rate[element] = r
 
         Kn = {}
-        for element in dcdt:
-            Kn[element] = dt * ne.evaluate(dcdt[element], {
-                **
-                coef,
-                **
-                rates_per_rate
-            })
+        for element, rate in kernels.dcdt.items():
+            k = kernels.evaluate(rate, (stage, 'dcdt', element),
+                                 rates_per_rate, coef)
+            Kn[element] = np.multiply(k, dt, out=k if k.ndim else None)
 
         return Kn, rates_per_rate
 
     def sum_k(A, B, b):
+        # B (Kn) already includes dt
         C_new = {}
         for k in A:
-            C_new[k] = A[k] + b * B[k] * dt
+            C_new[k] = A[k] + b * B[k]
         return C_new
 
     def rk4(C_0):
@@ -191,10 +447,10 @@ def ode_integrate(C0, dcdt, rates, coef, dt, solver='rk4'):
             k_4 = dt*dcdt(C0+k_3, dt)
             C_new = C0 + (k_1+2*k_2+2*k_3+k_4)/6
         """
-        k1, rates_per_rate1 = k_loop(C_0)
-        k2, rates_per_rate2 = k_loop(sum_k(C_0, k1, 0.5))
-        k3, rates_per_rate3 = k_loop(sum_k(C_0, k2, 0.5))
-        k4, rates_per_rate4 = k_loop(sum_k(C_0, k3, 1))
+        k1, rates_per_rate1 = k_loop(C_0, stage=1)
+        k2, rates_per_rate2 = k_loop(sum_k(C_0, k1, 0.5), stage=2)
+        k3, rates_per_rate3 = k_loop(sum_k(C_0, k2, 0.5), stage=3)
+        k4, rates_per_rate4 = k_loop(sum_k(C_0, k3, 1), stage=4)
 
         rates_per_rate = {}
         for rate_name, rate in rates_per_rate1.items():
@@ -221,16 +477,24 @@ def ode_integrate(C0, dcdt, rates, coef, dt, solver='rk4'):
         k_6 = dt*sediment_rates(C0 - 3/7*k_1 + 2/7*k_2 + 12/7*k_3 - 12/7*k_4 + 8/7*k_5, dt);
         C_new = C0 + (7*k_1 + 32*k_3 + 12*k_4 + 32*k_5 + 7*k_6)/90;
         """
-        k1 = k_loop(C_0)
-        k2 = k_loop(sum_k(C_0, k1, 1 / 4))
-        k3 = k_loop(sum_k(sum_k(C_0, k1, 1 / 8), k2, 1 / 8))
-        k4 = k_loop(sum_k(sum_k(C_0, k2, -0.5), k3, 1))
-        k5 = k_loop(sum_k(sum_k(C_0, k1, 3 / 16), k4, 9 / 16))
-        k6 = k_loop(
+        k1, r1 = k_loop(C_0, stage=1)
+        k2, r2 = k_loop(sum_k(C_0, k1, 1 / 4), stage=2)
+        k3, r3 = k_loop(sum_k(sum_k(C_0, k1, 1 / 8), k2, 1 / 8), stage=3)
+        k4, r4 = k_loop(sum_k(sum_k(C_0, k2, -0.5), k3, 1), stage=4)
+        k5, r5 = k_loop(sum_k(sum_k(C_0, k1, 3 / 16), k4, 9 / 16), stage=5)
+        k6, r6 = k_loop(
             sum_k(
                 sum_k(
                     sum_k(sum_k(sum_k(C_0, k1, -3 / 7), k2, 2 / 7), k3, 12 / 7),
-                    k4, -12 / 7), k5, 8 / 7))
+                    k4, -12 / 7), k5, 8 / 7),
+            stage=6)
+
+        rates_per_rate = {}
+        for rate_name in r1:
+            rates_per_rate[rate_name] = (
+                7 * r1[rate_name] + 32 * r3[rate_name] + 12 * r4[rate_name] +
+                32 * r5[rate_name] + 7 * r6[rate_name]) / 90
+
         C_new = {}
         rates_per_element = {}
         for element in C_0:
@@ -238,12 +502,115 @@ def ode_integrate(C0, dcdt, rates, coef, dt, solver='rk4'):
                 7 * k1[element] + 32 * k3[element] + 12 * k4[element] +
                 32 * k5[element] + 7 * k6[element]) / 90
             C_new[element] = C_0[element] + rates_per_element[element]
-        return C_new, rates_per_element
+        return C_new, rates_per_element, rates_per_rate
+
+    def dopri5(C_0, rtol=1e-6, atol=1e-10, min_step=1e-8):
+        """Integrates the reactions according to Dormand-Prince 5(4) method
+        with error control in every cell. Cells substep independently: the
+        first stage is evaluated in all cells, quiescent cells (change of
+        reacting elements dt*dcdt(C0) within tolerance) finish with this
+        stage, the other cells are integrated with adaptive substeps and
+        every substep evaluates stages only in cells which have not reached
+        dt yet. Rates are averaged over the substeps.
+        """
+        shape = np.broadcast(*C_0.values()).shape
+        size = int(np.prod(shape))
+
+        def flat(v, n=size):
+            return np.array(np.broadcast_to(v, (n, )), dtype=float)
+
+        C = {
+            element: flat(np.broadcast_to(v, shape).ravel())
+            for element, v in C_0.items()
+        }
+        # elements with dcdt independent of rates are integrated exactly
+        reacting = [
+            element for element, (_, names, _) in kernels.dcdt.items()
+            if any(name in kernels.rates for name in names)
+        ]
+
+        K_1, R_1 = k_loop(C, stage=1)
+        K_1 = {element: flat(v) for element, v in K_1.items()}
+        R_1 = {rate_name: flat(v) for rate_name, v in R_1.items()}
+        quiescent = np.ones(size, dtype=bool)
+        for element in reacting:
+            quiescent &= np.abs(
+                K_1[element]) <= atol + rtol * np.abs(C[element])
+        for element, k in K_1.items():
+            C[element][quiescent] += k[quiescent]
+        rates_sum = {rate_name: v * dt for rate_name, v in R_1.items()}
+
+        cells = np.flatnonzero(~quiescent)
+        for rate_name in rates_sum:
+            rates_sum[rate_name][cells] = 0
+        F_1 = {element: v[cells] / dt for element, v in K_1.items()}
+        R_1 = {rate_name: v[cells] for rate_name, v in R_1.items()}
+        t = np.zeros(cells.size)
+        h = np.full(cells.size, float(dt))
+        while cells.size:
+            C_cells = {element: v[cells] for element, v in C.items()}
+            F, R = [F_1], [R_1]
+            for i, a in enumerate(DOPRI_A):
+                Y = dict(C_cells)
+                for element in F_1:
+                    Y[element] = C_cells[element] + h * sum(
+                        a_j * F_j[element] for a_j, F_j in zip(a, F) if a_j)
+                K, r = k_loop(Y, dt=1, stage=('dopri', i))
+                F.append({e: flat(v, h.size) for e, v in K.items()})
+                R.append({k: flat(v, h.size) for k, v in r.items()})
+            # Y is the solution of 5th order, F[-1] is dcdt(Y)
+
+            err = np.zeros(cells.size)
+            for element in reacting:
+                e = h * sum(
+                    e_j * F_j[element] for e_j, F_j in zip(DOPRI_E, F) if e_j)
+                scale = atol + rtol * np.maximum(
+                    np.abs(C_cells[element]), np.abs(Y[element]))
+                err = np.maximum(err, np.abs(e) / scale)
+
+            accept = (err <= 1) | (h <= min_step * dt)
+            accepted_cells = cells[accept]
+            for element in F_1:
+                C[element][accepted_cells] = Y[element][accept]
+            for rate_name in rates_sum:
+                rates_sum[rate_name][accepted_cells] += (h * sum(
+                    b_j * R_j[rate_name]
+                    for b_j, R_j in zip(DOPRI_A[-1], R) if b_j))[accept]
+            t[accept] += h[accept]
+
+            h = h * np.clip(0.9 * np.maximum(err, 1e-10)**-0.2, 0.2, 5)
+            h = np.maximum(np.minimum(h, dt - t), min_step * dt)
+            # first same as last: the last stage of accepted substep is the
+            # first stage of the next one
+            running = t < dt * (1 - 1e-12)
+            F_1 = {
+                e: np.where(accept, F[-1][e], F_1[e])[running]
+                for e in F_1
+            }
+            R_1 = {
+                r: np.where(accept, R[-1][r], R_1[r])[running]
+                for r in R_1
+            }
+            cells, t, h = cells[running], t[running], h[running]
+
+        C_new = {element: v.reshape(shape) for element, v in C.items()}
+        rates_per_rate = {
+            rate_name: (v / dt).reshape(shape)
+            for rate_name, v in rates_sum.items()
+        }
+        rates_per_element = {}
+        for element in C_0:
+            rates_per_element[element] = C_new[element] - C_0[element]
+        return C_new, rates_per_element, rates_per_rate
 
     if solver == 'butcher5':
         return butcher5(C0)
+    if solver == 'dopri5':
+        return dopri5(C0)
     if solver == 'implicit':
         return implicit_solver(C0)
+    if solver == 'bdf2':
+        return implicit_solver(C0, bdf2=True)
 
     return rk4(C0)
 
@@ -253,9 +620,18 @@ def create_ode_function(species,
                         constants,
                         rates,
                         dcdt,
-                        non_negative_rates=True):
+                        non_negative_rates=True,
+                        cells=True):
     """creates the string of ode function
 
+    The function is vectorized over the cells: y is the flattened array
+    (number of cells x number of species) ordered cell by cell, i.e. the
+    state of one cell or of the whole column. Constants are not written as
+    literals, they are taken from the parameter vector p (in the order of
+    constants dict). With cells=False the function f_cell evaluates one
+    cell on scalars, which is much faster in python for cells integrated
+    one by one.
+
     Arguments:
         species {dict} -- dict of species provided by user
         constants {dict} -- dict of concstants provided by user
@@ -264,28 +640,39 @@ def create_ode_function(species,
 
     Keyword Arguments:
         non_negative_rates {bool} -- prevent negative values? (default: {True})
+        cells {bool} -- vectorized over the cells (default: {True})
 
     Returns:
         [str] -- returns string of fun
     """
-    body_of_function = "def f(t, y):\n"
-    body_of_function += "\t import scipy as sp\n"
-    body_of_function += "\t dydt = np.zeros((len(y), 1))"
+    index = ':, ' if cells else ''
+    if cells:
+        body_of_function = "def f(t, y, p):\n"
+        body_of_function += "\t y = y.reshape(-1, {:.0f})\n".format(
+            len(species))
+        body_of_function += "\t dydt = np.zeros(y.shape)"
+    else:
+        body_of_function = "def f_cell(t, y, p):\n"
+        body_of_function += "\t dydt = np.zeros({:.0f})".format(len(species))
+    # one clip of the whole state, np.clip has large overhead per call
+    body_of_function += "\n\t y = np.clip(y, 1e-16, 1e+16)"
     for i, s in enumerate(species):
-        body_of_function += '\n\t {} = np.clip(y[{:.0f}], 1e-16, 1e+16)'.format(
-            s, i)
+        body_of_function += '\n\t {} = y[{}{:.0f}]'.format(s, index, i)
     for k, v in functions.items():
         body_of_function += '\n\t {} = {}'.format(k, v)
-    for k, v in constants.items():
-        body_of_function += '\n\t {} = {}'.format(k, v)
+    for idx, k in enumerate(constants):
+        body_of_function += '\n\t {} = p[{:.0f}]'.format(k, idx)
     for k, v in rates.items():
         body_of_function += '\n\t {} = {}'.format(k, v, v)
         if non_negative_rates:
             body_of_function += '\n\t {} = {}*({}>0)'.format(k, k, k)
     for i, s in enumerate(dcdt):
-        body_of_function += '\n\t dydt[{:.0f}] = {}  # {}'.format(
-            i, dcdt[s], s)
-    body_of_function += "\n\t return dydt"
+        body_of_function += '\n\t dydt[{}{:.0f}] = {}  # {}'.format(
+            index, i, dcdt[s], s)
+    if cells:
+        body_of_function += "\n\t return dydt.ravel()"
+    else:
+        body_of_function += "\n\t return dydt"
 
     return body_of_function
 
@@ -298,6 +685,10 @@ def create_rate_function(species,
                          non_negative_rates=False):
     """creates the string of rates function
 
+    The function is vectorized over the cells: y is the state of one cell
+    or array (number of cells x number of species), p is the vector of
+    constants.
+
     Arguments:
         species {dict} -- dict of species provided by user
         constants {dict} -- dict of concstants provided by user
@@ -309,14 +700,14 @@ def create_rate_function(species,
     Returns:
         [str] -- returns string of fun
     """
-    body_of_function = "def rates(y):\n"
+    body_of_function = "def rates(y, p):\n"
+    body_of_function += "\t y = np.clip(y, 1e-16, 1e+16)"
     for i, s in enumerate(species):
-        body_of_function += '\n\t {} = np.clip(y[{:.0f}], 1e-16, 1e+16)'.format(
-            s, i)
+        body_of_function += '\n\t {} = y[..., {:.0f}]'.format(s, i)
     for k, v in functions.items():
         body_of_function += '\n\t {} = {}'.format(k, v)
-    for k, v in constants.items():
-        body_of_function += '\n\t {} = {}'.format(k, v)
+    for idx, k in enumerate(constants):
+        body_of_function += '\n\t {} = p[{:.0f}]'.format(k, idx)
     for k, v in rates.items():
         body_of_function += '\n\t {} = {}'.format(k, v, v)
         if non_negative_rates:
@@ -328,14 +719,480 @@ def create_rate_function(species,
     return body_of_function
 
 
-def create_solver(dydt):
-    solver = ode(dydt).set_integrator('lsoda', method='bdf', rtol=1e-2)
+if sympy is not None:
+
+    class _NumPyPrinter(NumPyPrinter):
+        """prints expressions with np prefix and without functools (the
+        printed code should be compilable by numba)"""
+
+        def _module_format(self, fqn, register=True):
+            if fqn.startswith('numpy.'):
+                fqn = 'np.' + fqn[len('numpy.'):]
+            return super()._module_format(fqn, register)
+
+        def _print_Max(self, expr):
+            return self._print_nested('np.maximum', expr.args)
+
+        def _print_Min(self, expr):
+            return self._print_nested('np.minimum', expr.args)
+
+        def _print_nested(self, func, args):
+            printed = self._print(args[-1])
+            for arg in reversed(args[:-1]):
+                printed = '{}({}, {})'.format(func, self._print(arg), printed)
+            return printed
+
+
+def create_jacobian_function(species,
+                             functions,
+                             constants,
+                             rates,
+                             dcdt,
+                             non_negative_rates=True,
+                             cells=True):
+    """creates the string of analytical Jacobian of ode function, see
+    create_jacobian_functions
+
+    Arguments:
+        species {dict} -- dict of species provided by user
+        functions {dict} -- dict of functions provided by user
+        constants {dict} -- dict of concstants provided by user
+        rates {dict} -- dict of rates provided by user
+        dcdt {dict} -- dict of dcdt provided by user
+
+    Keyword Arguments:
+        non_negative_rates {bool} -- prevent negative values? (default: {True})
+        cells {bool} -- vectorized over the cells (jac) or one cell on
+        scalars (jac_cell) (default: {True})
+
+    Returns:
+        [str] -- returns string of jac or None if sympy is not installed
+        or expressions can not be differentiated
+    """
+    jac_strs = create_jacobian_functions(species, functions, constants,
+                                         rates, dcdt, non_negative_rates)
+    if jac_strs is None:
+        return None
+    return jac_strs[0] if cells else jac_strs[1]
+
+
+def create_jacobian_functions(species,
+                              functions,
+                              constants,
+                              rates,
+                              dcdt,
+                              non_negative_rates=True):
+    """creates the strings of analytical Jacobian of ode function
+
+    The expressions of rates and dcdt are differentiated symbolically
+    (sympy) using chain rule through rates (also through rates used in
+    later rates), functions are substituted in the expressions.
+    Non-negativity masks of rates are kept as masks of the derivatives.
+    The derivatives are written twice: jac is vectorized over the cells as
+    the ode function and returns array (number of cells x n x n) of blocks,
+    jac_cell evaluates one cell on scalars and returns n x n matrix (see
+    create_ode_function).
+
+    Arguments:
+        species {dict} -- dict of species provided by user
+        functions {dict} -- dict of functions provided by user
+        constants {dict} -- dict of concstants provided by user
+        rates {dict} -- dict of rates provided by user
+        dcdt {dict} -- dict of dcdt provided by user
+
+    Keyword Arguments:
+        non_negative_rates {bool} -- prevent negative values? (default: {True})
+
+    Returns:
+        tuple -- strings of jac and jac_cell or None if sympy is not
+        installed or expressions can not be differentiated
+    """
+    if sympy is None:
+        return None
+
+    symbols = {
+        name: sympy.Symbol(name)
+        for name in list(species) + list(constants) + list(rates)
+    }
+    # numpy and scipy functions in the expressions are mapped on sympy
+    math_module = types.SimpleNamespace(
+        **{k: getattr(sympy, k)
+           for k in dir(sympy) if not k.startswith('_')})
+    math_module.log10 = lambda x: sympy.log(x, 10)
+    math_module.power = sympy.Pow
+    math_module.maximum = sympy.Max
+    math_module.minimum = sympy.Min
+    math_module.abs = sympy.Abs
+    namespace = {**symbols, 'np': math_module, 'sp': math_module}
+
+    try:
+        for k, v in functions.items():
+            namespace[k] = sympy.sympify(v, locals=namespace)
+        rate_exprs = {
+            k: sympy.sympify(v, locals=namespace)
+            for k, v in rates.items()
+        }
+        dcdt_exprs = [sympy.sympify(v, locals=namespace) for v in dcdt.values()]
+    except Exception:
+        return None
+
+    n = len(species)
+    masks = {k: sympy.Symbol('{}__mask'.format(k)) for k in rates}
+    printer = _NumPyPrinter()
+    # lines of the body after the header, index of cell is written as {c}
+    lines = ["y = np.clip(y, 1e-16, 1e+16)"]
+    for i, s in enumerate(species):
+        lines.append('{} = y[{{c}}{:.0f}]'.format(s, i))
+    for idx, k in enumerate(constants):
+        lines.append('{} = p[{:.0f}]'.format(k, idx))
+    for k, v in rate_exprs.items():
+        lines.append('{} = {}'.format(k, printer.doprint(v)))
+        if non_negative_rates:
+            # float mask, unary minus is not defined for numpy booleans
+            lines.append('{} = ({}>0)*1.0'.format(masks[k], k))
+            lines.append('{} = {}*{}'.format(k, k, masks[k]))
+
+    def chain_rule(expr, spc, d_rates):
+        d = sympy.diff(expr, symbols[spc])
+        for r, d_rate in d_rates.items():
+            d_expr = sympy.diff(expr, symbols[r])
+            if d_expr != 0:
+                d += d_expr * d_rate[spc] * (masks[r]
+                                             if non_negative_rates else 1)
+        return d
+
+    # total derivatives of rates, rates may refer to rates defined before
+    # them (as in the ode function)
+    d_rates = {}
+    for r, rate_expr in rate_exprs.items():
+        d_rates[r] = {
+            spc: chain_rule(rate_expr, spc, d_rates)
+            for spc in species
+        }
+    entries = []
+    for i, (s, expr) in enumerate(zip(dcdt, dcdt_exprs)):
+        for j, spc in enumerate(species):
+            d = chain_rule(expr, spc, d_rates)
+            if d != 0:
+                entries.append('jac[{{c}}{:.0f}, {:.0f}] = {}  # d{}/d{}'.format(
+                    i, j, printer.doprint(d), s, spc))
+
+    def write(header, cell_index):
+        body_of_function = header
+        for line in lines + entries:
+            # printed expressions may contain braces, only {c} is replaced
+            body_of_function += '\n\t ' + line.replace('{c}', cell_index)
+        return body_of_function + "\n\t return jac"
+
+    jac_str = write(
+        "def jac(t, y, p):\n"
+        "\t y = y.reshape(-1, {0:.0f})\n"
+        "\t jac = np.zeros((y.shape[0], {0:.0f}, {0:.0f}))".format(n), ':, ')
+    jac_cell_str = write(
+        "def jac_cell(t, y, p):\n"
+        "\t jac = np.zeros(({0:.0f}, {0:.0f}))".format(n), '')
+    return jac_str, jac_cell_str
+
+
+def model_hash(species, functions, constants, rates, dcdt, **options):
+    """hash of generated model code: version of code generator, names of
+    species and constants, expressions of functions, rates and dcdt and
+    options of code generation. Values of constants are not included (they
+    are passed as parameters).
+
+    Returns:
+        str -- hex digest
+    """
+    model = [
+        CODE_GENERATOR_VERSION,
+        list(species),
+        list(functions.items()),
+        list(constants),
+        list(rates.items()),
+        list(dcdt.items()),
+        sorted(options.items())
+    ]
+    return hashlib.sha1(json.dumps(model).encode()).hexdigest()
+
+
+def create_model_source(species, functions, constants, rates, dcdt):
+    """creates source of model module with ode functions f(t, y, p) and
+    f_cell(t, y, p), Jacobians jac(t, y, p) and jac_cell(t, y, p) (None if
+    they can not be created) and rates(y, p)
+
+    Returns:
+        str -- source of module
+    """
+    jac_strs = create_jacobian_functions(species, functions, constants,
+                                         rates, dcdt)
+    source = 'import numpy as np\nimport scipy as sp\n\n\n'
+    for cells in (True, False):
+        source += create_ode_function(
+            species, functions, constants, rates, dcdt, cells=cells)
+        source += '\n\n\n'
+    if jac_strs is None:
+        source += 'jac = None\njac_cell = None'
+    else:
+        source += '\n\n\n'.join(jac_strs)
+    source += '\n\n\n'
+    source += create_rate_function(species, functions, constants, rates,
+                                   dcdt)
+    source += '\n'
+    return source
+
+
+def default_cache_dir():
+    """per user folder of cached model modules,
+    $XDG_CACHE_HOME/porousmedialab/models (~/.cache by default)
+
+    Returns:
+        str -- path of the folder
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'porousmedialab', 'models')
+
+
+def is_private_directory(path):
+    """checks that the directory is owned by the current user and can not
+    be written by others (modules in the cache are executed on import)
+
+    Arguments:
+        path {str} -- path of the directory
+
+    Returns:
+        bool -- True if the directory is private
+    """
+    if not hasattr(os, 'getuid'):
+        return True
+    status = os.stat(path)
+    return status.st_uid == os.getuid() and not status.st_mode & 0o022
+
+
+def load_model_module(species,
+                      functions,
+                      constants,
+                      rates,
+                      dcdt,
+                      cache_dir=None):
+    """loads model module (see create_model_source), the module is written
+    in cache_dir as file named by model hash and is imported from there by
+    next runs and other processes without code generation; modules are also
+    kept in sys.modules during the session. Modules are not cached in
+    directories which are not private (see is_private_directory).
+
+    Keyword Arguments:
+        cache_dir {str} -- directory of cached modules, the source is
+        executed in memory if None (default: {None})
+
+    Returns:
+        module -- module with f, jac, rates and source
+    """
+    key = model_hash(
+        species,
+        functions,
+        constants,
+        rates,
+        dcdt,
+        jacobian=None if sympy is None else sympy.__version__)
+    name = 'porousmedialab_model_' + key
+    if name in sys.modules:
+        return sys.modules[name]
+    if cache_dir is not None:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        if not is_private_directory(cache_dir):
+            print('Warning: {} is not private directory of the user, the '
+                  'model is not cached!'.format(cache_dir))
+            cache_dir = None
+    if cache_dir is None:
+        module = types.ModuleType(name)
+        module.source = create_model_source(species, functions, constants,
+                                            rates, dcdt)
+        exec(module.source, module.__dict__)
+    else:
+        path = os.path.join(cache_dir, name + '.py')
+        if not os.path.exists(path):
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(
+                    create_model_source(species, functions, constants, rates,
+                                        dcdt))
+            os.replace(tmp_path, path)
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        with open(path) as f:
+            module.source = f.read()
+    sys.modules[name] = module
+    return module
+
+
+def banded_jacobian(jac):
+    """converts Jacobian function returning blocks (number of cells x n x n)
+    of block-diagonal Jacobian into the function returning LAPACK banded
+    storage with half-bandwidth n-1, as required by LSODA with lband and
+    uband (cells are ordered one by one, see create_ode_function). LSODA
+    expects lband additional rows of zeros below the band (space for LU).
+
+    Arguments:
+        jac {function} -- Jacobian returning blocks
+
+    Returns:
+        function -- Jacobian in banded storage
+    """
+
+    def banded_jac(t, y):
+        blocks = jac(t, y)
+        N, n, _ = blocks.shape
+        packed = np.zeros((3 * n - 2, N * n))
+        for i in range(n):
+            for j in range(n):
+                packed[i - j + n - 1, j::n] = blocks[:, i, j]
+        return packed
+
+    return banded_jac
+
+
+# compiled functions of loaded model modules (see load_model_module)
+_compiled_functions = {}
+
+
+def compile_function(function, *args, cache=False):
+    """compiles generated function (ode, Jacobian, rates) with numba in
+    nopython mode, the function is called with args to compile it at once
+
+    Arguments:
+        function {function} -- function created by exec or model module
+        *args -- example arguments, e.g. (0.0, y, p)
+
+    Keyword Arguments:
+        cache {bool} -- cache compiled code on disk, only for functions
+        of model modules saved in files (default: {False})
+
+    Returns:
+        function -- compiled function or the same function if numba is not
+        installed or the expressions are not supported by numba
+    """
+    if numba is None:
+        return function
+    if function not in _compiled_functions:
+        try:
+            compiled = numba.njit(cache=cache)(function)
+            compiled(*args)
+        except Exception:
+            compiled = function
+        _compiled_functions[function] = compiled
+    return _compiled_functions[function]
+
+
+def create_solver(dydt, band=None, jac=None, parameters=None):
+    """creates LSODA solver of ode
+
+    Arguments:
+        dydt {function} -- right hand side of ode
+
+    Keyword Arguments:
+        band {int} -- half-bandwidth of Jacobian, e.g. number of species - 1
+        for all cells integrated together (block-diagonal Jacobian)
+        (default: {None})
+        jac {function} -- analytical Jacobian, blocks of the cells if band
+        is given (jac) else matrix of one cell (jac_cell), see
+        create_jacobian_functions, finite differences are used if None
+        (default: {None})
+        parameters {np.array} -- vector of constants passed to dydt and jac
+        (default: {None})
+
+    Returns:
+        scipy.integrate.ode -- solver
+    """
+    params = () if parameters is None else (parameters, )
+
+    # plain python functions, LSODA callback can not inspect numba functions
+    def rhs(t, y):
+        return dydt(t, y, *params)
+
+    if jac is not None:
+        jac_params = jac
+
+        def jac(t, y):
+            return jac_params(t, y, *params)
+
+        if band is not None:
+            jac = banded_jacobian(jac)
+
+    solver = ode(rhs, jac).set_integrator(
+        'lsoda', method='bdf', rtol=1e-2, lband=band, uband=band)
     return solver
 
 
-def ode_integrate_scipy(solver, yinit, timestep):
+def ode_integrate_scipy(solver,
+                        yinit,
+                        timestep,
+                        warm_start=False,
+                        first_step=None):
+    """integrates ode with LSODA solver over one timestep
+
+    Arguments:
+        solver {scipy.integrate.ode} -- solver, see create_solver
+        yinit {np.array} -- initial state
+        timestep {float} -- timestep
+
+    Keyword Arguments:
+        warm_start {bool} -- if yinit equals the result of previous call
+        (state did not jump, e.g. no transport or equilibrium between calls)
+        the integration continues with the step size, order and Jacobian
+        history of LSODA instead of restart (default: {False})
+        first_step {float} -- initial step size of restarted LSODA, e.g.
+        a fraction of the last step size of the previous time step (restart
+        after transport) or of the cell integrated by shared solver,
+        ignored for other integrators (default: {None})
+
+    Returns:
+        np.array -- state after timestep
+    """
+    if warm_start and solver.t > 0 and solver.successful():
+        if np.array_equal(solver.y, yinit):
+            t_end = solver.t + timestep
+            while solver.successful() and solver.t < t_end:
+                solver.integrate(t_end)
+            return solver.y
     t_start = 0.0
     solver.set_initial_value(yinit, t_start)
+    rwork = lsoda_work_array(solver)
+    if first_step and rwork is not None:
+        # rwork(5) is the initial step size of LSODA
+        rwork[4] = min(first_step, timestep)
     while solver.successful() and solver.t < timestep:
         solver.integrate(solver.t + timestep)
     return solver.y
+
+
+def lsoda_work_array(solver):
+    """real work array of LSODA (optional inputs and outputs of the
+    integrator), scipy keeps it in private attributes
+
+    Arguments:
+        solver {scipy.integrate.ode} -- solver
+
+    Returns:
+        np.array -- rwork or None for other integrators
+    """
+    integrator = getattr(solver, '_integrator', None)
+    if type(integrator).__name__ != 'lsoda':
+        return None
+    return getattr(integrator, 'rwork', None)
+
+
+def next_step_size(solver):
+    """step size LSODA would attempt next (rwork(12), HCUR)
+
+    Arguments:
+        solver {scipy.integrate.ode} -- solver after integration
+
+    Returns:
+        float -- step size, 0 if it is not available (other integrators)
+    """
+    rwork = lsoda_work_array(solver)
+    if rwork is None:
+        return 0.0
+    return float(rwork[11])
@@ -1,4 +1,205 @@
+import warnings
+
+import numpy as np
+from scipy.linalg import null_space
+
+
 def solve_henry_law(totC_vec, HenryC):
     g = totC_vec / (1 + HenryC)
     a = totC_vec - g
     return g, a
+
+
+class MassActionSystem:
+    """Fast equilibria given by mass action laws (tableau of components)
+
+    Every species is either a component or a complex of components,
+    concentration of the complex is
+
+        [complex] = K * prod([component_i]**nu_i),
+
+    e.g. aqueous species in Henry equilibrium with gas ([aq] = Hcc*[gas]),
+    complexation, linear sorption ([sorbed] = Kd*[aq]) or Langmuir sorption
+    with free sites as component ([sorbed] = K*[aq]*[sites]). Totals of
+    components (mass balances) are conserved. All cells are solved at once
+    by Newton-Raphson method on logarithms of concentrations of components.
+    """
+
+    def __init__(self):
+        self.components = []
+        self.complexes = []
+        self.stoichiometry = {}
+        self.log_k = {}
+        self.log_free = None
+        self.log_totals = None
+
+    def add_complex(self, name, K, stoichiometry):
+        """adds complex in equilibrium with components
+
+        Species in stoichiometry, which are not complexes, become components;
+        complexes are replaced by their components.
+
+        Arguments:
+            name {str} -- name of the complex
+            K {float} -- equilibrium constant
+            stoichiometry {dict} -- coefficients of species, e.g. {'CO2g': 1}
+        """
+        if name in self.components or name in self.complexes:
+            raise ValueError(
+                "{} is already in the equilibrium system.".format(name))
+        nu = {}
+        log_k = np.log(K)
+        for species, coef in stoichiometry.items():
+            if species in self.complexes:
+                log_k += coef * self.log_k[species]
+                for c, c_coef in self.stoichiometry[species].items():
+                    nu[c] = nu.get(c, 0) + coef * c_coef
+            else:
+                if species not in self.components:
+                    self.components.append(species)
+                nu[species] = nu.get(species, 0) + coef
+        self.complexes.append(name)
+        self.stoichiometry[name] = nu
+        self.log_k[name] = log_k
+        self.log_free = None
+        self.log_totals = None
+
+    @property
+    def species(self):
+        """names of all species (components first, then complexes)
+
+        Returns:
+            list -- names of species
+        """
+        return self.components + self.complexes
+
+    def matrix(self):
+        """stoichiometric matrix and logarithms of equilibrium constants
+
+        Returns:
+            tuple -- matrix (species x components) and vector of ln K
+        """
+        nu = np.eye(len(self.components), len(self.components))
+        log_k = np.zeros(len(self.components))
+        if self.complexes:
+            complexes = np.array([[
+                self.stoichiometry[s].get(c, 0) for c in self.components
+            ] for s in self.complexes], dtype=float)
+            nu = np.vstack([nu, complexes])
+            log_k = np.append(log_k, [self.log_k[s] for s in self.complexes])
+        return nu, log_k
+
+    def solve(self, conc, tol=1e-10, max_iter=50, max_step=2.):
+        """redistributes species to equilibrium conserving totals of
+        components
+
+        Previous solution (self.log_free) is used as initial guess if the
+        shape of concentrations did not change (warm start) for components
+        which were present in the previous solution and whose totals changed
+        at most by factor exp(max_step) (self.log_totals), other components
+        start from their totals.
+
+        Arguments:
+            conc {list} -- concentrations of species (vectors of size N) in
+            the order of self.species
+
+        Keyword Arguments:
+            tol {float} -- relative tolerance of mass balances
+            (default: {1e-10})
+            max_iter {int} -- maximum number of iterations (default: {50})
+            max_step {float} -- maximum change of logarithm of concentration
+            of components in one iteration (default: {2.})
+
+        Returns:
+            list -- concentrations of species at equilibrium (unchanged in
+            cells where iterations did not converge, RuntimeWarning is
+            issued)
+        """
+        nu, log_k = self.matrix()
+        conc = np.array([np.asarray(c, dtype=float) for c in conc])
+        shape = conc.shape[1:]
+        conc = conc.reshape(len(nu), -1).T
+        totals = conc.dot(nu)
+        # components with zero total are absent, as well as species formed
+        # by them, absent components are excluded from iterations
+        absent = totals <= 0
+        present = ~absent.dot(nu.T != 0)
+        totals = np.where(absent, 1., totals)
+        log_totals = np.log(totals)
+        log_free = log_totals.copy()
+        if self.log_free is not None and self.log_free.shape == totals.shape:
+            # absent components have nan previous totals (no warm start)
+            with np.errstate(invalid='ignore'):
+                warm = np.abs(log_totals - self.log_totals) <= max_step
+            log_free[warm] = self.log_free[warm]
+        log_free[absent] = 0.
+
+        idx = np.arange(totals.shape[0])
+        for _ in range(max_iter):
+            species = np.exp(log_k + log_free[idx].dot(nu.T)) * present[idx]
+            residual = species.dot(nu) - totals[idx]
+            residual[absent[idx]] = 0
+            converged = np.all(
+                np.abs(residual) <= tol * species.dot(np.abs(nu)), axis=1)
+            jac = np.matmul(nu.T * species[:, np.newaxis, :], nu)
+            diagonal = np.arange(len(self.components))
+            jac[:, diagonal, diagonal] += absent[idx]
+            step = np.linalg.solve(jac, residual[..., np.newaxis])[..., 0]
+            log_free[idx] -= np.clip(step, -max_step, max_step)
+            idx = idx[~converged]
+            if idx.size == 0:
+                break
+        else:
+            warnings.warn(
+                'Unsuccessful equilibrium solution in {} of {} cells, '
+                'concentrations are kept in these cells.'.format(
+                    idx.size, totals.shape[0]), RuntimeWarning)
+
+        # failed cells are not warm started by the next solution
+        failed = np.zeros(totals.shape[0], dtype=bool)
+        failed[idx] = True
+        self.log_free = log_free
+        self.log_totals = np.where(absent | failed[:, np.newaxis], np.nan,
+                                   log_totals)
+        species = np.exp(log_k + log_free.dot(nu.T)) * present
+        species[failed] = conc[failed]
+        return list(species.T.reshape((len(nu), ) + shape))
+
+
+def common_invariants(first, second, tol=1e-10):
+    """linear invariants (conserved totals) common to two equilibrium
+    projections, each projection conserves linear combinations of species
+    given by rows of its matrix
+
+    Rows of the result are in reduced row echelon form, so species which
+    are not in equilibrium stay unit rows and totals of equilibrium groups
+    are not mixed with other species.
+
+    Arguments:
+        first {np.array} -- invariants of the first projection
+        (number of invariants x species)
+        second {np.array} -- invariants of the second projection
+
+    Keyword Arguments:
+        tol {float} -- tolerance of pivots (default: {1e-10})
+
+    Returns:
+        np.array -- common invariants (number of invariants x species)
+    """
+    null = null_space(np.hstack([first.T, -second.T]))
+    basis = first.T.dot(null[:first.shape[0]]).T
+    rows = 0
+    for col in range(basis.shape[1]):
+        if rows == basis.shape[0]:
+            break
+        pivot = rows + np.argmax(np.abs(basis[rows:, col]))
+        if abs(basis[pivot, col]) < tol:
+            continue
+        basis[[rows, pivot]] = basis[[pivot, rows]]
+        basis[rows] /= basis[rows, col]
+        others = np.arange(basis.shape[0]) != rows
+        basis[others] -= np.outer(basis[others, col], basis[rows])
+        rows += 1
+    basis = basis[:rows]
+    basis[np.abs(basis) < tol] = 0
+    return basis
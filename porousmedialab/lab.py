@@ -2,6 +2,7 @@
 """
 
 import sys
+import tempfile
 import time
 import traceback
 
@@ -15,10 +16,268 @@ from porousmedialab.dotdict import DotDict
 import porousmedialab.saver as saver
 
 
+class LazyRates(DotDict):
+    """estimated rates computed on demand
+
+    Rate is estimated (for all cells and saved time steps) when it is
+    accessed for the first time and then kept; invalidate() drops all
+    estimated rates, e.g. after new solve(). Rates of a subset of saved
+    time steps can be estimated without the whole history, see subset().
+    """
+
+    def __init__(self, names=(), estimate=None, allocate=None):
+        """
+        Arguments:
+            names {list} -- names of rates
+
+        Keyword Arguments:
+            estimate {function} -- estimate(names, columns) returns dict
+            of rates, columns are indices of saved time steps (None for
+            all), see Lab.estimate_rates (default: {None})
+            allocate {function} -- allocate(name) returns zero array for
+            rates stored during the run, see store() (default: {None})
+        """
+        super().__init__({name: None for name in names})
+        object.__setattr__(self, 'estimate', estimate)
+        object.__setattr__(self, 'allocate', allocate)
+        object.__setattr__(self, 'subsets', {})
+
+    def __getitem__(self, name):
+        if dict.__getitem__(self, name) is None:
+            self.update_estimated(self.estimate([name], None))
+        return dict.__getitem__(self, name)
+
+    def __getattr__(self, name):
+        return self.get(name)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def items(self):
+        return [(name, self[name]) for name in self]
+
+    def values(self):
+        return [self[name] for name in self]
+
+    def update_estimated(self, rates):
+        """keeps estimated rates which are not known yet
+
+        Arguments:
+            rates {dict} -- rates for all saved time steps
+        """
+        for name, r in rates.items():
+            if dict.get(self, name, 0) is None:
+                dict.__setitem__(self, name, r)
+
+    def subset(self, name, columns):
+        """rate for a subset of saved time steps, estimated only for
+        these time steps (and cached) if the whole rate is not known yet
+
+        Arguments:
+            name {str} -- name of the rate
+            columns {slice or np.array} -- indices of saved time steps
+
+        Returns:
+            np.array -- rate (N x number of selected time steps)
+        """
+        rate = dict.__getitem__(self, name)
+        if rate is not None:
+            return rate[:, columns]
+        if isinstance(columns, slice):
+            key = (name, columns.start, columns.stop, columns.step)
+        else:
+            key = (name, np.asarray(columns).tobytes())
+        if key not in self.subsets:
+            self.subsets[key] = self.estimate([name], columns)[name]
+        return self.subsets[key]
+
+    def store(self, name, column, rate):
+        """stores rate estimated during the run
+
+        Arguments:
+            name {str} -- name of the rate
+            column {int} -- index of saved time step
+            rate {np.array} -- rate in all cells
+        """
+        if dict.__getitem__(self, name) is None:
+            dict.__setitem__(self, name, self.allocate(name))
+        dict.__getitem__(self, name)[:, column] = rate
+
+    def invalidate(self):
+        """drops all estimated and stored rates
+        """
+        for name in self:
+            dict.__setitem__(self, name, None)
+        self.subsets.clear()
+
+
+class Profiles(DotDict):
+    """current state of the lab: profiles of all species in one contiguous
+    block (species x cells)
+
+    Rows of the block (self.block) follow the order in which species were
+    added (self.index maps names to rows). profiles[name] is a view of the
+    row and assigning a profile copies it in the block, so stages of the
+    solution can read and write all species at once (see rows and
+    set_block). Parameters of species (see Species) are kept in parallel
+    arrays self.parameters (one row per species).
+    """
+
+    # parameters kept in arrays and codes of boundary conditions types
+    per_cell = ('theta', 'D', 'w')
+    per_species = ('bc_top_value', 'bc_bot_value', 'int_transport')
+    boundary_types = {'dirichlet': 1, 'constant': 1, 'flux': 0, 'neumann': 0}
+
+    def __init__(self):
+        object.__setattr__(self, 'block', np.zeros((0, 0)))
+        object.__setattr__(self, 'index', {})
+        object.__setattr__(self, 'parameters', {})
+        object.__setattr__(self, 'species', {})
+
+    def __setitem__(self, name, profile):
+        if name not in self.index:
+            self.add(name, np.size(profile))
+        row = self.index[name]
+        self.block[row] = profile
+        dict.__setitem__(self, name, self.block[row])
+
+    __setattr__ = __setitem__
+
+    def add(self, name, size):
+        """adds row of the species (zero profile) if it is new
+
+        Arguments:
+            name {str} -- name of the species
+            size {int} -- number of cells
+
+        Returns:
+            Species -- parameters of the species bound to its row
+        """
+        if name not in self.index:
+            n = len(self.index)
+            if n:
+                block = np.vstack([self.block, np.zeros(self.block.shape[1])])
+            else:
+                block = np.zeros((1, size))
+            object.__setattr__(self, 'block', block)
+            self.index[name] = n
+            for key, values in self.parameters.items():
+                grown = np.zeros((n + 1, ) + values.shape[1:], values.dtype)
+                grown[:n] = values
+                self.parameters[key] = grown
+            for elem, row in self.index.items():
+                dict.__setitem__(self, elem, self.block[row])
+            for species in self.species.values():
+                species.bind()
+        self.species[name] = Species(self, name)
+        return self.species[name]
+
+    def set_parameter(self, name, key, value):
+        """writes parameter of the species in its parallel array
+
+        Arguments:
+            name {str} -- name of the species
+            key {str} -- name of the parameter
+            value -- value of the parameter
+
+        Returns:
+            value to keep in the dictionary of the species: view of the
+            array for arrays (e.g. theta), else the value itself
+        """
+        if key in self.per_cell:
+            shape, dtype = (self.block.shape[1], ), float
+        elif key.endswith('_type'):
+            shape, dtype = (), int
+        else:
+            shape, dtype = (), float
+        if key not in self.parameters:
+            self.parameters[key] = np.zeros((len(self.index), ) + shape,
+                                            dtype)
+        row = self.index[name]
+        if key.endswith('_type'):
+            self.parameters[key][row] = self.boundary_types.get(value, -1)
+        else:
+            self.parameters[key][row] = value
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            return self.parameters[key][row]
+        return value
+
+    def rows(self, names):
+        """rows of the species in the block
+
+        Arguments:
+            names {list} -- names of species
+
+        Returns:
+            np.array -- indices of rows
+        """
+        return np.array([self.index[name] for name in names], dtype=int)
+
+    def get_block(self, names):
+        """profiles of the species (species x cells), a view of the whole
+        block if names are all species in the order of rows
+
+        Arguments:
+            names {list} -- names of species
+
+        Returns:
+            np.array -- profiles
+        """
+        rows = self.rows(names)
+        if np.array_equal(rows, np.arange(len(self.index))):
+            return self.block
+        return self.block[rows]
+
+    def set_block(self, names, profiles):
+        """writes profiles of the species (species x cells) in the block
+
+        Arguments:
+            names {list} -- names of species
+            profiles {np.array} -- new profiles
+        """
+        self.block[self.rows(names)] = profiles
+
+
+class Species(DotDict):
+    """parameters and results of one species
+
+    Parameters listed in Profiles.per_cell and Profiles.per_species and
+    types of boundary conditions (as codes) are also written in parallel
+    arrays of Profiles, arrays (e.g. theta) are kept as views of them.
+    """
+
+    def __init__(self, profiles, name):
+        object.__setattr__(self, 'profiles', profiles)
+        object.__setattr__(self, 'name', name)
+
+    def __setitem__(self, key, value):
+        if (key in Profiles.per_cell or key in Profiles.per_species
+                or key in ('bc_top_type', 'bc_bot_type')):
+            value = self.profiles.set_parameter(self.name, key, value)
+        dict.__setitem__(self, key, value)
+
+    __setattr__ = __setitem__
+
+    def bind(self):
+        """binds arrays of parameters to the (reallocated) parallel arrays
+        """
+        row = self.profiles.index[self.name]
+        for key, values in self.profiles.parameters.items():
+            if isinstance(dict.get(self, key), np.ndarray):
+                dict.__setitem__(self, key, values[row])
+
+
 class Lab:
     """The batch experiments simulations"""
 
-    def __init__(self, tend, dt, tstart=0):
+    def __init__(self,
+                 tend,
+                 dt,
+                 tstart=0,
+                 save_every=1,
+                 output_times=None,
+                 storage='memory',
+                 scratch_dir=None):
         """ init function
 
         initialize the lab class
@@ -29,23 +288,53 @@ class Lab:
 
         Keyword Arguments:
             tstart {float} -- start time of computation (default: {0})
+            save_every {int} -- save results every k-th time step
+            (default: {1})
+            output_times {np.array} -- times when results are saved,
+            overrides save_every (default: {None})
+            storage {str} -- storage of results: 'memory' (numpy arrays)
+            or 'memmap' (files in scratch_dir) (default: {'memory'})
+            scratch_dir {str} -- folder for memmap files, temporary
+            folder if None (default: {None})
         """
 
         self.tend = tend
         self.dt = dt
         self.time = np.linspace(tstart, tend, round(tend / dt) + 1)
+        self.init_output_schedule(save_every, output_times)
+        self.storage = storage
+        if storage == 'memmap':
+            if scratch_dir is None:
+                scratch_dir = tempfile.mkdtemp(prefix='porousmedialab_')
+            saver.create_memmap(scratch_dir, 'time',
+                                self.output_time.shape)[:] = self.output_time
+        self.scratch_dir = scratch_dir
         self.species = DotDict({})
         self.dynamic_functions = DotDict({})
-        self.profiles = DotDict({})
+        self.profiles = Profiles()
         self.dcdt = DotDict({})
         self.rates = DotDict({})
-        self.estimated_rates = DotDict({})
+        self.estimated_rates = LazyRates()
+        self.rates_chunk_size = None
         self.constants = DotDict({})
         self.functions = DotDict({})
         self.henry_law_equations = []
+        self.mass_action_equilibria = []
+        self.equilibrium_system = equilibriumsolver.MassActionSystem()
         self.acid_base_components = []
         self.acid_base_system = phcalc.System()
         self.ode_method = 'scipy'
+        self.vectorized_reactions = True
+        self.use_numba = False
+        self.warm_start_reactions = True
+        self.reaction_step_seed = None
+        self.reaction_activity_threshold = None
+        self.pH_tolerance = 1e-6
+        self.pH_tables = True
+        self.coupled_equilibria = False
+        self.reaction_cells = DotDict({'integrated': 0, 'skipped': 0})
+        self.code_cache_dir = desolver.default_cache_dir()
+        self.output_stream = None
 
     def __getattr__(self, attr):
         """dot notation for species
@@ -62,21 +351,123 @@ class Lab:
 
         return self.species[attr]
 
-    def save_results_in_hdf5(self):
+    def init_output_schedule(self, save_every=1, output_times=None):
+        """defines time steps which are saved in the results
+
+        Results (concentrations, rates) are stored only for the scheduled
+        steps, self.output_time is the time axis of the stored results.
+        Initial conditions (step 0) are always saved.
+
+        Keyword Arguments:
+            save_every {int} -- save every k-th time step (default: {1})
+            output_times {np.array} -- times to save, rounded to the nearest
+            time step (default: {None})
+        """
+
+        if output_times is None:
+            steps = np.arange(0, self.time.size, save_every)
+        else:
+            steps = np.round((np.asarray(output_times, dtype=float) -
+                              self.time[0]) / self.dt).astype(int)
+            steps = np.unique(
+                np.clip(np.append(0, steps), 0, self.time.size - 1))
+        self.output_steps = steps
+        self.output_time = self.time[steps]
+        self.output_column = np.full(self.time.size, -1, dtype=int)
+        self.output_column[steps] = np.arange(steps.size)
+
+    def allocate_results_array(self, key, n_columns=None):
+        """allocates zero matrix N x n_columns for results
+
+        With memmap storage the array is a transposed view of time-major
+        file in scratch_dir, so writing a time step [:, j] is contiguous.
+        Files can be reopened with saver.load_memmap_results(scratch_dir).
+
+        Arguments:
+            key {str} -- name of the array, e.g. 'concentration/O2'
+
+        Keyword Arguments:
+            n_columns {int} -- number of columns, number of saved time
+            steps if None (default: {None})
+
+        Returns:
+            np.array -- array N x n_columns
+        """
+
+        if n_columns is None:
+            n_columns = self.output_time.size
+        if self.storage == 'memmap':
+            return saver.create_memmap(self.scratch_dir, key,
+                                       (n_columns, self.N)).T
+        return np.zeros((self.N, n_columns))
+
+    def save_profiles(self, i):
+        """saves current profiles of all species in the results if
+        time step is in the output schedule
+
+        Arguments:
+            i {int} -- index of time
+        """
+
+        if (self.output_stream is not None
+                and i % self.output_stream.save_every == 0):
+            data = {'concentrations': self.profiles}
+            if self.rates:
+                data['estimated_rates'] = self.rates_of_profiles(self.profiles)
+            self.output_stream.append(self.time[i], data)
+        j = self.output_column[i]
+        if j < 0:
+            return
+        for element, profile in zip(self.species,
+                                    self.profiles.get_block(self.species)):
+            self.species[element]['concentration'][:, j] = profile
+
+    def stream_results_to_hdf5(self,
+                               filename='results.h5',
+                               block_size=100,
+                               save_every=1):
+        """appends concentrations and rates to hdf5 file during
+        the next solve(), independently of the output schedule of
+        results in memory
+
+        Arguments:
+            filename {str} -- name of the file (default: {'results.h5'})
+            block_size {int} -- number of time steps written at once
+            (default: {100})
+            save_every {int} -- append every k-th time step (default: {1})
+        """
+        self.output_stream = saver.HDF5Stream(filename, block_size, save_every)
+        self.output_stream.save_dict(
+            '/', {
+                'rates': self.rates,
+                'parameters': {k: str(v) for k, v in self.constants.items()}
+            })
+
+    def close_output_stream(self):
+        """flushes and closes the hdf5 stream
+        """
+        if self.output_stream is not None:
+            self.output_stream.close()
+            self.output_stream = None
+
+    def save_results_in_hdf5(self, filename='results.h5'):
         """concentrations and rate profiles in the
         hdf5 files
+
+        Keyword Arguments:
+            filename {str} -- name of the file (default: {'results.h5'})
         """
         self.reconstruct_rates()
         concentrations = {k: v['concentration'] for k, v in self.species.items()}
 
         results = {}
-        results['time'] = self.time
+        results['time'] = self.output_time
         results['concentrations'] = concentrations
         results['estimated_rates'] = self.estimated_rates
         results['rates'] = self.rates
         results['parameters'] = {k: str(v) for k, v in self.constants.items()}
 
-        saver.save_dict_to_hdf5(results, 'results.h5')
+        saver.save_dict_to_hdf5(results, filename)
 
     def solve(self, verbose=True):
         """ solves coupled PDEs
@@ -98,7 +489,9 @@ class Lab:
                         '\nABORT!!!: Numerical instability... Please, adjust dt and dx manually...'
                     )
                     traceback.print_exc()
+                    self.close_output_stream()
                     sys.exit()
+        self.close_output_stream()
 
         # temporal hack for time dependent variables
         if 'TIME' in self.species:
@@ -131,59 +524,67 @@ class Lab:
                   time.strftime("%Y-%m-%d %H:%M:%S",
                                 time.localtime(time.time() + total_t)))
 
-    def henry_equilibrium_integrate(self, i):
-        """integrates Henry equlibrium reactions
+    def create_equilibrium_system(self):
+        """creates system of fast equilibria (Henry law and mass action
+        equilibria) solved by equilibriumsolver.MassActionSystem
+        """
+        self.equilibrium_system = equilibriumsolver.MassActionSystem()
+        for eq in self.henry_law_equations:
+            self.equilibrium_system.add_complex(eq['aq'], eq['Hcc'],
+                                                {eq['gas']: 1})
+        for eq in self.mass_action_equilibria:
+            self.equilibrium_system.add_complex(eq['species'], eq['K'],
+                                                eq['stoichiometry'])
 
-        Estimates the destribution of species using functions from
-        equilibriumsolver, and, then, updated the profiles with new
-        concentrations
+    def equilibrium_integrate(self, i):
+        """integrates fast equilibrium reactions
+
+        Estimates the distribution of all species in Henry and mass action
+        equilibria in all cells at once (one call of
+        MassActionSystem.solve, warm started from the previous time step),
+        and, then, updates the profiles with new concentrations
 
         Arguments:
             i {int} -- index of time
         """
 
-        for eq in self.henry_law_equations:
-            self.species[eq['gas']]['concentration'][:, i], self.species[eq[
-                'aq']][
-                    'concentration'][:, i] = equilibriumsolver.solve_henry_law(
-                        self.species[eq['aq']]['concentration'][:, i] +
-                        self.species[eq['gas']]['concentration'][:, i],
-                        eq['Hcc'])
-            for elem in [eq['gas'], eq['aq']]:
-                self.profiles[elem] = self.species[elem]['concentration'][:, i]
-                if self.species[elem]['int_transport']:
-                    self.update_matrices_due_to_bc(elem, i)
+        names = self.equilibrium_system.species
+        conc = self.equilibrium_system.solve(self.profiles.get_block(names))
+        self.profiles.set_block(names, conc)
+        self.update_matrices_due_to_bc_of_species(names, i)
+        self.restart_reactions()
+
+    def henry_equilibrium_integrate(self, i):
+        """integrates Henry equlibrium reactions, see equilibrium_integrate
+
+        Arguments:
+            i {int} -- index of time
+        """
+        self.equilibrium_integrate(i)
 
     def acid_base_solve_ph(self, i):
         """solves acid base reactions
 
         solves acid-base using function from phcalc. First, it sums the total
-        concentration for particular species, then, estimates pH. if it idx=0,
-        then it uses "greedy" algorithm, else, uses +-0.1 of previous pH and
-        finds minimum around it.
+        concentration for particular species, then, estimates pH in all cells
+        at once by safeguarded Newton method on the charge balance
+        (System.pHsolve_newton) starting from pH of the previous time-step.
+        If self.pH_tables is True the charge balance is interpolated from
+        tables built in create_acid_base_system and the solution is polished
+        by the exact charge balance.
 
         Arguments:
-            i {[type]} -- [description]
+            i {int} -- step in time
         """
 
+        for c in self.acid_base_components:
+            init_conc = 0
+            for element in c['species']:
+                init_conc = init_conc + self.profiles[element]
+            c['pH_object'].conc = init_conc
         # initial guess from previous time-step
-        res = self.species['pH']['concentration'][0, i - 1]
-        for idx_j in range(self.N):
-            for c in self.acid_base_components:
-                init_conc = 0
-                for element in c['species']:
-                    init_conc += self.species[element]['concentration'][idx_j,
-                                                                        i]
-                c['pH_object'].conc = init_conc
-            if idx_j == 0:
-                self.acid_base_system.pHsolve(guess=7, tol=1e-4)
-                res = self.acid_base_system.pH
-            else:
-                phs = np.linspace(res - 0.1, res + 0.1, 201)
-                idx = self.acid_base_system._diff_pos_neg(phs).argmin()
-                res = phs[idx]
-            self.species['pH']['concentration'][idx_j, i] = res
-            self.profiles['pH'][idx_j] = res
+        self.profiles['pH'][:] = self.acid_base_system.pHsolve_newton(
+            guess=self.profiles['pH'], tol=self.pH_tolerance)
 
     def add_partition_equilibrium(self, aq, gas, Hcc):
         """ For partition reactions between 2 species
@@ -195,6 +596,27 @@ class Lab:
         """
         self.henry_law_equations.append({'aq': aq, 'gas': gas, 'Hcc': Hcc})
 
+    def add_mass_action_equilibrium(self, species, K, stoichiometry):
+        """ For fast equilibrium of species with other species (components)
+        given by mass action law:
+
+            [species] = K * prod([component]**coefficient)
+
+        e.g. complexation, linear sorption ({'Fe': 1}) or Langmuir sorption
+        with free sites as another species ({'PO4': 1, 'Sites': 1}); totals
+        of components are conserved.
+
+        Arguments:
+            species {str} -- name of the species (complex)
+            K {float} -- equilibrium constant
+            stoichiometry {dict} -- coefficients of components
+        """
+        self.mass_action_equilibria.append({
+            'species': species,
+            'K': K,
+            'stoichiometry': stoichiometry
+        })
+
     def henry_equilibrium(self, aq, gas, Hcc):
         """ For partition reactions between 2 species
 
@@ -245,32 +667,123 @@ class Lab:
 
         self.acid_base_solve_ph(i)
         self.acid_base_update_concentrations(i)
+        self.restart_reactions()
 
     def init_rates_arrays(self):
-        """allocates zero matrices for rates
+        """creates mapping of estimated rates, rates are estimated when
+        accessed (see LazyRates and estimate_rates)
         """
 
-        for rate in self.rates:
-            self.estimated_rates[rate] = np.zeros((self.N, self.time.size))
+        self.estimated_rates = LazyRates(
+            self.rates, self.estimate_rates,
+            lambda rate: self.allocate_results_array('estimated_rates/' + rate))
 
     def create_dynamic_functions(self):
         """create strings of dynamic functions for scipy solver and later execute
         them using exec(), potentially not safe but haven't found better approach yet.
+        The functions are saved as module in self.code_cache_dir (keyed by
+        hash of the model) and loaded from there by later runs, set it to
+        None to execute them in memory only. Constants are passed as vector
+        of parameters, so changing constants does not create new module.
+        If numba is installed and self.use_numba is True the functions are
+        compiled with numba (functions which numba can not compile are kept
+        as they are).
+        """
+
+        module = self.load_model_module()
+        parameters = self.parameters_vector()
+        y = self.init_state()
+        self.dynamic_functions['dydt_str'] = module.source
+        self.dynamic_functions['parameters'] = parameters
+        self.dynamic_functions['dydt'] = self.compile_dynamic_function(
+            module.f, 0.0, y, parameters)
+        self.dynamic_functions['dydt_cell'] = self.compile_dynamic_function(
+            module.f_cell, 0.0, y, parameters)
+        self.dynamic_functions['jac'] = None
+        self.dynamic_functions['jac_cell'] = None
+        if module.jac is not None:
+            self.dynamic_functions['jac'] = self.compile_dynamic_function(
+                module.jac, 0.0, y, parameters)
+            self.dynamic_functions['jac_cell'] = self.compile_dynamic_function(
+                module.jac_cell, 0.0, y, parameters)
+        # cells integrated one by one use functions evaluated on scalars
+        self.dynamic_functions['solver'] = desolver.create_solver(
+            self.dynamic_functions['dydt_cell'],
+            jac=self.dynamic_functions['jac_cell'],
+            parameters=parameters)
+        self.dynamic_functions['column_solver'] = desolver.create_solver(
+            self.dynamic_functions['dydt'],
+            band=len(self.species) - 1,
+            jac=self.dynamic_functions['jac'],
+            parameters=parameters)
+        self.dynamic_functions['step_sizes'] = np.zeros(self.N)
+        self.dynamic_functions['column_step'] = 0.0
+        self.restart_reactions()
+        self.reaction_cells = DotDict({'integrated': 0, 'skipped': 0})
+        self.create_rate_functions()
+
+    def create_rate_functions(self):
+        """create rates function for scipy solver (from model module),
+        the function is used for estimation of rates
+        """
+
+        module = self.load_model_module()
+        parameters = self.parameters_vector()
+        self.dynamic_functions['rates_str'] = module.source
+        self.dynamic_functions['rates_species'] = list(self.species)
+        self.dynamic_functions['parameters'] = parameters
+        self.dynamic_functions['rates'] = self.compile_dynamic_function(
+            module.rates, self.init_state().reshape(1, -1), parameters)
+
+    def load_model_module(self):
+        """loads module with generated functions of the model, see
+        desolver.load_model_module
+
+        Returns:
+            module -- module with f, jac and rates
+        """
+        return desolver.load_model_module(self.species, self.functions,
+                                          self.constants, self.rates,
+                                          self.dcdt, self.code_cache_dir)
+
+    def parameters_vector(self):
+        """vector of constants passed to dynamic functions
+
+        Returns:
+            np.array -- values of constants
+        """
+        return np.array(list(self.constants.values()), dtype=float)
+
+    def compile_dynamic_function(self, function, *args):
+        """compiles dynamic function with numba if self.use_numba
+
+        Arguments:
+            function {function} -- function of model module
+            *args -- example arguments
+
+        Returns:
+            function -- compiled or the same function
         """
+        if not self.use_numba:
+            return function
+        return desolver.compile_function(
+            function, *args, cache=self.code_cache_dir is not None)
 
-        fun_str = desolver.create_ode_function(
-            self.species, self.functions, self.constants, self.rates, self.dcdt)
-        exec(fun_str)
-        self.dynamic_functions['dydt_str'] = fun_str
-        self.dynamic_functions['dydt'] = locals()['f']
-        self.dynamic_functions['solver'] = desolver.create_solver(locals()['f'])
+    def init_state(self):
+        """state of the first cell (vector of species), used as example
+        argument of dynamic functions
+
+        Returns:
+            np.array -- vector of concentrations
+        """
+        return self.profiles.get_block(self.species)[:, 0].astype(float)
 
     def reset(self):
         """resets the solution for re-run
         """
         for element in self.species:
-            self.profiles[element] = self.species[element]['concentration'][:,
-                                                                            0]
+            self.profiles[element] = self.species[element][
+                'concentration'][:, 0].copy()
 
     def pre_run_methods(self):
         """pre-run before solve
@@ -278,12 +791,20 @@ class Lab:
         for reaction solver
         """
         self.add_time_variable()
+        if self.henry_law_equations or self.mass_action_equilibria:
+            self.create_equilibrium_system()
         if len(self.acid_base_components) > 0:
             self.create_acid_base_system()
             self.acid_base_equilibrium_solve(0)
-        if self.ode_method is 'scipy':
+        if self.ode_method == 'scipy':
             self.create_dynamic_functions()
+        else:
+            self.dynamic_functions['kernels'] = desolver.NumExprKernels(
+                self.rates, self.dcdt)
+        if self.equilibria_coupled():
+            self.create_coupled_system()
         self.init_rates_arrays()
+        self.save_profiles(0)
 
     def change_concentration_profile(self, element, i, new_profile):
         """change concentration in profile vectors
@@ -296,72 +817,410 @@ class Lab:
 
         self.profiles[element] = new_profile
         self.update_matrices_due_to_bc(element, i)
+        self.restart_reactions()
+
+    def restart_reactions(self):
+        """marks jump of the state (e.g. equilibrium, changed boundary
+        conditions or profile), the next reaction step restarts LSODA
+        without step sizes of previous steps (see reaction_step_seed)
+        """
+        self.dynamic_functions['cold_restart'] = True
 
     def reactions_integrate_scipy(self, i):
         """integrates ODE of reactions
 
+        If self.vectorized_reactions is True all cells are integrated
+        together as one stiff system with block-diagonal (banded) Jacobian,
+        else each cell is integrated separately. If
+        self.warm_start_reactions is True LSODA continues from its previous
+        state when profiles did not change between time steps (e.g. batch
+        without equilibria), else it is restarted. Restarts choose their
+        initial step size, unless self.reaction_step_seed is set: fraction
+        of the last step size (of the cell if cells are integrated
+        separately) used as initial step size after transport. Seeds are
+        not used after jumps of the state (equilibria, changed boundary
+        conditions or profiles, see restart_reactions). Inactive cells (see
+        active_cells) are not integrated, the numbers of integrated and
+        skipped cells are counted in self.reaction_cells.
+
         Arguments:
             i {int} -- step in time
         """
 
         # C_new, rates_per_elem, rates_per_rate = desolver.ode_integrate(self.profiles, self.dcdt, self.rates, self.constants, self.dt, solver='rk4')
         # C_new, rates_per_elem = desolver.ode_integrate(self.profiles, self.dcdt, self.rates, self.constants, self.dt, solver='rk4')
-        # for idx_j in range(self.N):
-        for idx_j in range(self.N):
-            yinit = np.zeros(len(self.species))
-            for idx, s in enumerate(self.species):
-                yinit[idx] = self.profiles[s][idx_j]
-
-            ynew = desolver.ode_integrate_scipy(
-                self.dynamic_functions['solver'], yinit, self.dt)
-
-            for idx, s in enumerate(self.species):
-                self.species[s]['concentration'][idx_j, i] = ynew[idx]
+        y = self.profiles.get_block(self.species).T.copy()
+        active = self.active_cells(y)
+        n_active = np.count_nonzero(active)
+        self.reaction_cells['integrated'] += n_active
+        self.reaction_cells['skipped'] += self.N - n_active
+        C_new = y.T.copy()
+        seed = self.reaction_step_seed
+        if self.dynamic_functions['cold_restart']:
+            seed = None
+        if self.vectorized_reactions:
+            if n_active:
+                first_step = None
+                if seed and self.dynamic_functions['column_step'] > 0:
+                    first_step = seed * self.dynamic_functions['column_step']
+                C_new[:, active] = desolver.ode_integrate_scipy(
+                    self.dynamic_functions['column_solver'],
+                    y[active].ravel(),
+                    self.dt,
+                    warm_start=self.warm_start_reactions,
+                    first_step=first_step).reshape(n_active, -1).T
+                self.dynamic_functions['column_step'] = desolver.next_step_size(
+                    self.dynamic_functions['column_solver'])
+        else:
+            steps = self.dynamic_functions['step_sizes']
+            for idx_j in np.flatnonzero(active):
+                yinit = y[idx_j]
+                first_step = None
+                if seed and steps[idx_j] > 0:
+                    first_step = seed * steps[idx_j]
+                C_new[:, idx_j] = desolver.ode_integrate_scipy(
+                    self.dynamic_functions['solver'],
+                    yinit,
+                    self.dt,
+                    first_step=first_step)
+                steps[idx_j] = desolver.next_step_size(
+                    self.dynamic_functions['solver'])
+        self.dynamic_functions['cold_restart'] = False
+
+        self.profiles.set_block(self.species, C_new)
+        self.update_matrices_due_to_bc_of_species(self.species, i)
+
+    def update_matrices_due_to_bc_of_species(self, names, i):
+        """updates matrices due to boundary conditions of species
+        integrated by transport, e.g. after their profiles were changed
 
-        for element in self.species:
-            self.profiles[element] = self.species[element]['concentration'][:,
-                                                                            i]
+        Arguments:
+            names {list} -- names of species
+            i {int} -- step in time
+        """
+        for element in names:
             if self.species[element]['int_transport']:
                 self.update_matrices_due_to_bc(element, i)
 
-    def reconstruct_rates(self):
+    def active_cells(self, y):
+        """marks cells where reactions are active: change of some
+        concentration or some rate times the time step exceeds (in absolute
+        value) self.reaction_activity_threshold. All cells are evaluated at
+        once by vectorized rates and ode functions. The threshold is an
+        absolute change of concentration in one time step, so it depends on
+        units: by default (None) all cells are active. Set it when large
+        parts of the domain do not react, below the smallest change per
+        time step that matters for any species (trace species included)
+        and above changes caused by clipping of concentrations to 1e-16 in
+        the generated functions, e.g. 1e-14 for concentrations of order 1.
+
+        Arguments:
+            y {np.array} -- concentrations (number of cells x species)
+
+        Returns:
+            np.array -- boolean mask of active cells
+        """
+        threshold = self.reaction_activity_threshold
+        if threshold is None:
+            return np.ones(self.N, dtype=bool)
+        threshold = threshold / self.dt
+        parameters = self.dynamic_functions['parameters']
+        dydt = self.dynamic_functions['dydt'](0.0, y.ravel(), parameters)
+        active = np.any(np.abs(dydt.reshape(self.N, -1)) > threshold, axis=1)
+        if self.rates:
+            for r in self.dynamic_functions['rates'](y, parameters):
+                active |= np.abs(r) > threshold
+        return active
+
+    def equilibria_coupled(self):
+        """checks if fast equilibria are solved together with reactions
+        (see reactions_integrate_coupled): self.coupled_equilibria is True,
+        scipy solver is used and there are some equilibria
+
+        Returns:
+            bool -- True if equilibria are coupled with reactions
+        """
+        return bool(self.coupled_equilibria and self.ode_method == 'scipy' and
+                    (self.henry_law_equations or self.mass_action_equilibria
+                     or self.acid_base_components))
+
+    def create_coupled_system(self):
+        """creates invariants of fast equilibria and solver of reactions
+        formulated for them
+
+        Each equilibrium (mass action system and acid-base system) conserves
+        totals of its components and all species outside of it. Totals
+        conserved by both (rows of self.dynamic_functions['invariants'])
+        are not changed by equilibria, only by reactions, so the ODE of
+        reactions is integrated for them and species are recovered by
+        the equilibrium projection (see equilibrium_projection).
+        """
+        names = [s for s in self.species if s != 'pH']
+        column = {s: j for j, s in enumerate(names)}
+        groups = []
+        system = self.equilibrium_system
+        if system.complexes:
+            nu, _ = system.matrix()
+            groups.append([{s: nu[j, k]
+                            for j, s in enumerate(system.species)}
+                           for k in range(len(system.components))])
+        if self.acid_base_components:
+            groups.append([{s: 1.
+                            for s in c['species']}
+                           for c in self.acid_base_components])
+        invariants = []
+        for group in groups:
+            inside = set(s for row in group for s in row)
+            matrix = np.zeros((len(group) + len(names) - len(inside),
+                               len(names)))
+            for k, row in enumerate(group):
+                for s, coef in row.items():
+                    matrix[k, column[s]] = coef
+            outside = [column[s] for s in names if s not in inside]
+            matrix[len(group) + np.arange(len(outside)), outside] = 1
+            invariants.append(matrix)
+        if len(invariants) == 1:
+            invariants.append(np.eye(len(names)))
+        A = equilibriumsolver.common_invariants(*invariants)
+        self.dynamic_functions['invariants'] = A
+        self.dynamic_functions['invariants_pinv'] = np.linalg.pinv(A)
+        self.dynamic_functions['invariant_species'] = [
+            list(self.species).index(s) for s in names
+        ]
+        self.dynamic_functions['equilibria_overlap'] = len(groups) > 1 and bool(
+            set(system.species) & set(
+                s for c in self.acid_base_components for s in c['species']))
+        self.dynamic_functions['coupled_state'] = None
+        self.dynamic_functions['coupled_solver'] = desolver.create_solver(
+            self.coupled_dydt, band=A.shape[0] - 1)
+
+    def equilibrium_projection(self, y, tol=1e-10, max_iter=100):
+        """redistributes species to all fast equilibria conserving their
+        common invariants: mass action (and Henry) equilibria, then acid-base
+        equilibrium (see equilibrium_turn). If they share species the turns
+        are repeated until they agree; the turns are accelerated by secant
+        extrapolation, which keeps the invariants.
+
+        Arguments:
+            y {np.array} -- concentrations (number of cells x species)
+
+        Keyword Arguments:
+            tol {float} -- relative tolerance of the agreement of equilibria
+            (default: {1e-10})
+            max_iter {int} -- maximum number of turns (default: {100})
+
+        Returns:
+            np.array -- concentrations at equilibrium
+        """
+        concentrations = np.array([s != 'pH' for s in self.species])
+        g_old = f_old = None
+        for _ in range(max_iter):
+            g = self.equilibrium_turn(y.copy(), 1e-2 * tol)
+            if not self.dynamic_functions['equilibria_overlap']:
+                return g
+            scale = np.abs(g) + np.abs(g).max(axis=0) + np.finfo(float).tiny
+            f = (g - y) / scale
+            if np.all(np.abs(f) <= tol):
+                return g
+            y = g
+            if f_old is not None:
+                df = f - f_old
+                gamma = np.sum(df * f, axis=1) / np.maximum(
+                    np.sum(df * df, axis=1), np.finfo(float).tiny)
+                extrapolated = g - gamma[:, np.newaxis] * (g - g_old)
+                # extrapolation is used only if concentrations stay positive
+                valid = np.all(extrapolated[:, concentrations] >= 0, axis=1)
+                y = np.where(valid[:, np.newaxis], extrapolated, g)
+            f_old, g_old = f, g
+        print('Warning: Equilibria did not agree in {} turns!'.format(max_iter))
+        return g
+
+    def equilibrium_turn(self, y, tol):
+        """one turn of equilibrium_projection: solves mass action equilibria
+        and, then, acid-base equilibrium
+
+        Arguments:
+            y {np.array} -- concentrations (number of cells x species),
+            changed in place
+            tol {float} -- tolerance of solvers
+
+        Returns:
+            np.array -- concentrations
+        """
+        index = {s: j for j, s in enumerate(self.species)}
+        system = self.equilibrium_system
+        if system.complexes:
+            columns = [index[s] for s in system.species]
+            y[:, columns] = np.array(
+                system.solve(list(y[:, columns].T), tol=tol)).T
+        if self.acid_base_components:
+            for c in self.acid_base_components:
+                c['pH_object'].conc = y[:, [index[s] for s in c['species']
+                                           ]].sum(axis=1)
+            y[:, index['pH']] = self.acid_base_system.pHsolve_newton(
+                guess=y[:, index['pH']], tol=tol)
+            for c in self.acid_base_components:
+                alphas = np.reshape(c['pH_object'].alpha(y[:, index['pH']]),
+                                    (self.N, -1))
+                y[:, [index[s] for s in c['species']
+                      ]] = c['pH_object'].conc[:, np.newaxis] * alphas
+        return y
+
+    def speciate(self, u):
+        """concentrations of species at equilibrium with given invariants,
+        previous speciation (self.dynamic_functions['coupled_state']) is
+        corrected to match invariants and projected on equilibria
+
+        Arguments:
+            u {np.array} -- invariants (number of cells x invariants)
+
+        Returns:
+            np.array -- concentrations (number of cells x species)
+        """
+        A = self.dynamic_functions['invariants']
+        columns = self.dynamic_functions['invariant_species']
+        y = self.dynamic_functions['coupled_state'].copy()
+        y[:, columns] += (u - y[:, columns].dot(A.T)).dot(
+            self.dynamic_functions['invariants_pinv'].T)
+        y = self.equilibrium_projection(y)
+        self.dynamic_functions['coupled_state'] = y
+        return y
+
+    def coupled_dydt(self, t, u):
+        """ODE of reactions for invariants of fast equilibria
+
+        Arguments:
+            t {float} -- time
+            u {np.array} -- invariants (flattened, cells x invariants)
+
+        Returns:
+            np.array -- derivatives of invariants
+        """
+        A = self.dynamic_functions['invariants']
+        y = self.speciate(u.reshape(self.N, -1))
+        dydt = self.dynamic_functions['dydt'](
+            t, y.ravel(), self.dynamic_functions['parameters'])
+        dydt = dydt.reshape(self.N, -1)[:, self.dynamic_functions[
+            'invariant_species']]
+        return dydt.dot(A.T).ravel()
+
+    def reactions_integrate_coupled(self, i):
+        """integrates reactions together with fast equilibria (index-reduced
+        DAE): instead of splitting reactions and equilibria (which needs
+        small time steps when reactions are fast) the ODE of reactions is
+        integrated by LSODA for totals conserved by equilibria (see
+        create_coupled_system), while species are always at equilibrium.
+        Used if self.coupled_equilibria is True.
+
+        Arguments:
+            i {int} -- step in time
+        """
+        y = self.equilibrium_projection(
+            self.profiles.get_block(self.species).T.copy())
+        self.dynamic_functions['coupled_state'] = y
+        u = desolver.ode_integrate_scipy(
+            self.dynamic_functions['coupled_solver'],
+            y[:, self.dynamic_functions['invariant_species']].dot(
+                self.dynamic_functions['invariants'].T).ravel(), self.dt)
+        y = self.speciate(u.reshape(self.N, -1))
+        self.profiles.set_block(self.species, y.T)
+        self.update_matrices_due_to_bc_of_species(self.species, i)
+
+    def reconstruct_rates(self, chunk_size=None):
         """reconstructs rates after model run
-        1. estimates rates;
+        1. estimates rates (lazily: rates stored during the run are
+        dropped and every rate is estimated when accessed);
         2. estimates changes of concentrations
-        not sure if it works with dynamic functions of "scipy",
-        only with rk4 and butcher 5?
+
+        Keyword Arguments:
+            chunk_size {int} -- number of time steps estimated at once,
+            see estimate_rates (default: {None})
         """
         if self.ode_method == 'scipy':
-            rates_str = desolver.create_rate_function(
-                self.species, self.functions, self.constants, self.rates,
-                self.dcdt)
-            exec(rates_str, globals())
-            self.dynamic_functions['rates_str'] = rates_str
-            # from IPython.core.debugger import set_trace
-            # set_trace()
-            self.dynamic_functions['rates'] = globals()['rates']
-            yinit = np.zeros(len(self.species))
-
-            for idx_t in range(len(self.time)):
-                for idx_j in range(self.N):
-                    for idx, s in enumerate(self.species):
-                        yinit[idx] = self.species[s]['concentration'][idx_j,
-                                                                      idx_t]
-
-                    rates = self.dynamic_functions['rates'](yinit)
-
-                    for idx, r in enumerate(self.rates):
-                        self.estimated_rates[r][idx_j, idx_t] = rates[idx]
-        else:
-            for idx_t in range(len(self.time)):
-                for name, rate in self.rates.items():
-                    conc = {}
-                    for spc in self.species:
-                        conc[spc] = self.species[spc]['concentration'][:, idx_t]
-                    r = ne.evaluate(rate, {**self.constants, **conc})
-                    self.estimated_rates[name][:, idx_t] = r * (r > 0)
+            self.create_rate_functions()
+        if chunk_size is not None:
+            self.rates_chunk_size = chunk_size
+        self.estimated_rates.invalidate()
 
         for spc in self.species:
-            self.species[spc]['rates'] = (
+            self.species[spc]['rates'] = self.allocate_results_array(
+                'rates/' + spc, self.output_time.size - 1)
+            self.species[spc]['rates'][:] = (
                 self.species[spc]['concentration'][:, 1:] -
-                self.species[spc]['concentration'][:, :-1]) / self.dt
+                self.species[spc]['concentration'][:, :-1]) / np.diff(
+                    self.output_time)
+
+    def estimate_rates(self, names, columns=None):
+        """estimates rates from saved concentrations
+
+        Rates of all saved time steps are estimated for blocks of
+        self.rates_chunk_size time steps at once (about 2**20 values if
+        None) and stored in arrays from allocate_results_array.
+
+        Arguments:
+            names {list} -- names of rates
+
+        Keyword Arguments:
+            columns {slice or np.array} -- indices of saved time steps,
+            all if None (default: {None})
+
+        Returns:
+            dict -- rates (N x number of time steps), rates estimated
+            together with requested ones (scipy) are included
+        """
+        if self.ode_method == 'scipy' and self.dynamic_functions.get(
+                'rates_species') != list(self.species):
+            self.create_rate_functions()
+        if columns is not None:
+            conc = {}
+            for spc in self.species:
+                conc[spc] = np.asarray(
+                    self.species[spc]['concentration'][:, columns])
+            return self.rates_of_profiles(conc, names)
+        n_t = self.output_time.size
+        chunk_size = self.rates_chunk_size or max(1, 2**20 // self.N)
+        estimated_rates = {}
+        for start in range(0, n_t, chunk_size):
+            chunk = slice(start, min(start + chunk_size, n_t))
+            conc = {}
+            for spc in self.species:
+                conc[spc] = np.asarray(
+                    self.species[spc]['concentration'][:, chunk])
+            for name, r in self.rates_of_profiles(conc, names).items():
+                if name not in estimated_rates:
+                    estimated_rates[name] = self.allocate_results_array(
+                        'estimated_rates/' + name)
+                estimated_rates[name][:, chunk] = r
+        return estimated_rates
+
+    def rates_of_profiles(self, profiles, names=None):
+        """estimates rates for the given concentration profiles
+
+        Arguments:
+            profiles {dict} -- profiles of all species, vectors of size N
+            or arrays (N x number of time steps)
+
+        Keyword Arguments:
+            names {list} -- rates to estimate, all if None; scipy rates
+            function estimates all rates anyway (default: {None})
+
+        Returns:
+            dict -- arrays of rates (of the same shape as profiles)
+        """
+        estimated_rates = {}
+        if not self.rates:
+            return estimated_rates
+        shape = np.shape(profiles[next(iter(self.species))])
+        if self.ode_method == 'scipy':
+            y = np.stack([profiles[s] for s in self.species], axis=-1)
+            rates = self.dynamic_functions['rates'](
+                y.astype(float), self.dynamic_functions['parameters'])
+            for idx, r in enumerate(self.rates):
+                estimated_rates[r] = np.ones(shape) * rates[idx]
+        else:
+            for name, rate in self.rates.items():
+                if names is not None and name not in names:
+                    continue
+                r = ne.evaluate(rate, {**self.constants, **profiles})
+                estimated_rates[name] = np.ones(shape) * r * (r > 0)
+        return estimated_rates
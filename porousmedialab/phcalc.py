@@ -1,322 +1,632 @@
-import numpy as np
-import scipy.optimize as spo
-
-
-class Neutral(object):
-    """A nonreactive ion class.
-
-    This object defines things like K+ and Cl-, which contribute to the
-    overall charge balance, but do not have any inherent reactivity with
-    water.
-
-    Parameters
-    ----------
-    charge : int
-        The formal charge of the ion.
-
-    conc : float
-        The concentration of this species in solution.
-
-    Attributes
-    ----------
-    charge : int
-        The formal charge of the ion.
-
-    conc : float
-        The concentration of this species in solution.
-
-    """
-
-    def __init__(self, charge=None, conc=None):
-        if charge is None:
-            raise ValueError(
-                "The charge for this ion must be defined.")
-
-        self.charge = charge
-        self.conc = conc
-
-    def alpha(self, pH):
-        '''Return the fraction of each species at a given pH.
-
-        Parameters
-        ----------
-        pH : int, float, or Numpy Array
-            These are the pH value(s) over which the fraction should be
-            returned.
-
-        Returns
-        -------
-        Numpy NDArray
-            Because this is a non-reactive ion class, this function will
-            always return a Numpy array containing just 1.0's for all pH
-            values.
-
-        '''
-        if isinstance(pH, (int, float)):
-            length = 1
-        else:
-            length = len(pH)
-        ones = np.ones(length).reshape(-1, 1)
-        return ones
-
-
-class Acid(object):
-    '''An acidic species class.
-
-    This object is used to calculate a number of parameters related to a weak
-    acid in an aqueous solution.
-
-    Parameters
-    ----------
-    Ka : None (default), float, list, Numpy Array
-        This defines the Ka values for all acidic protons in this species. It
-        can be a single Ka value (float), a list of floats, or a Numpy array
-        of floats. Either this value or pKa needs to be defined. The other
-        will then be calculated from the given values.
-
-    pKa : None (default), float, list, Numpy Array
-        The pKa value(s) for all the acidic protons in this species.  This
-        follows the same rules as Ka (See Ka description for more details),
-        and either this value or Ka must be defined.
-
-    charge : None (default), int
-        This is the charge of the fully protonated form of this acid. This
-        must be defined.
-
-    conc : None (default), float
-        The formal concentration of this acid in solution. This value must be
-        defined.
-
-    Note
-    ----
-    There is no corresponding Base object. To define a base, you must use a
-    combination of an Acid and Neutral object. See the documentation for
-    examples.
-
-    '''
-
-    def __init__(self, Ka=None, pKa=None, charge=None, conc=None):
-        # Do a couple quick checks to make sure that everything has been
-        # defined.
-        if not Ka and not pKa:
-            raise ValueError(
-                "You must define either Ka or pKa values.")
-        elif charge is None:
-            raise ValueError(
-                "The maximum charge for this acid must be defined.")
-
-        # Make sure both Ka and pKa are calculated. For lists of values, be
-        # sure to sort them to ensure that the most acidic species is defined
-        # first.
-        elif not Ka:
-            if isinstance(pKa, (int, float)):
-                self.pKa = np.array([pKa, ], dtype=float)
-            else:
-                self.pKa = np.array(pKa, dtype=float)
-                self.pKa.sort()
-            self.Ka = 10**(-self.pKa)
-        elif not pKa:
-            if isinstance(Ka, (int, float)):
-                self.Ka = np.array([Ka, ], dtype=float)
-            else:
-                self.Ka = np.array(Ka, dtype=float)
-                # Ka values must be in reverse sort order
-                self.Ka.sort()
-                self.Ka = self.Ka[::-1]
-            self.pKa = -np.log10(self.Ka)
-        # This temporary Ka array will be used to calculate alpha values. It
-        # starts with an underscore so that it won't be confusing for others.
-        self._Ka_temp = np.append(1., self.Ka)
-
-        # Make a list of charges for each species defined by the Ka values.
-        self.charge = np.arange(charge, charge - len(self.Ka) - 1, -1)
-        # Make sure the concentrations are accessible to the object instance.
-        self.conc = conc
-
-    def alpha(self, pH):
-        '''Return the fraction of each species at a given pH.
-
-        Parameters
-        ----------
-        pH : int, float, or Numpy Array
-            These are the pH value(s) over which the fraction should be
-            returned.
-
-        Returns
-        -------
-        Numpy NDArray
-            These are the fractional concentrations at any given pH. They are
-            sorted from most acidic species to least acidic species. If a
-            NDArray of pH values is provided, then a 2D array will be
-            returned. In this case, each row represents the speciation for
-            each given pH.
-        '''
-        # If the given pH is not a list/array, be sure to convert it to one
-        # for future calcs.
-        if isinstance(pH, (int, float)):
-            pH = [pH, ]
-        pH = np.array(pH, dtype=float)
-
-        # Calculate the concentration of H3O+. If multiple pH values are
-        # given, then it is best to construct a two dimensional array of
-        # concentrations.
-        h3o = 10.**(-pH)
-        if len(h3o) > 1:
-            h3o = np.repeat(h3o.reshape(-1, 1), len(self._Ka_temp), axis=1)
-
-        # These are the powers that the H3O+ concentrations will be raised.
-        power = np.arange(len(self._Ka_temp))
-        # Calculate the H3O+ concentrations raised to the powers calculated
-        # above (in reverse order).
-        h3o_pow = h3o**(power[::-1])
-        # Calculate a cumulative product of the Ka values. The first value
-        # must be 1.0, which is why _Ka_temp is used instead of Ka.
-        Ka_prod = np.cumproduct(self._Ka_temp)
-        # Multiply the H3O**power values times the cumulative Ka product.
-        h3o_Ka = h3o_pow * Ka_prod
-
-        # Return the alpha values. The return signature will differ is the
-        # shape of the H3O array was 2-dimensional.
-        if len(h3o.shape) > 1:
-            den = h3o_Ka.sum(axis=1)
-            return h3o_Ka / den.reshape(-1, 1)
-        else:
-            den = h3o_Ka.sum()
-            return h3o_Ka / den
-
-
-class System(object):
-    '''An object used to define an a system of acid and neutral species.
-
-    This object accepts an arbitrary number of acid and neutral species
-    objects and uses these to calculate the pH of the system. Be sure to
-    include all of the species that completely define the contents of a
-    particular solution.
-
-    Parameters
-    ----------
-    *species
-        These are any number of Acid and Neutral objects that you'd like to
-        use to define your system.
-
-    Attibutes
-    ---------
-    species : list
-        This is a list containing all of the species that you input.
-
-    pHsolution
-        This is the full minimization output, which is defined by the function
-        scipy.optimize.minimize. This is only available after running the
-        pHsolve method.
-
-    pH : float
-        The pH of this particular system. This is only calculated after
-        running the pHsolve method.
-    '''
-
-    def __init__(self, *species):
-        self.species = species
-
-    def _diff_pos_neg(self, pH):
-        '''Calculate the charge balance difference.
-
-        Parameters
-        ----------
-        pH : int, float, or Numpy Array
-            The pH value(s) used to calculate the different distributions of
-            positive and negative species.
-
-        Returns
-        -------
-        float or Numpy Array
-            The absolute value of the difference in concentration between the
-            positive and negatively charged species in the system. A float is
-            returned if an int or float is input as the pH: a Numpy array is
-            returned if an array of pH values is used as the input.
-        '''
-        twoD = True
-        if isinstance(pH, (int, float)) or pH.shape[0] == 1:
-            twoD = False
-        else:
-            pH = np.array(pH, dtype=float)
-        # Calculate the h3o and oh concentrations and sum them up.
-        h3o = 10.**(-pH)
-        oh = (10.**(-14)) / h3o
-        x = (h3o - oh)
-
-        # Go through all the species that were given, and sum up their
-        # charge*concentration values into our total sum.
-        for s in self.species:
-            if not twoD:
-                x += (s.conc * s.charge * s.alpha(pH)).sum()
-            else:
-                x += (s.conc * s.charge * s.alpha(pH)).sum(axis=1)
-
-        # Return the absolute value so it never goes below zero.
-        return np.abs(x)
-
-    def pHsolve(self, guess=7.0, guess_est=False, est_num=1500,
-                method='Nelder-Mead', tol=1e-5):
-        '''Solve the pH of the system.
-
-        The pH solving is done using a simple minimization algorithm which
-        minimizes the difference in the total positive and negative ion
-        concentrations in the system. The minimization algorithm can be
-        adjusted using the `method` keyword argument. The available methods
-        can be found in the documentation for the scipy.optimize.minimize
-        function.
-
-        A good initial guess may help the minimization. It can be set manually
-        using the `guess` keyword, which defaults to 7.0. There is an
-        automated method that can be run as well if you set the `guess_est`
-        argument. This will override whatever you pass is for `guess`. The
-        `est_num` keyword sets the number of data points that you'd like to
-        use for finding the guess estimate. Too few points might start you
-        pretty far from the actual minimum; too many points is probably
-        overkill and won't help much. This may or may not speed things up.
-
-        Parameters
-        ----------
-
-        guess : float (default 7.0)
-            This is used as the initial guess of the pH for the system.
-
-        guess_est : bool (default False)
-            Run a simple algorithm to determine a best guess for the initial
-            pH of the solution. This may or may not slow down the calculation
-            of the pH.
-
-        est_num : int (default 1500)
-            The number of data points to use in the pH guess estimation.
-            Ignored unless `guess_est=True`.
-
-        method : str (default 'Nelder-Mead')
-            The minimization method used to find the pH. The possible values
-            for this variable are defined in the documentation for the
-            scipy.optimize.minimize function.
-
-        tol : float (default 1e-5)
-            The tolerance used to determine convergence of the minimization
-            function.
-        '''
-        if guess_est:
-            phs = np.linspace(0, 14, est_num)
-            guesses = self._diff_pos_neg(phs)
-            guess_idx = guesses.argmin()
-            guess = phs[guess_idx]
-
-        # jac = lambda x, *args: scipy.optimize.approx_fprime(x, self._diff_pos_neg, 1e-16, *args)
-        # scipy.optimize.minimize(fun, x0, args, method='dogleg', jac=jac)
-
-        self.pHsolution = spo.minimize(self._diff_pos_neg, guess,
-                                       method='Nelder-Mead', tol=tol)
-
-        if not self.pHsolution.success:
-            print('Warning: Unsuccessful pH optimization!')
-            print(self.pHsolution.message)
-
-        if len(self.pHsolution.x) == 1:
-            self.pH = self.pHsolution.x[0]
-
-    def _jac(self, x, *args):
-        return spo.approx_fprime(x, self._diff_pos_neg, 1e-2, *args)
+import numpy as np
+import scipy.optimize as spo
+
+
+class Neutral(object):
+    """A nonreactive ion class.
+
+    This object defines things like K+ and Cl-, which contribute to the
+    overall charge balance, but do not have any inherent reactivity with
+    water.
+
+    Parameters
+    ----------
+    charge : int
+        The formal charge of the ion.
+
+    conc : float
+        The concentration of this species in solution.
+
+    Attributes
+    ----------
+    charge : int
+        The formal charge of the ion.
+
+    conc : float
+        The concentration of this species in solution.
+
+    """
+
+    def __init__(self, charge=None, conc=None):
+        if charge is None:
+            raise ValueError(
+                "The charge for this ion must be defined.")
+
+        self.charge = charge
+        self.conc = conc
+
+    def alpha(self, pH, out=None):
+        '''Return the fraction of each species at a given pH.
+
+        Parameters
+        ----------
+        pH : int, float, or Numpy Array
+            These are the pH value(s) over which the fraction should be
+            returned.
+
+        out : None (default) or Numpy NDArray
+            The array where the result is written, of the same shape as
+            the result.
+
+        Returns
+        -------
+        Numpy NDArray
+            Because this is a non-reactive ion class, this function will
+            always return a Numpy array containing just 1.0's for all pH
+            values. The shape is (number of pH values, 1), or pH.shape + (1,)
+            for 2D pH arrays.
+
+        '''
+        shape = np.shape(pH)
+        if len(shape) < 2:
+            shape = (np.size(pH), )
+        if out is None:
+            out = np.empty(shape + (1, ))
+        out.fill(1.)
+        return out
+
+
+class Acid(object):
+    '''An acidic species class.
+
+    This object is used to calculate a number of parameters related to a weak
+    acid in an aqueous solution.
+
+    Parameters
+    ----------
+    Ka : None (default), float, list, Numpy Array
+        This defines the Ka values for all acidic protons in this species. It
+        can be a single Ka value (float), a list of floats, or a Numpy array
+        of floats. Either this value or pKa needs to be defined. The other
+        will then be calculated from the given values.
+
+    pKa : None (default), float, list, Numpy Array
+        The pKa value(s) for all the acidic protons in this species.  This
+        follows the same rules as Ka (See Ka description for more details),
+        and either this value or Ka must be defined.
+
+    charge : None (default), int
+        This is the charge of the fully protonated form of this acid. This
+        must be defined.
+
+    conc : None (default), float
+        The formal concentration of this acid in solution. This value must be
+        defined.
+
+    Note
+    ----
+    There is no corresponding Base object. To define a base, you must use a
+    combination of an Acid and Neutral object. See the documentation for
+    examples.
+
+    '''
+
+    def __init__(self, Ka=None, pKa=None, charge=None, conc=None):
+        # Do a couple quick checks to make sure that everything has been
+        # defined.
+        if not Ka and not pKa:
+            raise ValueError(
+                "You must define either Ka or pKa values.")
+        elif charge is None:
+            raise ValueError(
+                "The maximum charge for this acid must be defined.")
+
+        # Make sure both Ka and pKa are calculated. For lists of values, be
+        # sure to sort them to ensure that the most acidic species is defined
+        # first.
+        elif not Ka:
+            if isinstance(pKa, (int, float)):
+                self.pKa = np.array([pKa, ], dtype=float)
+            else:
+                self.pKa = np.array(pKa, dtype=float)
+                self.pKa.sort()
+            self.Ka = 10**(-self.pKa)
+        elif not pKa:
+            if isinstance(Ka, (int, float)):
+                self.Ka = np.array([Ka, ], dtype=float)
+            else:
+                self.Ka = np.array(Ka, dtype=float)
+                # Ka values must be in reverse sort order
+                self.Ka.sort()
+                self.Ka = self.Ka[::-1]
+            self.pKa = -np.log10(self.Ka)
+        # This temporary Ka array will be used to calculate alpha values. It
+        # starts with an underscore so that it won't be confusing for others.
+        self._Ka_temp = np.append(1., self.Ka)
+        # Cumulative products of the Ka values and the powers of H3O+ in the
+        # alpha equations are constant, so they are calculated only once.
+        self._Ka_prod = np.cumprod(self._Ka_temp)
+        self._power = np.arange(len(self._Ka_temp))[::-1]
+
+        # Make a list of charges for each species defined by the Ka values.
+        self.charge = np.arange(charge, charge - len(self.Ka) - 1, -1)
+        # Make sure the concentrations are accessible to the object instance.
+        self.conc = conc
+
+    def alpha(self, pH, out=None):
+        '''Return the fraction of each species at a given pH.
+
+        Parameters
+        ----------
+        pH : int, float, or Numpy Array
+            These are the pH value(s) over which the fraction should be
+            returned. Arrays of any shape are accepted, e.g. 2D array of
+            candidate pH values (cells x candidates).
+
+        out : None (default) or Numpy NDArray
+            The array of shape pH.shape + (number of species,) where the
+            result is written, e.g. a buffer reused between time steps.
+
+        Returns
+        -------
+        Numpy NDArray
+            These are the fractional concentrations at any given pH. They are
+            sorted from most acidic species to least acidic species. If a
+            NDArray of pH values is provided, then an array with an additional
+            last dimension will be returned, e.g. for 1D array each row
+            represents the speciation for each given pH. A 1D array is
+            returned for a single pH value.
+        '''
+        pH = np.asarray(pH, dtype=float)
+
+        # Raise the concentrations of H3O+ to the powers (in reverse order)
+        # along the new last dimension and multiply them by the cumulative
+        # product of the Ka values.
+        h3o = 10.**(-pH[..., np.newaxis])
+        h3o_Ka = np.power(h3o, self._power, out=out)
+        h3o_Ka *= self._Ka_prod
+        h3o_Ka /= h3o_Ka.sum(axis=-1, keepdims=True)
+
+        if pH.ndim == 1 and pH.size == 1:
+            return h3o_Ka[0]
+        return h3o_Ka
+
+
+class System(object):
+    '''An object used to define an a system of acid and neutral species.
+
+    This object accepts an arbitrary number of acid and neutral species
+    objects and uses these to calculate the pH of the system. Be sure to
+    include all of the species that completely define the contents of a
+    particular solution.
+
+    Parameters
+    ----------
+    *species
+        These are any number of Acid and Neutral objects that you'd like to
+        use to define your system.
+
+    Attibutes
+    ---------
+    species : list
+        This is a list containing all of the species that you input.
+
+    pHsolution
+        This is the full minimization output, which is defined by the function
+        scipy.optimize.minimize. This is only available after running the
+        pHsolve method.
+
+    pH : float or Numpy Array
+        The pH of this particular system. This is only calculated after
+        running the pHsolve method. It is an array if the concentrations of
+        the species are arrays (one pH for every composition).
+
+    tables : dict or None
+        The charge of the species tabulated on a pH grid, see build_tables.
+    '''
+
+    def __init__(self, *species):
+        self.species = species
+        self.tables = None
+        self._alpha_buffers = {}
+
+    def build_tables(self, bounds=(-2., 16.), step=1e-3):
+        '''Precompute the charge of the species on a dense pH grid.
+
+        For fixed Ka values the mean charge of every species (per unit of
+        concentration) and its variance depend only on pH. They are
+        tabulated once and the charge balance used by `_diff_pos_neg` and
+        `pHsolve_newton` is then linearly interpolated from the tables. The
+        error of the interpolated charge is below step**2/8 times its second
+        derivative with respect to pH (about 6e-8 per unit of concentration
+        for step 1e-3), `pHsolve` and `pHsolve_newton` polish the
+        interpolated solution with the exact charge balance.
+
+        Parameters
+        ----------
+        bounds : tuple (default (-2., 16.))
+            The range of the pH grid.
+
+        step : float (default 1e-3)
+            The step of the pH grid.
+        '''
+        grid = np.arange(bounds[0], bounds[1] + step / 2, step)
+        self.tables = {'pH': grid, 'step': step, 'charge': [], 'variance': []}
+        for idx in range(len(self.species)):
+            charge, variance = self._charge_terms(idx, grid)
+            self.tables['charge'].append(np.array(charge, dtype=float))
+            self.tables['variance'].append(np.array(variance, dtype=float))
+
+    def _table_weights(self, pH):
+        '''Calculate indices and weights of linear interpolation in the tables.
+
+        Parameters
+        ----------
+        pH : Numpy Array
+            The pH value(s).
+
+        Returns
+        -------
+        tuple or None
+            The indices of the lower grid points and the weights of the upper
+            ones, None if the tables are not built.
+        '''
+        if self.tables is None:
+            return None
+        grid = self.tables['pH']
+        t = np.clip((pH - grid[0]) / self.tables['step'], 0, grid.size - 1)
+        i = np.minimum(t.astype(int), grid.size - 2)
+        return i, t - i
+
+    def _charge_terms(self, idx, pH, weights=None):
+        '''Calculate the mean charge of a species and its variance.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the species in `species`.
+
+        pH : Numpy Array
+            The pH value(s).
+
+        weights : None (default) or tuple
+            Interpolation weights (see `_table_weights`), if given the values
+            are interpolated from the tables, else they are calculated
+            exactly.
+
+        Returns
+        -------
+        tuple of Numpy Arrays
+            The charge per unit of concentration and its variance.
+        '''
+        if weights is not None:
+            i, w = weights
+            charge = self.tables['charge'][idx]
+            variance = self.tables['variance'][idx]
+            return (charge[i] + w * (charge[i + 1] - charge[i]),
+                    variance[i] + w * (variance[i + 1] - variance[i]))
+        alpha, charge = self._mean_charge(idx, pH)
+        square = alpha.dot(np.atleast_1d(self.species[idx].charge)**2)
+        return charge, square - charge**2
+
+    def _mean_charge(self, idx, pH):
+        '''Calculate the fractions and the mean charge of a species.
+
+        The fractions are written in a buffer of the species, which is
+        reused while the shape of pH does not change.
+
+        Parameters
+        ----------
+        idx : int
+            The index of the species in `species`.
+
+        pH : Numpy Array
+            The pH value(s).
+
+        Returns
+        -------
+        tuple of Numpy Arrays
+            The fractions (see alpha) and the charge per unit of
+            concentration of the species.
+        '''
+        s = self.species[idx]
+        charge = np.atleast_1d(s.charge)
+        shape = np.shape(pH) + charge.shape
+        out = self._alpha_buffers.get(idx)
+        if out is None or out.shape != shape:
+            out = self._alpha_buffers[idx] = np.empty(shape)
+        alpha = s.alpha(pH, out=out)
+        return alpha, alpha.dot(charge)
+
+    def _diff_pos_neg(self, pH):
+        '''Calculate the charge balance difference.
+
+        Parameters
+        ----------
+        pH : int, float, or Numpy Array
+            The pH value(s) used to calculate the different distributions of
+            positive and negative species.
+
+        Returns
+        -------
+        float or Numpy Array
+            The absolute value of the difference in concentration between the
+            positive and negatively charged species in the system (interpolated
+            if the tables are built, see `build_tables` for the error of the
+            interpolation). A float is
+            returned if an int or float is input as the pH: a Numpy array is
+            returned if an array of pH values is used as the input.
+        '''
+        pH = np.asarray(pH, dtype=float)
+        # Calculate the h3o and oh concentrations and sum them up.
+        h3o = 10.**(-pH)
+        oh = (10.**(-14)) / h3o
+        x = (h3o - oh)
+
+        # Go through all the species that were given, and sum up their
+        # charge*concentration values into our total sum. Concentrations
+        # can be arrays, e.g. of cells for 2D pH (cells x candidates).
+        weights = self._table_weights(pH)
+        for idx, s in enumerate(self.species):
+            charge = self._charge_terms(idx, pH, weights)[0]
+            conc = np.reshape(s.conc, np.shape(s.conc) +
+                              (1, ) * (np.ndim(charge) - np.ndim(s.conc)))
+            x = x + conc * charge
+
+        # Return the absolute value so it never goes below zero.
+        return np.abs(x)
+
+    def pHsolve(self, guess=7.0, guess_est=False, est_num=1500,
+                method='Nelder-Mead', tol=1e-5):
+        '''Solve the pH of the system.
+
+        The pH solving is done using a simple minimization algorithm which
+        minimizes the difference in the total positive and negative ion
+        concentrations in the system. The minimization algorithm can be
+        adjusted using the `method` keyword argument. The available methods
+        can be found in the documentation for the scipy.optimize.minimize
+        function.
+
+        A good initial guess may help the minimization. It can be set manually
+        using the `guess` keyword, which defaults to 7.0. There is an
+        automated method that can be run as well if you set the `guess_est`
+        argument. This will override whatever you pass is for `guess`. The
+        `est_num` keyword sets the number of data points that you'd like to
+        use for finding the guess estimate. Too few points might start you
+        pretty far from the actual minimum; too many points is probably
+        overkill and won't help much. This may or may not speed things up.
+
+        If the tables are built (see `build_tables`) the minimization uses the
+        interpolated charge balance and the solution is polished by Newton
+        iterations on the exact one (see `pHsolve_newton`).
+
+        If the concentrations of the species are Numpy arrays (e.g. total
+        concentrations of the points of a titration curve), the pH of all the
+        compositions is solved at once by the bracketed Newton method (see
+        `pHsolve_newton`) and `guess_est`, `est_num` and `method` are ignored.
+
+        Parameters
+        ----------
+
+        guess : float (default 7.0)
+            This is used as the initial guess of the pH for the system.
+
+        guess_est : bool (default False)
+            Run a simple algorithm to determine a best guess for the initial
+            pH of the solution. This may or may not slow down the calculation
+            of the pH.
+
+        est_num : int (default 1500)
+            The number of data points to use in the pH guess estimation.
+            Ignored unless `guess_est=True`.
+
+        method : str (default 'Nelder-Mead')
+            The minimization method used to find the pH. The possible values
+            for this variable are defined in the documentation for the
+            scipy.optimize.minimize function.
+
+        tol : float (default 1e-5)
+            The tolerance used to determine convergence of the minimization
+            function.
+        '''
+        if any(np.ndim(s.conc) > 0 for s in self.species):
+            return self.pHsolve_newton(guess=guess, tol=tol)
+
+        if guess_est:
+            phs = np.linspace(0, 14, est_num)
+            guesses = self._diff_pos_neg(phs)
+            guess_idx = guesses.argmin()
+            guess = phs[guess_idx]
+
+        # jac = lambda x, *args: scipy.optimize.approx_fprime(x, self._diff_pos_neg, 1e-16, *args)
+        # scipy.optimize.minimize(fun, x0, args, method='dogleg', jac=jac)
+
+        self.pHsolution = spo.minimize(self._diff_pos_neg, guess,
+                                       method='Nelder-Mead', tol=tol)
+
+        if not self.pHsolution.success:
+            print('Warning: Unsuccessful pH optimization!')
+            print(self.pHsolution.message)
+
+        if len(self.pHsolution.x) == 1:
+            self.pH = self.pHsolution.x[0]
+            if self.tables is not None:
+                pH = self.pHsolution.x.astype(float)
+                conc = [np.atleast_1d(float(s.conc)) for s in self.species]
+                bounds = (self.tables['pH'][0], self.tables['pH'][-1])
+                if not self._newton(pH, conc, tol, 50, bounds, False):
+                    self.pH = pH[0]
+
+    def _charge_balance(self, pH, conc, tables=True):
+        '''Calculate the signed charge balance and its derivative.
+
+        Parameters
+        ----------
+        pH : Numpy Array
+            1D array of pH values, one for each composition.
+
+        conc : list
+            Concentrations of the species (in the order of `species`), each
+            is a float or a Numpy array of the same length as pH.
+
+        tables : bool (default True)
+            Interpolate the charge of the species from the tables if they are
+            built (see `build_tables`).
+
+        Returns
+        -------
+        tuple of Numpy Arrays
+            The difference in concentration between the positive and
+            negatively charged species and its derivative with respect to
+            pH. The derivative is always negative, i.e. the charge balance
+            decreases monotonically with pH.
+        '''
+        h3o = 10.**(-pH)
+        oh = (10.**(-14)) / h3o
+        x = h3o - oh
+        dx = h3o + oh
+        weights = self._table_weights(pH) if tables else None
+        for idx, c in enumerate(conc):
+            # derivative of the mean charge with respect to ln[H3O+] is the
+            # variance of the charge
+            charge, variance = self._charge_terms(idx, pH, weights)
+            x += c * charge
+            dx += c * variance
+        return x, -np.log(10.) * dx
+
+    def pHsolve_newton(self, guess=7.0, tol=1e-6, max_iter=50,
+                       bounds=(-2., 16.)):
+        '''Solve the pH of many compositions at once.
+
+        The concentrations of the species can be Numpy arrays (e.g. one value
+        per grid cell). The pH of all the compositions is found together by
+        Newton iterations on the signed charge balance, safeguarded by
+        bisection: a Newton step which leaves the bracket of the root or is
+        not at least twice shorter than the previous step is replaced by the
+        midpoint of the bracket. The charge balance decreases monotonically
+        with pH, so the root is unique. If the tables are built (see
+        `build_tables`) the iterations use the interpolated charge balance and
+        the solution is polished by the exact one.
+
+        Parameters
+        ----------
+        guess : float or Numpy Array (default 7.0)
+            This is used as the initial guess of the pH, e.g. the pH of the
+            previous time step.
+
+        tol : float (default 1e-6)
+            The convergence tolerance of the pH.
+
+        max_iter : int (default 50)
+            The maximum number of iterations.
+
+        bounds : tuple (default (-2., 16.))
+            The initial bracket of the pH.
+
+        Returns
+        -------
+        float or Numpy Array
+            The pH of every composition, this is also stored as `pH`.
+        '''
+        shape = np.broadcast(guess, *[s.conc for s in self.species]).shape
+        conc = [
+            np.broadcast_to(s.conc, shape).ravel().astype(float)
+            for s in self.species
+        ]
+        pH = np.clip(
+            np.broadcast_to(guess, shape).ravel().astype(float), *bounds)
+        failed = self._newton(pH, conc, tol, max_iter, bounds)
+        if self.tables is not None:
+            failed = self._newton(pH, conc, tol, max_iter, bounds, False)
+        if failed:
+            print('Warning: Unsuccessful pH solution in {} of {} cases!'.format(
+                failed, pH.size))
+
+        self.pH = pH.reshape(shape) if shape else pH[0]
+        return self.pH
+
+    def _newton(self, pH, conc, tol, max_iter, bounds, tables=True):
+        '''Safeguarded Newton iterations of `pHsolve_newton`.
+
+        Parameters
+        ----------
+        pH : Numpy Array
+            1D array of initial pH values, updated in place.
+
+        conc : list
+            Concentrations of the species, Numpy arrays of the same length as
+            pH.
+
+        tol : float
+            The convergence tolerance of the pH.
+
+        max_iter : int
+            The maximum number of iterations.
+
+        bounds : tuple
+            The initial bracket of the pH.
+
+        tables : bool (default True)
+            Use the interpolated charge balance, see `_charge_balance`.
+
+        Returns
+        -------
+        int
+            The number of compositions which did not converge.
+        '''
+        lower = np.full(pH.size, bounds[0], dtype=float)
+        upper = np.full(pH.size, bounds[1], dtype=float)
+        last_step = upper - lower
+        idx = np.arange(pH.size)
+        for _ in range(max_iter):
+            x, dx = self._charge_balance(pH[idx], [c[idx] for c in conc],
+                                         tables)
+            # the root is above the pH if the charge balance is positive
+            positive = x > 0
+            lower[idx[positive]] = pH[idx[positive]]
+            upper[idx[~positive]] = pH[idx[~positive]]
+            step = x / dx
+            new = pH[idx] - step
+            # Newton steps shorter than the tolerance are accepted even if
+            # they touch the bracket (which happens due to round-off)
+            bisect = ((new <= lower[idx]) | (new >= upper[idx]) |
+                      (np.abs(2 * x) > np.abs(last_step[idx] * dx))) & (
+                          np.abs(step) >= tol)
+            new[bisect] = 0.5 * (lower[idx[bisect]] + upper[idx[bisect]])
+            last_step[idx] = new - pH[idx]
+            converged = (np.abs(new - pH[idx]) < tol) | (x == 0)
+            pH[idx] = new
+            idx = idx[~converged]
+            if idx.size == 0:
+                break
+        return idx.size
+
+    def titrate(self, titrant, conc, guess=7.0, tol=1e-6):
+        '''Calculate the titration curve of the system.
+
+        The concentrations of the other species are kept and the pH is solved
+        for every total concentration of the titrant at once (see
+        `pHsolve_newton`).
+
+        Parameters
+        ----------
+        titrant : Acid or Neutral
+            The species of the system which is added, e.g. Neutral(charge=1)
+            for NaOH.
+
+        conc : Numpy Array
+            The total concentrations of the titrant, shape (n_points,).
+
+        guess : float or Numpy Array (default 7.0)
+            The initial guess of the pH.
+
+        tol : float (default 1e-6)
+            The convergence tolerance of the pH.
+
+        Returns
+        -------
+        Numpy Array
+            The pH of every point of the titration curve, the speciation can
+            be calculated by `alpha` of the species.
+        '''
+        if titrant not in self.species:
+            raise ValueError("The titrant must be one of the species.")
+        initial_conc = titrant.conc
+        titrant.conc = np.asarray(conc, dtype=float)
+        try:
+            return self.pHsolve_newton(guess=guess, tol=tol)
+        finally:
+            titrant.conc = initial_conc
+
+    def _jac(self, x, *args):
+        return spo.approx_fprime(x, self._diff_pos_neg, 1e-2, *args)
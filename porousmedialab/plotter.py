@@ -9,6 +9,17 @@ from matplotlib.colors import ListedColormap
 sns.set_style("whitegrid")
 
 
+def number_of_outputs(lab, time_interval):
+    """number of saved time steps in the last time_interval of simulation"""
+    return np.count_nonzero(
+        lab.output_time > lab.output_time[-1] - time_interval)
+
+
+def output_index(lab, t):
+    """index of the saved time step closest to time t"""
+    return np.abs(lab.output_time - t).argmin()
+
+
 def custom_plot(lab, x, y, ttl='', y_lbl='', x_lbl=''):
     plt.figure()
     ax = plt.subplot(111)
@@ -28,7 +39,7 @@ def plot_batch_rates(batch, *args, **kwargs):
 
 
 def plot_batch_rate(batch, rate, time_factor=1):
-    plt.plot(batch.time * time_factor,
+    plt.plot(batch.output_time * time_factor,
              batch.estimated_rates[rate][0] / time_factor, label=rate, lw=3)
     plt.ylabel('Rate, $[\Delta C/\Delta T]$')
     plt.xlabel('Time, [T]')
@@ -43,7 +54,7 @@ def plot_batch_deltas(batch, *args, **kwargs):
 
 
 def plot_batch_delta(batch, element, time_factor=1):
-    plt.plot(batch.time[1:] * time_factor, batch.species[element]
+    plt.plot(batch.output_time[1:] * time_factor, batch.species[element]
              ['rates'][0] / time_factor, label=element, lw=3)
     plt.ylabel('Rate of change, $[\Delta C/ \Delta T]$')
     plt.xlabel('Time, [T]')
@@ -55,13 +66,13 @@ def saturation_index_countour(lab, elem1, elem2, Ks, labels=False):
     plt.figure()
     plt.title('Saturation index %s%s' % (elem1, elem2))
     resoluion = 100
-    n = math.ceil(lab.time.size / resoluion)
+    n = math.ceil(lab.output_time.size / resoluion)
     plt.xlabel('Time')
     z = np.log10((lab.species[elem1]['concentration'][:, ::n] + 1e-8) * (
         lab.species[elem2]['concentration'][:, ::n] + 1e-8) / lab.constants[Ks])
     lim = np.max(abs(z))
     lim = np.linspace(-lim - 0.1, +lim + 0.1, 51)
-    X, Y = np.meshgrid(lab.time[::n], -lab.x)
+    X, Y = np.meshgrid(lab.output_time[::n], -lab.x)
     plt.xlabel('Time')
     CS = plt.contourf(X, Y, z, 20, cmap=ListedColormap(sns.color_palette(
         "RdBu_r", 101)), origin='lower', levels=lim, extend='both')
@@ -83,7 +94,7 @@ def plot_fractions(lab):
         if isinstance(component['pH_object'], Acid):
             plt.figure()
             for idx in range(len(component['species'])):
-                plt.plot(lab.time, lab.species[component['species'][idx]]
+                plt.plot(lab.output_time, lab.species[component['species'][idx]]
                          ['alpha'][0, :], label=component['species'][idx])
             plt.ylabel('Fraction')
             plt.xlabel('Time')
@@ -109,10 +120,10 @@ def plot_depth_index(lab, element, idx=0, time_to_plot=False, time_factor=1, ax=
     else:
         ax.set_ylabel('Concentration')
     if time_to_plot:
-        num_of_elem = int(time_to_plot / lab.dt)
+        num_of_elem = number_of_outputs(lab, time_to_plot)
     else:
-        num_of_elem = len(lab.time)
-    t = lab.time[-num_of_elem:] * time_factor
+        num_of_elem = len(lab.output_time)
+    t = lab.output_time[-num_of_elem:] * time_factor
     ax.set_xlabel('Time')
     if isinstance(element, str):
         ax.plot(t, lab.species[element]['concentration']
@@ -137,10 +148,10 @@ def plot_depths(lab, element, depths=[0, 1, 2, 3, 4], time_to_plot=False):
         plt.title(element + ' concentration at specific depths')
         plt.ylabel('Concentration')
     if time_to_plot:
-        num_of_elem = int(time_to_plot / lab.dt)
+        num_of_elem = number_of_outputs(lab, time_to_plot)
     else:
-        num_of_elem = len(lab.time)
-    t = lab.time[-num_of_elem:]
+        num_of_elem = len(lab.output_time)
+    t = lab.output_time[-num_of_elem:]
     plt.xlabel('Time')
     for depth in depths:
         lbl = str(depth)
@@ -164,7 +175,7 @@ def plot_times(lab, element, time_slices=[0, 1, 2, 3, 4]):
     for tms in time_slices:
         lbl = 'at time: %.2f ' % (tms)
         plt.plot(lab.species[element]['concentration'][
-                 :, int(tms / lab.dt)], -lab.x, lw=3, label=lbl)
+                 :, output_index(lab, tms)], -lab.x, lw=3, label=lbl)
     ax.legend(loc='center left', bbox_to_anchor=(1, 0.5), ncol=2)
     ax.grid(linestyle='-', linewidth=0.2)
     return ax
@@ -206,16 +217,16 @@ def contour_plot(lab, element, labels=False, days=False, last_year=False):
     plt.figure()
     plt.title(element + ' concentration')
     resoluion = 100
-    n = math.ceil(lab.time.size / resoluion)
+    n = math.ceil(lab.output_time.size / resoluion)
     if last_year:
-        k = n - int(1 / lab.dt)
+        k = n - number_of_outputs(lab, 1)
     else:
         k = 1
     if days:
-        X, Y = np.meshgrid(lab.time[k::n] * 365, -lab.x)
+        X, Y = np.meshgrid(lab.output_time[k::n] * 365, -lab.x)
         plt.xlabel('Time')
     else:
-        X, Y = np.meshgrid(lab.time[k::n], -lab.x)
+        X, Y = np.meshgrid(lab.output_time[k::n], -lab.x)
         plt.xlabel('Time')
     z = lab.species[element]['concentration'][:, k - 1:-1:n]
     CS = plt.contourf(X, Y, z, 51, cmap=ListedColormap(
@@ -246,15 +257,15 @@ def contour_plot_of_rates(lab, r, labels=False, last_year=False):
     plt.figure()
     plt.title('{}'.format(r))
     resoluion = 100
-    n = math.ceil(lab.time.size / resoluion)
+    n = math.ceil(lab.output_time.size / resoluion)
     if last_year:
-        k = n - int(1 / lab.dt)
+        k = n - number_of_outputs(lab, 1)
     else:
         k = 1
-    z = lab.estimated_rates[r][:, k - 1:-1:n]
+    z = lab.estimated_rates.subset(r, slice(k - 1, -1, n))
     # lim = np.max(np.abs(z))
     # lim = np.linspace(-lim - 0.1, +lim + 0.1, 51)
-    X, Y = np.meshgrid(lab.time[k::n], -lab.x)
+    X, Y = np.meshgrid(lab.output_time[k::n], -lab.x)
     plt.xlabel('Time')
     CS = plt.contourf(X, Y, z, 20, cmap=ListedColormap(
         sns.color_palette("Blues", 51)))
@@ -280,15 +291,15 @@ def contour_plot_of_delta(lab, element, labels=False, last_year=False):
     plt.figure()
     plt.title('Rate of %s consumption/production' % element)
     resoluion = 100
-    n = math.ceil(lab.time.size / resoluion)
+    n = math.ceil(lab.output_time.size / resoluion)
     if last_year:
-        k = n - int(1 / lab.dt)
+        k = n - number_of_outputs(lab, 1)
     else:
         k = 1
     z = lab.species[element]['rates'][:, k - 1:-1:n]
     lim = np.max(np.abs(z))
     lim = np.linspace(-lim - 0.1, +lim + 0.1, 51)
-    X, Y = np.meshgrid(lab.time[k:-1:n], -lab.x)
+    X, Y = np.meshgrid(lab.output_time[k:-1:n], -lab.x)
     plt.xlabel('Time')
     CS = plt.contourf(X, Y, z, 20, cmap=ListedColormap(sns.color_palette(
         "RdBu_r", 101)), origin='lower', levels=lim, extend='both')
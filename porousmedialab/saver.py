@@ -1,3 +1,4 @@
+import json
 import numpy as np
 import h5py
 import os
@@ -28,6 +29,128 @@ def recursively_save_dict_contents_to_group(h5file, path, dic):
         else:
             raise ValueError('Cannot save %s type'%type(item))
 
+class HDF5Stream:
+    """
+    Streaming output into HDF5 file. Profiles are buffered and appended
+    in blocks to chunked, resizable datasets (N x time) while the
+    simulation runs, so the memory use is bounded by the block size and
+    results written so far survive an interrupted run.
+    """
+
+    def __init__(self, filename, block_size=100, save_every=1):
+        """
+        Arguments:
+            filename {str} -- name of HDF5 file, overwritten if exists
+            block_size {int} -- number of time steps in one block
+            save_every {int} -- append every k-th time step
+        """
+        self.filename = filename
+        self.block_size = block_size
+        self.save_every = save_every
+        self.h5file = h5py.File(filename, 'w')
+        self.times = []
+        self.buffers = {}
+
+    def save_dict(self, path, dic):
+        """
+        Save dictionary (e.g. parameters) in the file at the path location.
+        """
+        recursively_save_dict_contents_to_group(self.h5file, path, dic)
+
+    def append(self, t, data):
+        """
+        Append profiles of one time step. data is a dictionary of groups,
+        each group is a dictionary of profiles, e.g.
+        {'concentrations': {'O2': array, ...}, 'estimated_rates': {...}}
+        """
+        self.times.append(t)
+        for group, profiles in data.items():
+            for name, profile in profiles.items():
+                self.buffers.setdefault(group + '/' + name, []).append(
+                    np.array(profile, dtype=float))
+        if len(self.times) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write buffered block in the file.
+        """
+        if not self.times:
+            return
+        self.append_block('time', np.array(self.times))
+        for path, profiles in self.buffers.items():
+            self.append_block(path, np.column_stack(profiles))
+        self.times = []
+        self.buffers = {}
+        self.h5file.flush()
+
+    def append_block(self, path, block):
+        """
+        Append block along the last (time) axis of the dataset, the
+        dataset is created on the first call.
+        """
+        if path not in self.h5file:
+            self.h5file.create_dataset(
+                path,
+                data=block,
+                maxshape=block.shape[:-1] + (None, ),
+                chunks=block.shape[:-1] + (self.block_size, ))
+        else:
+            dset = self.h5file[path]
+            n = dset.shape[-1]
+            dset.resize(n + block.shape[-1], axis=dset.ndim - 1)
+            dset[..., n:] = block
+
+    def close(self):
+        """
+        Flush remaining profiles and close the file.
+        """
+        self.flush()
+        self.h5file.close()
+
+
+def create_memmap(directory, key, shape):
+    """
+    Create zero filled memmap file in the directory and register it in the
+    index file of the directory. key is 'group/name' or 'name'.
+    """
+    filename = key.replace('/', '.') + '.dat'
+    array = np.memmap(
+        os.path.join(directory, filename), dtype=float, mode='w+', shape=shape)
+    index_file = os.path.join(directory, 'index.json')
+    index = {}
+    if os.path.exists(index_file):
+        with open(index_file) as f:
+            index = json.load(f)
+    index[key] = {'filename': filename, 'shape': list(shape)}
+    with open(index_file, 'w') as f:
+        json.dump(index, f)
+    return array
+
+
+def load_memmap_results(directory, mode='r'):
+    """
+    Reopen memmap results from the directory (read-only by default) without
+    loading them in memory. Returns dictionary of groups, 2D arrays are
+    transposed to N x time as in the model.
+    """
+    with open(os.path.join(directory, 'index.json')) as f:
+        index = json.load(f)
+    results = {}
+    for key, item in index.items():
+        array = np.memmap(
+            os.path.join(directory, item['filename']),
+            dtype=float,
+            mode=mode,
+            shape=tuple(item['shape'])).T
+        if '/' in key:
+            group, name = key.split('/', 1)
+            results.setdefault(group, {})[name] = array
+        else:
+            results[key] = array
+    return results
+
+
 def load_dict_from_hdf5(filename):
     """
     Load a dictionary whose contents are only strings, floats, ints,
@@ -1,10 +1,9 @@
-import unittest
-from spec import skip
-import Column
-import OdeSolver
 import numpy as np
+import pytest
 from scipy import special
-# from unittest import TestCase
+
+import porousmedialab.desolver as OdeSolver
+from porousmedialab.column import Column
 
 
 def create_lab():
@@ -12,9 +11,9 @@ def create_lab():
     tend = 0.1
     dx = 0.1
     length = 100
-    phi = 1
     dt = 0.001
-    lab = Column.Column(length, dx, tend, dt, phi, w)
+    lab = Column(length, dx, tend, dt, w=w)
+    lab.code_cache_dir = None
     return lab
 
 
@@ -25,19 +24,19 @@ class TestIntialization:
         """ Scalar initial condition assigned to the whole vector"""
         init_C = 12.32
         lab = create_lab()
-        lab.add_species(True, 'O2', 40, init_C, bc_top=init_C, bc_top_type='dirichlet', bc_bot=0, bc_bot_type='neumann')
+        lab.add_species(True, 'O2', 40, init_C, bc_top_value=init_C, bc_top_type='dirichlet', bc_bot_value=0, bc_bot_type='neumann')
         assert np.array_equal(lab.O2.concentration[
-                              :, 0], init_C * np.ones((lab.length / lab.dx + 1)))
+                              :, 0], init_C * np.ones(lab.N))
 
     def boundary_conditions_test(self):
         """ Dirichlet BC at the interface always assigned"""
         lab = create_lab()
         init_C = 12.32
         bc = 0.2
-        lab.add_species(True, 'O2', 40, init_C, bc_top=bc, bc_top_type='dirichlet', bc_bot=0, bc_bot_type='neumann')
-        lab.solve()
+        lab.add_species(True, 'O2', 40, init_C, bc_top_value=bc, bc_top_type='dirichlet', bc_bot_value=0, bc_bot_type='neumann')
+        lab.solve(verbose=False)
         assert np.array_equal(lab.O2.concentration[
-                              0, :], bc * np.ones((lab.tend / lab.dt + 1)))
+                              0, :], bc * np.ones(lab.time.size))
 
 
 class TestMathModel:
@@ -47,10 +46,10 @@ class TestMathModel:
         '''Check the transport equation integrator'''
         lab = create_lab()
         D = 40
-        lab.add_species(True, 'O2', D, 0, bc_top=1, bc_top_type='dirichlet', bc_bot=0, bc_bot_type='neumann')
+        lab.add_species(True, 'O2', D, 0, bc_top_value=1, bc_top_type='dirichlet', bc_bot_value=0, bc_bot_type='neumann')
         lab.dcdt.O2 = '0'
-        lab.solve()
-        x = np.linspace(0, lab.length, lab.length / lab.dx + 1)
+        lab.solve(verbose=False)
+        x = lab.x
         sol = 1 / 2 * (special.erfc((x - lab.w * lab.tend) / 2 / np.sqrt(D * lab.tend)) + np.exp(
             lab.w * x / D) * special.erfc((x + lab.w * lab.tend) / 2 / np.sqrt(D * lab.tend)))
 
@@ -67,11 +66,11 @@ class TestMathModel:
         dcdt = {'C': '-R'}
         dt = 0.0001
         T = 0.01
-        time = np.linspace(0, T, T / dt + 1)
+        time = np.linspace(0, T, round(T / dt) + 1)
         num_sol = np.array(C0['C'])
         for i in range(1, len(time)):
-            C_new, _ = OdeSolver.ode_integrate(
-                C0, dcdt, rates, coef, dt, solver=1)
+            C_new, _, _ = OdeSolver.ode_integrate(
+                C0, dcdt, rates, coef, dt, solver='rk4')
             C0['C'] = C_new['C']
             num_sol = np.append(num_sol, C_new['C'])
         assert max(num_sol - np.exp(-coef['k'] * time)) < 1e-5
@@ -87,21 +86,21 @@ class TestMathModel:
         dcdt = {'C': '-R'}
         dt = 0.0001
         T = 0.01
-        time = np.linspace(0, T, T / dt + 1)
+        time = np.linspace(0, T, round(T / dt) + 1)
         num_sol = np.array(C0['C'])
         for i in range(1, len(time)):
-            C_new, _ = OdeSolver.ode_integrate(
-                C0, dcdt, rates, coef, dt, solver=0)
+            C_new, _, _ = OdeSolver.ode_integrate(
+                C0, dcdt, rates, coef, dt, solver='butcher5')
             C0['C'] = C_new['C']
             num_sol = np.append(num_sol, C_new['C'])
         assert max(num_sol - np.exp(-coef['k'] * time)) < 1e-5
 
     def adjust_time_test(self):
         """adjusting time step"""
-        skip()
+        pytest.skip('not implemented')
 
 
-class TestHandling(unittest.TestCase):
+class TestHandling:
     """Test the exception handling with correct terminal messages"""
 
     def ode_solver_key_error_test(self):
@@ -111,9 +110,10 @@ class TestHandling(unittest.TestCase):
         rates = {'R': 'k*C'}
         dcdt = {'C1': '-R'}
         dt = 0.0001
-        with self.assertRaises(KeyError):
-            OdeSolver.ode_integrate(C0, dcdt, rates, coef, dt, solver=0)
+        with pytest.raises(KeyError):
+            OdeSolver.ode_integrate(
+                C0, dcdt, rates, coef, dt, solver='butcher5')
 
     def bc_error_test(self):
         """boundary condition error """
-        skip()
+        pytest.skip('not implemented')
@@ -0,0 +1,47 @@
+import numpy as np
+
+from porousmedialab.column import Column
+
+
+def reacting_column(threshold):
+    """A + B -> C with reactants only in the top of the column"""
+    col = Column(length=2, dx=0.1, tend=0.1, dt=0.01)
+    col.code_cache_dir = None
+    col.reaction_activity_threshold = threshold
+    top = np.where(col.x < 0.5, 1., 0.)
+    for name, init in (('A', top), ('B', top), ('C', 0)):
+        col.add_species(
+            theta=0.9,
+            name=name,
+            D=1e-3,
+            init_conc=init,
+            bc_top_value=0,
+            bc_top_type='flux',
+            bc_bot_value=0,
+            bc_bot_type='flux')
+    col.constants['k'] = 5.
+    col.rates['R'] = 'k * A * B'
+    col.dcdt['A'] = '-R'
+    col.dcdt['B'] = '-R'
+    col.dcdt['C'] = 'R'
+    col.solve(verbose=False)
+    return col
+
+
+class TestActiveCells:
+    """cells without reactions are skipped above a threshold"""
+
+    def test_all_cells_by_default(self):
+        col = Column(length=1, dx=0.1, tend=0.1, dt=0.01)
+        assert col.reaction_activity_threshold is None
+
+    def test_threshold_skips_cells(self):
+        skipping = reacting_column(1e-14)
+        everywhere = reacting_column(None)
+        assert skipping.reaction_cells['skipped'] > 0
+        assert everywhere.reaction_cells['skipped'] == 0
+        for name in ('A', 'B', 'C'):
+            assert np.allclose(
+                skipping.species[name]['concentration'],
+                everywhere.species[name]['concentration'],
+                atol=1e-10)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from porousmedialab.batch import Batch
+
+CARBON = ('OM', 'CO2', 'HCO3', 'CO2g')
+
+
+def carbonate_batch(dt, coupled, tend=2.):
+    """decay of organic matter to CO2 with carbonate and Henry equilibria"""
+    batch = Batch(tend, dt)
+    batch.code_cache_dir = None
+    for name, init in (('OM', 1.), ('CO2', 0.), ('HCO3', 0.), ('CO2g', 0.),
+                       ('Na', 1e-2)):
+        batch.add_species(name, init)
+    batch.constants['k'] = 2.
+    batch.rates['R1'] = 'k * OM'
+    batch.dcdt['OM'] = '-R1'
+    batch.dcdt['CO2'] = 'R1'
+    batch.add_acid(['CO2', 'HCO3'], [6.35])
+    batch.add_ion('Na', 1)
+    batch.henry_equilibrium('CO2', 'CO2g', 0.5)
+    batch.coupled_equilibria = coupled
+    batch.solve(verbose=False)
+    return batch
+
+
+class TestCoupledEquilibria:
+    """reactions integrated together with fast equilibria vs splitting"""
+
+    def test_coupled_against_split(self):
+        dt = 0.5
+        every = int(round(dt / 5e-3))
+        reference = carbonate_batch(5e-3, False)
+        coupled = carbonate_batch(dt, True)
+        split = carbonate_batch(dt, False)
+
+        def error(batch):
+            return np.abs(batch.species['pH']['concentration'][0] -
+                          reference.species['pH']['concentration'][0, ::every]
+                          ).max()
+
+        assert error(coupled) < 0.1
+        assert error(coupled) < error(split) / 10
+
+    def test_carbon_is_conserved(self):
+        batch = carbonate_batch(0.5, True)
+        total = sum(batch.species[name]['concentration'][0] for name in CARBON)
+        assert np.allclose(total, 1., rtol=1e-6)
+        assert np.allclose(batch.species['Na']['concentration'][0], 1e-2)
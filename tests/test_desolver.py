@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+import porousmedialab.desolver as desolver
+
+sympy = pytest.importorskip('sympy')
+
+
+def compile_model(species, constants, rates, dcdt):
+    """generated ode function and analytical Jacobian of the model"""
+    namespace = {'np': np}
+    exec(desolver.create_ode_function(species, {}, constants, rates, dcdt),
+         namespace)
+    jac_str = desolver.create_jacobian_function(species, {}, constants, rates,
+                                                dcdt)
+    assert jac_str is not None
+    exec(jac_str, namespace)
+    return namespace['f'], namespace['jac']
+
+
+def finite_differences(f, y, p, h=1e-7):
+    """blocks of Jacobian (cells x n x n) estimated by central differences"""
+    N, n = y.shape
+    J = np.zeros((N, n, n))
+    for j in range(n):
+        y_h = y.copy()
+        y_h[:, j] += h
+        f_plus = f(0, y_h.ravel(), p).reshape(N, n)
+        y_h[:, j] -= 2 * h
+        f_minus = f(0, y_h.ravel(), p).reshape(N, n)
+        J[:, :, j] = (f_plus - f_minus) / 2 / h
+    return J
+
+
+class TestJacobian:
+    """analytical Jacobian of reactions against finite differences"""
+
+    def test_negative_stoichiometry(self):
+        """derivatives starting with unary minus of the mask of the rate"""
+        species = ['OM', 'SO4', 'HS']
+        constants = {'k17': 0.5, 'Km': 0.1}
+        rates = {'R17': 'k17 * OM * SO4 / (Km + SO4)'}
+        dcdt = {'OM': '-R17', 'SO4': '-0.5*R17', 'HS': '0.5*R17'}
+        f, jac = compile_model(species, constants, rates, dcdt)
+        y = np.array([[1., 2., 0.1], [0.3, 0.05, 1.], [2., 0.5, 0.]])
+        p = np.array(list(constants.values()))
+        J = jac(0, y.ravel(), p)
+        assert J.shape == (3, 3, 3)
+        assert np.allclose(J, finite_differences(f, y, p), rtol=1e-6,
+                           atol=1e-8)
+
+    def test_several_rates(self):
+        """chain rule through several rates sharing species"""
+        species = ['O2', 'OM', 'FeOH3', 'CO2']
+        constants = {'k': 1.0, 'Km': 0.02}
+        rates = {
+            'R1': 'k * OM * O2 / (Km + O2)',
+            'R2': 'k * OM * FeOH3 / (Km + FeOH3)'
+        }
+        dcdt = {
+            'O2': '-R1',
+            'OM': '-R1 - R2',
+            'FeOH3': '-4*R2',
+            'CO2': 'R1 + R2'
+        }
+        f, jac = compile_model(species, constants, rates, dcdt)
+        y = np.array([[0.2, 1., 0.5, 0.], [0.01, 0.3, 2., 1.]])
+        p = np.array(list(constants.values()))
+        assert np.allclose(
+            jac(0, y.ravel(), p),
+            finite_differences(f, y, p),
+            rtol=1e-6,
+            atol=1e-8)
+
+    def test_rate_of_rates(self):
+        """chain rule through rates used in later rates"""
+        species = ['A', 'B', 'C']
+        constants = {'k': 2.0, 'f': 0.3}
+        rates = {
+            'R1': 'k * A * B',
+            'R2': 'f * R1 * C',
+            'R3': 'R1 + R2 - 0.5 * A'
+        }
+        dcdt = {'A': '-R1 - R3', 'B': '-R2', 'C': 'R1 - R3'}
+        f, jac = compile_model(species, constants, rates, dcdt)
+        # R3 is negative (masked) in the last cell
+        y = np.array([[1., 2., 0.5], [0.2, 0.1, 3.], [1., 0.01, 0.01]])
+        p = np.array(list(constants.values()))
+        assert np.allclose(
+            jac(0, y.ravel(), p),
+            finite_differences(f, y, p),
+            rtol=1e-6,
+            atol=1e-8)
+
+    def test_functions_of_one_cell(self):
+        """f_cell and jac_cell evaluate one cell on scalars as f and jac"""
+        species = ['O2', 'OM', 'CO2']
+        constants = {'k': 1.0, 'Km': 0.02}
+        rates = {'R1': 'k * OM * O2 / (Km + O2)'}
+        dcdt = {'O2': '-R1', 'OM': '-R1', 'CO2': 'R1'}
+        namespace = {'np': np}
+        for cells in (True, False):
+            exec(desolver.create_ode_function(
+                species, {}, constants, rates, dcdt, cells=cells), namespace)
+            exec(desolver.create_jacobian_function(
+                species, {}, constants, rates, dcdt, cells=cells), namespace)
+        p = np.array(list(constants.values()))
+        for y in ([0.2, 1., 0.], [1e-20, 0.3, 1.]):
+            y = np.array(y)
+            assert np.allclose(namespace['f_cell'](0, y, p),
+                               namespace['f'](0, y, p))
+            assert namespace['jac_cell'](0, y, p).shape == (3, 3)
+            assert np.allclose(namespace['jac_cell'](0, y, p),
+                               namespace['jac'](0, y, p)[0])
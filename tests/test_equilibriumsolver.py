@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from porousmedialab.equilibriumsolver import MassActionSystem, solve_henry_law
+
+
+class TestMassActionSystem:
+    """Newton-Raphson on mass action laws against closed-form solutions"""
+
+    def test_henry_law(self):
+        """[aq] = Hcc*[gas] with initial split between phases"""
+        Hcc = 0.8
+        gas = np.array([1., 0., 0.3, 2e-6, 0.])
+        aq = np.array([0., 1., 0.7, 5e-7, 0.])
+        system = MassActionSystem()
+        system.add_complex('aq', Hcc, {'gas': 1})
+        assert system.species == ['gas', 'aq']
+        g, a = system.solve([gas, aq])
+        g_exact, a_exact = solve_henry_law(gas + aq, Hcc)
+        assert np.allclose(g, g_exact, rtol=1e-9, atol=0)
+        assert np.allclose(a, a_exact, rtol=1e-9, atol=0)
+
+    def test_warm_start(self):
+        """second solution starts from the previous one"""
+        Hcc = 30.
+        tot = np.linspace(1e-3, 1., 4)
+        system = MassActionSystem()
+        system.add_complex('aq', Hcc, {'gas': 1})
+        system.solve([tot, np.zeros(4)])
+        g, a = system.solve([tot / 2, tot / 2], max_iter=2)
+        g_exact, a_exact = solve_henry_law(tot, Hcc)
+        assert np.allclose(g, g_exact, rtol=1e-9)
+        assert np.allclose(a, a_exact, rtol=1e-9)
+
+    def test_component_returning_after_absence(self):
+        """warm start is not used for components absent in the previous
+        solution, mass balances hold for absent, tiny and normal totals"""
+        system = MassActionSystem()
+        system.add_complex('aq', 30., {'gas': 1})
+        system.add_complex('sorbed', 5., {'aq': 1, 'sites': 1})
+        nu, _ = system.matrix()
+        sites = np.ones(3)
+        for gas in (np.zeros(3), np.full(3, 1.24e-40), np.array([1e-3, 1., 2.])):
+            conc = [gas, sites, np.zeros(3), np.zeros(3)]
+            species = np.array(system.solve(conc))
+            assert np.allclose(
+                species.T.dot(nu), np.array(conc).T.dot(nu), rtol=1e-9,
+                atol=0)
+
+    def test_failed_solution(self):
+        """cells without convergence keep concentrations and are not warm
+        started"""
+        system = MassActionSystem()
+        system.add_complex('aq', 30., {'gas': 1})
+        conc = [np.array([1., 1e-6]), np.zeros(2)]
+        with pytest.warns(RuntimeWarning):
+            g, a = system.solve(conc, max_iter=1)
+        assert np.array_equal(g, conc[0])
+        assert np.array_equal(a, conc[1])
+        assert np.all(np.isnan(system.log_totals))
+        g, a = system.solve(conc)
+        g_exact, a_exact = solve_henry_law(conc[0], 30.)
+        assert np.allclose(g, g_exact, rtol=1e-9)
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+
+import porousmedialab.desolver as desolver
+from porousmedialab.batch import Batch
+
+
+def decay(k, cache_dir):
+    """first order decay A -> B solved by LSODA"""
+    lab = Batch(1, 0.05)
+    lab.code_cache_dir = cache_dir
+    lab.add_species(name='A', init_conc=1)
+    lab.add_species(name='B', init_conc=0)
+    lab.constants['k'] = k
+    lab.rates['R'] = 'k*A'
+    lab.dcdt['A'] = '-R'
+    lab.dcdt['B'] = 'R'
+    lab.solve(verbose=False)
+    return lab
+
+
+class TestModelCache:
+    """generated model modules cached on disk"""
+
+    def test_cache_hit_with_new_constant(self, tmp_path):
+        """constants are parameters, cached module gives results of new
+        constants"""
+        cache_dir = str(tmp_path / 'models')
+        first = decay(2, cache_dir)
+        files = os.listdir(cache_dir)
+        assert len(files) == 1
+        second = decay(3, cache_dir)
+        assert os.listdir(cache_dir) == files
+        for lab, k in [(first, 2), (second, 3)]:
+            assert np.allclose(lab.A.concentration[0],
+                               np.exp(-k * lab.time), rtol=5e-2, atol=1e-3)
+        assert not np.allclose(first.A.concentration, second.A.concentration)
+
+    def test_generator_version_in_hash(self, monkeypatch):
+        """new version of code generator does not reuse cached modules"""
+        model = (['A'], {}, {'k': 1}, {'R': 'k*A'}, {'A': '-R'})
+        key = desolver.model_hash(*model)
+        monkeypatch.setattr(desolver, 'CODE_GENERATOR_VERSION',
+                            desolver.CODE_GENERATOR_VERSION + 1)
+        assert desolver.model_hash(*model) != key
+
+    def test_shared_directory_is_not_used(self, tmp_path):
+        """modules are not imported from directories writable by others"""
+        cache_dir = tmp_path / 'shared'
+        cache_dir.mkdir()
+        os.chmod(str(cache_dir), 0o777)
+        module = desolver.load_model_module(['C'], {}, {'k': 1.},
+                                            {'R': 'k*C'}, {'C': '-R'},
+                                            str(cache_dir))
+        assert os.listdir(str(cache_dir)) == []
+        assert module.f(0, np.array([2.]), np.array([1.]))[0] == -2
+
+    def test_default_cache_dir(self, tmp_path, monkeypatch):
+        """labs cache modules in per user folder of XDG_CACHE_HOME"""
+        monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+        lab = Batch(1, 0.05)
+        assert lab.code_cache_dir == os.path.join(
+            str(tmp_path), 'porousmedialab', 'models')
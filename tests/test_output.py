@@ -0,0 +1,173 @@
+import h5py
+import numpy as np
+
+import porousmedialab.saver as saver
+from porousmedialab.column import Column
+from porousmedialab.lab import LazyRates
+
+
+def reacting_column(stream=None, **kwargs):
+    """A + B -> C in a column with diffusion, kwargs of Column, results of
+    every second step are streamed in hdf5 file stream if given"""
+    col = Column(length=1, dx=0.1, tend=0.1, dt=0.01, **kwargs)
+    col.code_cache_dir = None
+    top = np.where(col.x < 0.5, 1., 0.1)
+    for name, init in (('A', top), ('B', 1 - top), ('C', 0)):
+        col.add_species(
+            theta=0.9,
+            name=name,
+            D=1e-2,
+            init_conc=init,
+            bc_top_value=0,
+            bc_top_type='flux',
+            bc_bot_value=0,
+            bc_bot_type='flux')
+    col.constants['k'] = 5.
+    col.rates['R'] = 'k * A * B'
+    col.dcdt['A'] = '-R'
+    col.dcdt['B'] = '-R'
+    col.dcdt['C'] = 'R'
+    if stream is not None:
+        col.stream_results_to_hdf5(stream, block_size=4, save_every=2)
+    col.solve(verbose=False)
+    return col
+
+
+def assert_same_concentrations(col, reference, steps=slice(None)):
+    for name in ('A', 'B', 'C'):
+        assert np.allclose(col.species[name]['concentration'],
+                           reference.species[name]['concentration'][:, steps],
+                           rtol=1e-12, atol=0)
+
+
+class TestOutputSchedule:
+    """results of a subset of time steps"""
+
+    def test_save_every(self):
+        reference = reacting_column()
+        col = reacting_column(save_every=3)
+        assert np.allclose(col.output_time, [0., 0.03, 0.06, 0.09])
+        assert col.A['concentration'].shape == (col.N, 4)
+        assert_same_concentrations(col, reference, slice(None, None, 3))
+        assert np.allclose(col.estimated_rates['R'],
+                           reference.estimated_rates['R'][:, ::3])
+        col.reconstruct_rates()
+        assert col.A['rates'].shape == (col.N, 3)
+        assert np.allclose(
+            col.A['rates'][:, 1],
+            (col.A['concentration'][:, 2] - col.A['concentration'][:, 1]) /
+            0.03)
+
+    def test_output_times(self):
+        reference = reacting_column()
+        col = reacting_column(output_times=[0.1, 0.05, 0.0701])
+        assert np.allclose(col.output_time, [0., 0.05, 0.07, 0.1])
+        assert_same_concentrations(col, reference, [0, 5, 7, 10])
+
+
+class TestHDF5Stream:
+    """results appended to hdf5 file during the run"""
+
+    def test_stream_equals_results(self, tmp_path):
+        filename = str(tmp_path / 'results.h5')
+        col = reacting_column(stream=filename)
+        assert col.output_stream is None
+        with h5py.File(filename, 'r') as f:
+            assert np.allclose(f['time'][:], col.time[::2])
+            for name in ('A', 'B', 'C'):
+                assert np.allclose(f['concentrations/' + name][:],
+                                   col.species[name]['concentration'][:, ::2],
+                                   rtol=1e-12, atol=0)
+            assert np.allclose(f['estimated_rates/R'][:],
+                               col.estimated_rates['R'][:, ::2])
+            assert f['rates/R'][()].decode() == col.rates['R']
+
+
+class TestMemmapStorage:
+    """results stored in memmap files of the scratch folder"""
+
+    def test_memmap_equals_memory(self, tmp_path):
+        reference = reacting_column()
+        col = reacting_column(storage='memmap', scratch_dir=str(tmp_path))
+        assert isinstance(col.A['concentration'].base, np.memmap)
+        assert_same_concentrations(col, reference)
+        col.reconstruct_rates()
+        assert np.allclose(col.estimated_rates['R'],
+                           reference.estimated_rates['R'])
+
+        results = saver.load_memmap_results(str(tmp_path))
+        assert np.array_equal(results['time'], col.output_time)
+        for name in ('A', 'B', 'C'):
+            assert np.array_equal(results['concentration'][name],
+                                  col.species[name]['concentration'])
+            assert np.array_equal(results['rates'][name],
+                                  col.species[name]['rates'])
+        assert np.array_equal(results['estimated_rates']['R'],
+                              col.estimated_rates['R'])
+
+
+class TestReconstructRates:
+    """rates estimated for blocks of saved time steps"""
+
+    def check_chunks(self, col):
+        col.reconstruct_rates()
+        unchunked = np.array(col.estimated_rates['R'])
+        col.reconstruct_rates(chunk_size=3)
+        assert col.rates_chunk_size == 3
+        assert np.allclose(col.estimated_rates['R'], unchunked,
+                           rtol=1e-12, atol=0)
+        # generated functions clip concentrations to 1e-16
+        assert np.allclose(
+            unchunked, 5 * col.A['concentration'] * col.B['concentration'],
+            rtol=1e-12, atol=1e-15)
+
+    def test_chunks_scipy(self):
+        self.check_chunks(reacting_column())
+
+    def test_chunks_numexpr(self):
+        self.check_chunks(reacting_column(ode_method='rk4'))
+
+
+class TestLazyRates:
+    """rates estimated on first access and cached"""
+
+    def counting_rates(self):
+        calls = []
+
+        def estimate(names, columns):
+            calls.append((tuple(names), columns))
+            rate = np.arange(12.).reshape(3, 4)
+            return {name: rate if columns is None else rate[:, columns]
+                    for name in names}
+
+        return LazyRates(['R1', 'R2'], estimate), calls
+
+    def test_estimated_on_first_access(self):
+        rates, calls = self.counting_rates()
+        assert calls == []
+        assert rates['R1'].shape == (3, 4)
+        assert rates.R1 is rates['R1']
+        assert calls == [(('R1', ), None)]
+        rates.invalidate()
+        rates['R1']
+        assert len(calls) == 2
+
+    def test_subset(self):
+        rates, calls = self.counting_rates()
+        assert np.array_equal(rates.subset('R2', slice(1, 3)),
+                              np.arange(12.).reshape(3, 4)[:, 1:3])
+        rates.subset('R2', slice(1, 3))
+        rates.subset('R2', np.array([0, 2]))
+        rates.subset('R2', np.array([0, 2]))
+        assert calls == [(('R2', ), slice(1, 3)), (('R2', ), calls[1][1])]
+        # known rate is sliced without estimation
+        rates['R2']
+        rates.subset('R2', slice(0, 2))
+        assert len(calls) == 3
+
+    def test_lab_rates(self):
+        col = reacting_column()
+        col.reconstruct_rates()
+        assert dict.__getitem__(col.estimated_rates, 'R') is None
+        assert np.allclose(col.estimated_rates.subset('R', slice(2, 5)),
+                           col.estimated_rates['R'][:, 2:5])
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+import scipy.optimize as spo
+
+from porousmedialab.phcalc import Acid, Neutral, System
+
+
+def carbonate_system(sodium):
+    """carbonate, ammonium and sodium, sodium can be an array"""
+    return System(
+        Acid(pKa=[6.35, 10.33], charge=0, conc=1e-2),
+        Acid(pKa=9.25, charge=1, conc=5e-3),
+        Neutral(charge=1, conc=sodium))
+
+
+def brentq_pH(system, sodium):
+    """pH of one composition from the exact charge balance by brentq"""
+
+    def charge_balance(pH):
+        x = 10.**(-pH) - 10.**(pH - 14)
+        for s in system.species[:2]:
+            x += s.conc * s.alpha(pH).dot(np.atleast_1d(s.charge))
+        return x + sodium
+
+    return spo.brentq(charge_balance, -2., 16., xtol=1e-15, rtol=1e-15)
+
+
+SODIUM = np.array([0., 1e-4, 5e-3, 1e-2, 2e-2, 5e-2])
+
+
+class TestNewton:
+    """bracketed Newton method against brentq"""
+
+    def test_array_of_compositions(self):
+        system = carbonate_system(SODIUM)
+        pH = system.pHsolve_newton()
+        expected = [brentq_pH(system, na) for na in SODIUM]
+        assert pH.shape == SODIUM.shape
+        assert np.allclose(pH, expected, rtol=0, atol=1e-13)
+        assert np.array_equal(system.pH, pH)
+
+    def test_one_composition(self):
+        system = carbonate_system(1e-3)
+        pH = system.pHsolve_newton(guess=3.)
+        assert np.ndim(pH) == 0
+        assert abs(pH - brentq_pH(system, 1e-3)) < 1e-13
+
+
+class TestTables:
+    """interpolated charge balance polished by the exact one"""
+
+    def test_newton(self):
+        system = carbonate_system(SODIUM)
+        system.build_tables()
+        pH = system.pHsolve_newton()
+        expected = [brentq_pH(system, na) for na in SODIUM]
+        assert np.allclose(pH, expected, rtol=0, atol=1e-13)
+
+    def test_minimization(self):
+        system = carbonate_system(1e-3)
+        system.build_tables()
+        system.pHsolve()
+        assert abs(system.pH - brentq_pH(system, 1e-3)) < 1e-10
+
+    def test_interpolation_error(self):
+        system = carbonate_system(1e-3)
+        pH = np.linspace(0., 14., 1001)
+        exact = system._diff_pos_neg(pH)
+        system.build_tables()
+        assert np.allclose(
+            system._diff_pos_neg(pH), exact, rtol=0, atol=6.5e-8 * 1.5e-2)
+
+
+class TestCompositions:
+    """arrays of compositions and titration curves"""
+
+    def test_pHsolve_of_arrays(self):
+        system = carbonate_system(SODIUM)
+        system.pHsolve()
+        expected = [brentq_pH(system, na) for na in SODIUM]
+        # Newton iterations with the tolerance 1e-5 of the minimization
+        assert np.allclose(system.pH, expected, rtol=0, atol=1e-9)
+
+    def test_titrate(self):
+        system = carbonate_system(1e-3)
+        sodium = system.species[2]
+        pH = system.titrate(sodium, SODIUM)
+        expected = [brentq_pH(system, na) for na in SODIUM]
+        assert np.allclose(pH, expected, rtol=0, atol=1e-13)
+        assert np.all(np.diff(pH) > 0)
+        assert sodium.conc == 1e-3
+
+    def test_titrant_not_in_system(self):
+        system = carbonate_system(1e-3)
+        with pytest.raises(ValueError):
+            system.titrate(Neutral(charge=1, conc=0.), SODIUM)
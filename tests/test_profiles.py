@@ -0,0 +1,73 @@
+import numpy as np
+
+from porousmedialab.lab import Profiles
+
+
+def three_species():
+    profiles = Profiles()
+    profiles['A'] = np.array([1., 2., 3.])
+    profiles['B'] = np.zeros(3)
+    profiles['C'] = np.array([7., 8., 9.])
+    return profiles
+
+
+class TestProfiles:
+    """profiles of species as rows of one block"""
+
+    def test_assignment_copies_in_block(self):
+        profiles = three_species()
+        profile = np.array([4., 5., 6.])
+        profiles['B'] = profile
+        profile[0] = -1.
+        assert profiles.block.shape == (3, 3)
+        assert np.array_equal(profiles.block[1], [4., 5., 6.])
+        assert np.array_equal(profiles.B, [4., 5., 6.])
+
+    def test_view_updates_block(self):
+        profiles = three_species()
+        profiles['A'][1] = 10.
+        profiles.C *= 2
+        assert np.array_equal(profiles.block[0], [1., 10., 3.])
+        assert np.array_equal(profiles.block[2], [14., 16., 18.])
+        profiles.block[1] = 1.
+        assert np.array_equal(profiles['B'], [1., 1., 1.])
+
+    def test_get_and_set_block(self):
+        profiles = three_species()
+        assert profiles.get_block(['A', 'B', 'C']) is profiles.block
+        part = profiles.get_block(['C', 'A'])
+        assert np.array_equal(part, [[7., 8., 9.], [1., 2., 3.]])
+        profiles.set_block(['C', 'A'], part + 1)
+        assert np.array_equal(profiles.A, [2., 3., 4.])
+        assert np.array_equal(profiles.C, [8., 9., 10.])
+        assert np.array_equal(profiles.B, [0., 0., 0.])
+
+    def test_growth_rebinds_views(self):
+        profiles = Profiles()
+        profiles['A'] = np.ones(3)
+        species = profiles.add('A', 3)
+        species['theta'] = np.full(3, 0.9)
+        profiles['B'] = np.full(3, 2.)
+        profiles.A[0] = 5.
+        species['theta'][0] = 0.5
+        assert profiles.block[0, 0] == 5.
+        assert profiles.parameters['theta'].shape == (2, 3)
+        assert profiles.parameters['theta'][0, 0] == 0.5
+
+    def test_species_parameters(self):
+        profiles = three_species()
+        species = profiles.add('B', 3)
+        species['theta'] = np.full(3, 0.9)
+        species['bc_top_value'] = 0.1
+        species['bc_top_type'] = 'dirichlet'
+        species['bc_bot_type'] = 'flux'
+        species['name'] = 'B'
+        assert np.array_equal(profiles.parameters['theta'][1], [.9, .9, .9])
+        assert np.array_equal(profiles.parameters['theta'][0], [0., 0., 0.])
+        assert profiles.parameters['bc_top_value'][1] == 0.1
+        assert profiles.parameters['bc_top_type'][1] == 1
+        assert profiles.parameters['bc_bot_type'][1] == 0
+        assert species['bc_top_type'] == 'dirichlet'
+        assert 'name' not in profiles.parameters
+        species['theta'][2] = 0.5
+        assert profiles.parameters['theta'][1, 2] == 0.5
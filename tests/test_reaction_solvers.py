@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import porousmedialab.desolver as desolver
+
+
+def decay_error(solver, dt, T=1., k=1.):
+    """error of the solution of dC/dt = -kC at time T"""
+    C = {'C': np.array([1.0])}
+    for _ in range(int(round(T / dt))):
+        C, _, _ = desolver.ode_integrate(
+            C, {'C': '-R'}, {'R': 'k*C'}, {'k': k}, dt, solver=solver)
+    return abs(C['C'][0] - np.exp(-k * T))
+
+
+def observed_order(solver, steps=(0.2, 0.1, 0.05)):
+    """orders of convergence estimated from halving of the time step"""
+    errors = np.array([decay_error(solver, dt) for dt in steps])
+    return np.log2(errors[:-1] / errors[1:])
+
+
+class TestConvergenceOrder:
+    """orders of reaction solvers on the linear decay"""
+
+    def test_implicit_euler(self):
+        assert np.allclose(observed_order('implicit'), 1, atol=0.1)
+
+    def test_bdf2(self):
+        assert np.allclose(observed_order('bdf2'), 2, atol=0.1)
+
+    def test_dopri5(self):
+        """one Dormand-Prince step per time step at these tolerances"""
+        assert np.allclose(observed_order('dopri5'), 5, atol=0.3)
+
+
+class TestNewtonConvergence:
+    """Newton iterations of the implicit solvers on a stiff quartic decay"""
+
+    def solve(self, k):
+        C, _, _ = desolver.ode_integrate(
+            {'C': np.ones(3)}, {'C': '-R'}, {'R': 'k*C**4'}, {'k': k}, 1.,
+            solver='implicit')
+        return C['C']
+
+    def test_converged(self):
+        C = self.solve(1e6)
+        assert np.allclose(C + 1e6 * C**4, 1)
+
+    def test_unconverged_warns(self):
+        with pytest.warns(RuntimeWarning, match='did not converge in 3 of 3'):
+            self.solve(1e12)
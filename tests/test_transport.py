@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from scipy.sparse import diags
+
+import porousmedialab.desolver as desolver
+from porousmedialab.column import Column
+
+
+def tridiagonal(N=6):
+    A = diags([-np.ones(N - 1), 3 * np.ones(N), -np.ones(N - 1)], [-1, 0, 1])
+    return A.tocsr(), desolver.create_banded_matrix(A)
+
+
+class TestTridiagonalSolvers:
+    """banded solvers of transport matrices"""
+
+    def test_factorization_solves_several_right_hand_sides(self):
+        A, ab = tridiagonal()
+        B = np.arange(18.).reshape(6, 3)
+        x = desolver.factorize_tridiagonal(ab)(B)
+        assert np.allclose(A.dot(x), B)
+        assert np.allclose(x[:, 0], desolver.tridiagonal_solver(ab, B[:, 0]))
+
+    def test_failed_substitution_raises(self, monkeypatch):
+        _, ab = tridiagonal()
+        solve = desolver.factorize_tridiagonal(ab)
+        monkeypatch.setattr(desolver.lapack, 'dgttrs',
+                            lambda *args: (args[-1], -6))
+        with pytest.raises(np.linalg.LinAlgError):
+            solve(np.ones(6))
+
+
+# name: (theta, D, init, bc_top_value, bc_top_type), A and B share operator,
+# C and E share another one
+SPECIES = {
+    'A': (0.9, 10., 0., 1., 'dirichlet'),
+    'B': (0.9, 10., 0.2, 0.5, 'dirichlet'),
+    'C': (0.1, 1., 1., 0.3, 'flux'),
+    'E': (0.1, 1., 0.5, 0.1, 'flux'),
+}
+
+
+def transport_column(names, transport_solver):
+    """pure transport of species, boundary conditions of B and E change in
+    the middle of simulation (species are regrouped)"""
+    col = Column(
+        length=5, dx=0.1, tend=0.2, dt=0.01, w=0.5,
+        transport_solver=transport_solver)
+    col.code_cache_dir = None
+    for name in names:
+        theta, D, init, bc_top_value, bc_top_type = SPECIES[name]
+        col.add_species(
+            theta=theta,
+            name=name,
+            D=D,
+            init_conc=init,
+            bc_top_value=bc_top_value,
+            bc_top_type=bc_top_type,
+            bc_bot_value=0,
+            bc_bot_type='flux')
+    for i in range(1, len(col.time)):
+        if i == 10:
+            if 'B' in names:
+                col.change_boundary_conditions('B', i, 0.2, 'flux', 0, 'flux')
+            if 'E' in names:
+                col.change_boundary_conditions('E', i, 2., 'dirichlet', 0.,
+                                               'flux')
+        col.integrate_one_timestep(i)
+    return col
+
+
+class TestColumnTransport:
+    """banded, factorized and grouped transport against sparse solver"""
+
+    def test_against_sparse_solver(self):
+        banded = transport_column(list(SPECIES), 'banded')
+        assert sorted(map(sorted, banded.transport_groups.values())) == [
+            ['A'], ['B'], ['C'], ['E']]
+        sparse = transport_column(list(SPECIES), 'sparse')
+        for name in SPECIES:
+            # species alone in column, not grouped
+            alone = transport_column([name], 'sparse')
+            for col in (banded, sparse):
+                assert np.allclose(
+                    col.species[name]['concentration'],
+                    alone.species[name]['concentration'],
+                    rtol=1e-12,
+                    atol=1e-12)
+
+    def test_groups_of_shared_operators(self):
+        col = transport_column(['A', 'B', 'C', 'E'], 'banded')
+        col.change_boundary_conditions('B', 20, 1., 'dirichlet', 0, 'flux')
+        col.change_boundary_conditions('E', 20, 0.1, 'flux', 0, 'flux')
+        assert sorted(map(sorted, col.transport_groups.values())) == [
+            ['A', 'B'], ['C', 'E']]
+        assert col.species['A']['AL_factor'] is col.species['B']['AL_factor']
@@ -0,0 +1,48 @@
+import numpy as np
+
+from porousmedialab.column import Column
+
+
+def oxidation_column(vectorized):
+    """degradation of organic matter by oxygen and iron oxides"""
+    col = Column(length=5, dx=0.1, tend=0.1, dt=0.01, w=0.2)
+    col.code_cache_dir = None
+    col.vectorized_reactions = vectorized
+    for name, theta, D, bc_top, bc_type in (
+            ('O2', 0.9, 40, 0.2, 'dirichlet'), ('OM', 0.1, 1, 1, 'flux'),
+            ('FeOH3', 0.1, 1, 5, 'flux'), ('CO2', 0.9, 40, 0, 'dirichlet')):
+        col.add_species(
+            theta=theta,
+            name=name,
+            D=D,
+            init_conc=0,
+            bc_top_value=bc_top,
+            bc_top_type=bc_type,
+            bc_bot_value=0,
+            bc_bot_type='flux')
+    col.constants['k'] = 5.
+    col.constants['Km'] = 0.02
+    col.rates['R1'] = 'k * OM * O2 / (Km + O2)'
+    col.rates['R2'] = 'k * OM * FeOH3 / (Km + FeOH3) * Km / (Km + O2)'
+    col.dcdt['OM'] = '-R1 - R2'
+    col.dcdt['O2'] = '-R1'
+    col.dcdt['FeOH3'] = '-4*R2'
+    col.dcdt['CO2'] = 'R1 + R2'
+    col.solve(verbose=False)
+    return col
+
+
+class TestVectorizedReactions:
+    """all cells integrated together or one by one"""
+
+    def test_vectorized_and_per_cell_agree(self):
+        vectorized = oxidation_column(True)
+        per_cell = oxidation_column(False)
+        assert vectorized.reaction_cells['integrated'] > 0
+        for name in ('O2', 'OM', 'FeOH3', 'CO2'):
+            expected = per_cell.species[name]['concentration']
+            assert np.allclose(
+                vectorized.species[name]['concentration'],
+                expected,
+                rtol=2e-2,
+                atol=1e-3 * np.abs(expected).max())
@@ -0,0 +1,101 @@
+import numpy as np
+from scipy.integrate import ode
+
+import porousmedialab.desolver as desolver
+from porousmedialab.batch import Batch
+from porousmedialab.column import Column
+
+
+def second_order_decay(warm_start):
+    """A + A -> B in a batch, A = 1/(1 + k t)"""
+    lab = Batch(2, 0.05)
+    lab.code_cache_dir = None
+    lab.warm_start_reactions = warm_start
+    lab.add_species(name='A', init_conc=1)
+    lab.add_species(name='B', init_conc=0)
+    lab.constants['k'] = 3.
+    lab.rates['R'] = 'k*A*A'
+    lab.dcdt['A'] = '-R'
+    lab.dcdt['B'] = 'R'
+    lab.solve(verbose=False)
+    return lab
+
+
+def decay_column(seed):
+    col = Column(length=2, dx=0.1, tend=0.05, dt=0.01)
+    col.code_cache_dir = None
+    col.reaction_step_seed = seed
+    for name, init in (('A', 1), ('B', 0)):
+        col.add_species(
+            theta=0.9,
+            name=name,
+            D=1,
+            init_conc=init,
+            bc_top_value=1,
+            bc_top_type='dirichlet',
+            bc_bot_value=0,
+            bc_bot_type='flux')
+    col.constants['k'] = 20.
+    col.rates['R'] = 'k*A'
+    col.dcdt['A'] = '-R'
+    col.dcdt['B'] = 'R'
+    col.solve(verbose=False)
+    return col
+
+
+class TestWarmStart:
+    """continuation and restarts of LSODA between reaction steps"""
+
+    def test_batch_continues_integration(self):
+        warm = second_order_decay(True)
+        cold = second_order_decay(False)
+        # warm solver continued over all steps, cold one restarted every step
+        assert np.isclose(warm.dynamic_functions['column_solver'].t, 2.)
+        assert np.isclose(cold.dynamic_functions['column_solver'].t, 0.05)
+        exact = 1 / (1 + 3 * warm.time)
+        for lab in (warm, cold):
+            assert np.allclose(lab.A.concentration[0], exact, rtol=2e-2)
+
+    def test_seed_after_restart(self, monkeypatch):
+        """seeded restarts use fraction of the last step size, except the
+        first step after restart_reactions"""
+        col = decay_column(0.5)
+        first_steps = []
+        integrate = desolver.ode_integrate_scipy
+
+        def record(*args, **kwargs):
+            first_steps.append(kwargs.get('first_step'))
+            return integrate(*args, **kwargs)
+
+        monkeypatch.setattr(desolver, 'ode_integrate_scipy', record)
+        col.restart_reactions()
+        col.reactions_integrate_scipy(1)
+        last_step = col.dynamic_functions['column_step']
+        col.reactions_integrate_scipy(2)
+        assert first_steps[0] is None
+        assert last_step > 0
+        assert np.isclose(first_steps[1], 0.5 * last_step)
+
+    def test_seeded_and_default_restarts(self):
+        """far from the top boundary A decays as exp(-k t) (LSODA rtol is
+        1e-2)"""
+        for seed in (None, 0.5):
+            col = decay_column(seed)
+            assert np.allclose(
+                col.A.concentration[-1], np.exp(-20. * col.time), rtol=5e-2)
+
+
+class TestStepSizeOfOtherIntegrators:
+    """step sizes are read and written only for LSODA"""
+
+    def test_vode(self):
+        solver = ode(lambda t, y: -y).set_integrator('vode')
+        y = desolver.ode_integrate_scipy(
+            solver, np.ones(2), 0.1, first_step=0.01)
+        assert np.allclose(y, np.exp(-0.1), rtol=1e-4)
+        assert desolver.next_step_size(solver) == 0.0
+
+    def test_lsoda(self):
+        solver = desolver.create_solver(lambda t, y: -y)
+        desolver.ode_integrate_scipy(solver, np.ones(2), 0.1)
+        assert desolver.next_step_size(solver) > 0